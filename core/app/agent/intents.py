@@ -0,0 +1,187 @@
+import os
+import re
+from collections import OrderedDict, deque
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from ..llm.response_cache import normalize
+from ..metrics import intent_matches_total, plan_cache_total
+
+
+class _Automaton:
+    # Aho-Corasick over characters: one pass finds every keyword occurrence, however many are loaded
+    def __init__(self) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+
+    def add(self, phrase: str, payload: Any) -> None:
+        node = 0
+        for ch in phrase:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(phrase), payload))
+
+    def build(self) -> None:
+        # BFS from the root's children (whose fail link is the root) to set fail links and merge outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text: str) -> Iterator[Tuple[int, Any]]:
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, payload in self._out[node]:
+                yield i - length + 1, payload
+
+
+class IntentMatcher:
+    def __init__(
+        self,
+        library: Optional[Dict[str, Any]],
+        registry: Optional[Dict[str, Dict[str, Any]]],
+        cache_size: int = int(os.getenv("PLAN_CACHE_SIZE", "256")),
+    ) -> None:
+        library = library or {}
+        self._registry = registry or {}
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        self._order: Dict[str, int] = {}
+        self._cache: "OrderedDict[Tuple[str, FrozenSet[str], FrozenSet[str]], List[Dict[str, Any]]]" = OrderedDict()
+        self._cache_size = cache_size
+
+        # keywords, room aliases and device ids share one automaton; regex patterns share one alternation
+        self._automaton = _Automaton()
+        patterns: List[str] = []
+        self._pattern_owner: Dict[str, str] = {}
+        for n, tpl in enumerate(library.get("templates", [])):
+            tid = tpl["id"]
+            self._templates[tid] = tpl
+            self._order[tid] = n
+            for words in (tpl.get("keywords") or {}).values():
+                for w in words:
+                    if normalize(w):
+                        self._automaton.add(normalize(w), ("template", tid))
+            for pat in tpl.get("patterns", []):
+                group = f"p{len(patterns)}"
+                patterns.append(rf"(?P<{group}>\b(?:{pat}))")
+                self._pattern_owner[group] = tid
+        rooms = {room: list(aliases) for room, aliases in (library.get("rooms") or {}).items()}
+        for meta in self._registry.values():
+            if meta.get("room"):
+                rooms.setdefault(meta["room"], []).append(meta["room"])
+        for room, aliases in rooms.items():
+            for alias in aliases:
+                if normalize(alias):
+                    self._automaton.add(normalize(alias), ("room", room))
+        for dev_id in self._registry:
+            self._automaton.add(dev_id.lower(), ("device", dev_id))
+        self._automaton.build()
+        self._regex = re.compile("|".join(patterns)) if patterns else None
+
+    def match(self, query: str) -> Optional[Tuple[str, FrozenSet[str], FrozenSet[str]]]:
+        # normalized intent: (template id, rooms, devices)
+        text = normalize(query)
+        hits: Dict[str, int] = {}
+        rooms: Set[str] = set()
+        devices: Set[str] = set()
+        for start, (kind, value) in self._automaton.scan(text):
+            if start > 0 and text[start - 1] != " ":
+                # keywords are word stems: they must start a word ("включи" is not in "выключи")
+                continue
+            if kind == "template":
+                hits[value] = hits.get(value, 0) + 1
+            elif kind == "room":
+                rooms.add(value)
+            else:
+                devices.add(value)
+        if self._regex is not None:
+            for m in self._regex.finditer(text):
+                tid = self._pattern_owner[m.lastgroup]
+                hits[tid] = hits.get(tid, 0) + 1
+        candidates = []
+        for tid, count in hits.items():
+            tpl = self._templates[tid]
+            slots = set(tpl.get("slots", []))
+            mentioned = {"room": bool(rooms), "device": bool(devices)}
+            if any(not mentioned[r] for r in tpl.get("requires", [])):
+                continue
+            candidates.append((-float(tpl.get("priority", 0)), -count, self._order[tid], tid, slots))
+        if not candidates:
+            return None
+        _, _, _, tid, slots = min(candidates)
+        return (
+            tid,
+            frozenset(rooms) if "room" in slots else frozenset(),
+            frozenset(devices) if "device" in slots else frozenset(),
+        )
+
+    def plan(self, query: str) -> List[Dict[str, Any]]:
+        intent = self.match(query)
+        if intent is None:
+            plan_cache_total.labels(result="no_match").inc()
+            return []
+        intent_matches_total.labels(template=intent[0]).inc()
+        steps = self._cache.get(intent)
+        if steps is not None:
+            self._cache.move_to_end(intent)
+            plan_cache_total.labels(result="hit").inc()
+        else:
+            plan_cache_total.labels(result="miss").inc()
+            steps = self._expand(*intent)
+            self._cache[intent] = steps
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        # callers get their own copies; the cached plan stays pristine
+        return [{**s, "args": dict(s.get("args", {}))} for s in steps]
+
+    def _targets(self, selector: Dict[str, Any], rooms: FrozenSet[str], devices: FrozenSet[str]) -> List[str]:
+        ids = [
+            d for d, m in self._registry.items()
+            if m.get("type") == selector.get("type") and (not selector.get("room") or m.get("room") == selector["room"])
+        ]
+        if devices:
+            ids = [d for d in ids if d in devices]
+        elif rooms:
+            ids = [d for d in ids if self._registry[d].get("room") in rooms]
+        return sorted(ids)
+
+    def _expand(self, tid: str, rooms: FrozenSet[str], devices: FrozenSet[str]) -> List[Dict[str, Any]]:
+        # for_each steps fan out over registry devices; an `after` on a fanned-out id waits for every copy
+        steps: List[Dict[str, Any]] = []
+        groups: Dict[str, List[str]] = {}
+        for step in self._templates[tid]["steps"]:
+            base = {k: v for k, v in step.items() if k != "for_each"}
+            if "for_each" not in step:
+                steps.append(base)
+                if step.get("id"):
+                    groups[step["id"]] = [step["id"]]
+                continue
+            members = []
+            for n, dev_id in enumerate(self._targets(step["for_each"], rooms, devices)):
+                s = {**base, "args": {**step.get("args", {}), "device_id": dev_id}}
+                if step.get("id"):
+                    s["id"] = f"{step['id']}.{n}"
+                    members.append(s["id"])
+                steps.append(s)
+            if step.get("id"):
+                groups[step["id"]] = members
+        for s in steps:
+            if "after" in s:
+                after = [s["after"]] if isinstance(s["after"], str) else s["after"]
+                s["after"] = [m for a in after for m in groups.get(a, [a])]
+        return steps
@@ -1,64 +1,186 @@
+import asyncio
+import os
 import time
-from typing import Any, Dict, List
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 
 from ..tools.smarthome import SmartHomeTools
+from .intents import IntentMatcher
+from ..security.limiter import RateLimited, limiter
 from ..events import bus
-from ..metrics import agent_step_latency_ms, critical_actions_total
+from ..metrics import agent_step_latency_ms, critical_actions_total, agent_plan_steps_total, agent_plan_latency_ms
+from ..tracing import current_trace_id, tracer
 
 
 CRITICAL_TOOLS = {"lock_door", "arm_security"}
+# outcomes that let dependent steps go ahead
+PROCEED = {"ok", "dry_run"}
+
+
+def _plan_graph(steps: List[Dict[str, Any]]) -> Tuple[List[Set[int]], List[List[int]]]:
+    # optional `id` / `after: id | [ids]` per step; steps without `after` have no ordering constraint
+    ids: Dict[str, int] = {}
+    for i, step in enumerate(steps):
+        if step.get("id") is not None:
+            sid = str(step["id"])
+            if sid in ids:
+                raise ValueError(f"Duplicate step id: {sid}")
+            ids[sid] = i
+    deps: List[Set[int]] = []
+    for i, step in enumerate(steps):
+        after = step.get("after") or []
+        if isinstance(after, str):
+            after = [after]
+        d: Set[int] = set()
+        for a in after:
+            if str(a) not in ids:
+                raise ValueError(f"Step {i} depends on unknown step: {a}")
+            d.add(ids[str(a)])
+        deps.append(d)
+    dependents: List[List[int]] = [[] for _ in steps]
+    for i, d in enumerate(deps):
+        for j in d:
+            dependents[j].append(i)
+    # Kahn pass: every step must be reachable, otherwise `after` forms a cycle
+    waiting = [len(d) for d in deps]
+    queue = deque(i for i, n in enumerate(waiting) if n == 0)
+    seen = 0
+    while queue:
+        i = queue.popleft()
+        seen += 1
+        for j in dependents[i]:
+            waiting[j] -= 1
+            if waiting[j] == 0:
+                queue.append(j)
+    if seen != len(steps):
+        raise ValueError("Plan dependencies form a cycle")
+    return deps, dependents
 
 
 class Supervisor:
-    def __init__(self, tools: SmartHomeTools) -> None:
+    def __init__(
+        self,
+        tools: SmartHomeTools,
+        plans: Optional[Dict[str, Any]] = None,
+        devices: Optional[Dict[str, Dict[str, Any]]] = None,
+        max_parallel: int = int(os.getenv("PLAN_MAX_PARALLEL", "8")),
+        deadline_s: float = float(os.getenv("PLAN_DEADLINE_S", "30")),
+    ) -> None:
         self._tools = tools
-        self._critical_window = []  # list of timestamps of critical actions
-
-    def _allow_critical(self) -> bool:
-        now = time.time()
-        # keep only last 60 seconds
-        self._critical_window = [t for t in self._critical_window if now - t < 60]
-        return len(self._critical_window) < 3
-
-    async def execute_plan(self, steps: List[Dict[str, Any]], dry_run: bool = False, require_confirm: bool = False) -> List[Dict[str, Any]]:
-        results: List[Dict[str, Any]] = []
-        for step in steps:
-            tool = step.get("tool")
-            args = step.get("args", {})
-            start = time.time()
-            if dry_run:
-                results.append({"tool": tool, "args": args, "status": "dry_run"})
-                continue
-            if require_confirm and tool in CRITICAL_TOOLS:
-                results.append({"tool": tool, "args": args, "status": "needs_confirm"})
-                continue
-            if tool in CRITICAL_TOOLS and not self._allow_critical():
-                results.append({"tool": tool, "args": args, "status": "rate_limited"})
-                continue
-            try:
+        # template library from /configs/plans.json, compiled once
+        self._intents = IntentMatcher(plans, devices)
+        self._max_parallel = max(1, max_parallel)
+        self._deadline_s = deadline_s
+
+    async def execute_plan(self, steps: List[Dict[str, Any]], dry_run: bool = False, require_confirm: bool = False, deadline_s: Optional[float] = None) -> List[Dict[str, Any]]:
+        results = [r async for r in self.iter_plan(steps, dry_run=dry_run, require_confirm=require_confirm, deadline_s=deadline_s)]
+        return sorted(results, key=lambda r: r["index"])
+
+    async def iter_plan(self, steps: List[Dict[str, Any]], dry_run: bool = False, require_confirm: bool = False, deadline_s: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        # independent steps run concurrently (up to max_parallel); results are yielded as they complete
+        deps, dependents = _plan_graph(steps)
+        waiting = [len(d) for d in deps]
+        ready = deque(i for i, n in enumerate(waiting) if n == 0)
+        resolved: Set[int] = set()
+        running: Dict[asyncio.Task, int] = {}
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        deadline = t0 + (self._deadline_s if deadline_s is None else deadline_s)
+
+        def finish(res: Dict[str, Any]) -> Dict[str, Any]:
+            resolved.add(res["index"])
+            agent_plan_steps_total.labels(status=res["status"]).inc()
+            return res
+
+        def blocked(i: int, by: int) -> List[Dict[str, Any]]:
+            # a failed/held step takes everything ordered after it down with it
+            out = []
+            stack = [(i, by)]
+            while stack:
+                k, b = stack.pop()
+                if k in resolved:
+                    continue
+                out.append(finish(self._result(k, steps[k], "skipped", blocked_by=steps[b].get("id", b))))
+                stack.extend((j, k) for j in dependents[k])
+            return out
+
+        try:
+            while ready or running:
+                while ready and len(running) < self._max_parallel:
+                    i = ready.popleft()
+                    running[asyncio.create_task(self._run_step(i, steps[i], dry_run, require_confirm))] = i
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                finished, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not finished:
+                    break
+                for task in finished:
+                    i = running.pop(task)
+                    res = finish(task.result())
+                    yield res
+                    for j in dependents[i]:
+                        if j in resolved:
+                            continue
+                        if res["status"] in PROCEED:
+                            waiting[j] -= 1
+                            if waiting[j] == 0:
+                                ready.append(j)
+                        else:
+                            for r in blocked(j, i):
+                                yield r
+            # deadline: whatever is still running or never started is reported as timed out
+            for task in running:
+                task.cancel()
+            for i in range(len(steps)):
+                if i not in resolved:
+                    yield finish(self._result(i, steps[i], "timeout"))
+        finally:
+            for task in running:
+                task.cancel()
+            agent_plan_latency_ms.observe((loop.time() - t0) * 1000)
+
+    def _result(self, index: int, step: Dict[str, Any], status: str, **extra: Any) -> Dict[str, Any]:
+        res = {"index": index, "tool": step.get("tool"), "args": step.get("args", {}), "status": status, **extra}
+        if step.get("id") is not None:
+            res["id"] = step["id"]
+        return res
+
+    async def _run_step(self, index: int, step: Dict[str, Any], dry_run: bool, require_confirm: bool) -> Dict[str, Any]:
+        tool = step.get("tool")
+        args = step.get("args", {})
+        start = time.time()
+        if dry_run:
+            return self._result(index, step, "dry_run")
+        if require_confirm and tool in CRITICAL_TOOLS:
+            return self._result(index, step, "needs_confirm")
+        critical = tool in CRITICAL_TOOLS
+        # the token is taken before awaiting so parallel steps cannot overshoot the critical budget
+        if critical and limiter.take("critical", "supervisor"):
+            return self._result(index, step, "rate_limited")
+        try:
+            with tracer.span("plan.step", tool=tool, index=index):
                 out = await self._invoke(tool, args)
-                latency_ms = (time.time() - start) * 1000
-                agent_step_latency_ms.labels(tool=tool).observe(latency_ms)
-                if tool in CRITICAL_TOOLS:
-                    self._critical_window.append(time.time())
-                    critical_actions_total.labels(tool=tool).inc()
-                step = {"tool": tool, "args": args, "status": "ok", "lat_ms": round(latency_ms, 2), "result": out}
-                results.append(step)
-                await bus.publish({"type": "agent_step", **step, "ts": time.time()})
-            except Exception as e:
-                results.append({"tool": tool, "args": args, "status": "err", "error": str(e)})
-                break
-        return results
+        except asyncio.CancelledError:
+            if critical:
+                limiter.refund("critical", "supervisor")
+            raise
+        except Exception as e:
+            if critical:
+                limiter.refund("critical", "supervisor")
+            if isinstance(e, RateLimited):
+                return self._result(index, step, "rate_limited", retry_after=round(e.retry_after, 2))
+            return self._result(index, step, "err", error=str(e))
+        latency_ms = (time.time() - start) * 1000
+        agent_step_latency_ms.labels(tool=tool).observe(latency_ms)
+        if tool in CRITICAL_TOOLS:
+            critical_actions_total.labels(tool=tool).inc()
+        res = self._result(index, step, "ok", lat_ms=round(latency_ms, 2), result=out)
+        await bus.publish({"type": "agent_step", **res, "trace_id": current_trace_id(), "ts": time.time()})
+        return res
 
     async def plan_from_intent(self, intent: str) -> List[Dict[str, Any]]:
-        # Minimal heuristic plan for "prepare house for night"
-        if "ноч" in intent or "sleep" in intent or "night" in intent:
-            return [
-                {"tool": "control_light", "args": {"device_id": "light_living_main", "state": True, "brightness": 20}},
-                {"tool": "arm_security", "args": {"mode": "night"}},
-            ]
-        # default empty
-        return []
+        return self._intents.plan(intent)
 
     async def _invoke(self, tool: str, args: Dict[str, Any]) -> Any:
         if tool == "control_light":
@@ -5,6 +5,10 @@ import yaml
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
+from .llm.model_router import model_router
+from .llm.clients import clients
+from .llm.response_cache import response_cache
+
 
 router = APIRouter(prefix="/router", tags=["router"])
 
@@ -17,6 +21,12 @@ def backends() -> Any:
     return _current_router_cfg.get("backends", [])
 
 
+@router.get("/stats")
+def stats() -> Any:
+    # live routing view: per-backend EWMA TTFT, error rate, circuit state
+    return {**model_router.stats(), "clients": clients.stats(), "response_cache": response_cache.stats()}
+
+
 class ReloadResp(BaseModel):
     status: str
     backends: list
@@ -31,6 +41,7 @@ def reload_router() -> Any:
         if not isinstance(cfg, dict) or "backends" not in cfg or not isinstance(cfg["backends"], list):
             raise ValueError("Invalid router config: missing backends")
         _current_router_cfg = cfg
+        model_router.configure(cfg)
         return {"status": "ok", "backends": cfg["backends"]}
     except Exception as e:
         raise HTTPException(400, f"router reload failed: {e}")
@@ -1,17 +1,56 @@
+import asyncio
 import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from .audit_index import SegmentIndex, compress_blocks, index_path, load_index, query_segment, save_index
+from .tracing import current_trace_id
+from .metrics import audit_entries_total, audit_backpressure_total, audit_flush_latency_ms, audit_queue_depth
+
+
+FSYNC_POLICIES = ("always", "interval", "never")
 
 
 class AuditLogger:
-    def __init__(self, log_dir: str = "/app/logs") -> None:
+    def __init__(
+        self,
+        log_dir: str = "/app/logs",
+        flush_interval_s: float = float(os.getenv("AUDIT_FLUSH_MS", "200")) / 1000.0,
+        fsync: str = os.getenv("AUDIT_FSYNC", "interval"),
+        fsync_interval_s: float = float(os.getenv("AUDIT_FSYNC_MS", "1000")) / 1000.0,
+        max_bytes: int = int(os.getenv("AUDIT_MAX_BYTES", str(64 * 1024 * 1024))),
+        rotate_interval_s: float = float(os.getenv("AUDIT_ROTATE_S", "86400")),
+        max_segments: int = int(os.getenv("AUDIT_MAX_SEGMENTS", "30")),
+        queue_size: int = int(os.getenv("AUDIT_QUEUE_SIZE", "10000")),
+    ) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid audit fsync policy: {fsync}")
         self._path = Path(log_dir)
         self._path.mkdir(parents=True, exist_ok=True)
         self._file = self._path / "audit.log"
+        self._flush_interval_s = flush_interval_s
+        self._fsync = fsync
+        self._fsync_interval_s = fsync_interval_s
+        self._max_bytes = max_bytes
+        self._rotate_interval_s = rotate_interval_s
+        self._max_segments = max_segments
+        self._queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # file state below is touched from worker threads (writer and queries), guarded by _io_lock
+        self._io_lock = threading.Lock()
+        self._fh: Optional[BinaryIO] = None
+        self._segment_started = 0.0
+        self._last_fsync = 0.0
+        self._active_idx: Optional[SegmentIndex] = None
+        self._sealed_idx: Dict[Path, SegmentIndex] = {}
+        # rotated segments still being compressed; queried as plain text until their .gz exists
+        self._sealing: Dict[Path, SegmentIndex] = {}
 
     def _hash_args(self, args: Any) -> str:
         try:
@@ -20,7 +59,28 @@ class AuditLogger:
             blob = repr(args).encode("utf-8")
         return hashlib.sha256(blob).hexdigest()[:16]
 
-    def log(self, actor: str, role: str, action: str, args: Any, result: Any, latency_ms: float, trace_id: str | None = None) -> None:
+    async def start(self) -> None:
+        if self._task is None:
+            await asyncio.to_thread(self._recover)
+            self._queue = asyncio.Queue(maxsize=self._queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._queue is not None:
+            rest = self._drain()
+            if rest:
+                await asyncio.to_thread(self._write_batch, rest)
+            self._queue = None
+        await asyncio.to_thread(self._close)
+
+    async def log(self, actor: str, role: str, action: str, args: Any, result: Any, latency_ms: float, trace_id: str | None = None) -> None:
         entry: Dict[str, Any] = {
             "timestamp": time.time(),
             "actor": actor,
@@ -29,16 +89,209 @@ class AuditLogger:
             "args_hash": self._hash_args(args),
             "result": result,
             "latency_ms": round(latency_ms, 2),
-            "trace_id": trace_id or str(uuid.uuid4()),
+            "trace_id": trace_id or current_trace_id() or str(uuid.uuid4()),
         }
-        with self._file.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
-        # Publish to UI bus best-effort
-        try:
-            from .events import bus  # local import to avoid cycle at import time
-            import asyncio
-            asyncio.create_task(bus.publish({"type": "audit_log", **entry}))
-        except Exception:
-            pass
+        audit_entries_total.inc()
+        if self._queue is None:
+            # writer not running (startup/shutdown, scripts): write through
+            self._write_batch([entry])
+            return
+        if self._queue.full():
+            # backpressure: the caller waits for the writer instead of growing memory without bound
+            audit_backpressure_total.inc()
+        await self._queue.put(entry)
+        audit_queue_depth.set(self._queue.qsize())
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        if self._queue is None:
+            return batch
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return batch
+
+    async def _run(self) -> None:
+        from .events import bus  # local import to avoid cycle at import time
+        assert self._queue is not None
+        while True:
+            first = await self._queue.get()
+            # let entries accumulate for one flush interval, then write them in one go
+            try:
+                await asyncio.sleep(self._flush_interval_s)
+            except asyncio.CancelledError:
+                # `first` is already off the queue, so stop()'s drain would not see it
+                await asyncio.to_thread(self._write_batch, [first] + self._drain())
+                raise
+            batch = [first] + self._drain()
+            audit_queue_depth.set(self._queue.qsize())
+            start = time.time()
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception:
+                # never let disk trouble kill the writer; the entries still reach the bus
+                pass
+            audit_flush_latency_ms.observe((time.time() - start) * 1000)
+            for entry in batch:
+                try:
+                    await bus.publish({"type": "audit_log", **entry})
+                except Exception:
+                    pass
+
+    def _active_index(self) -> SegmentIndex:
+        if self._active_idx is None:
+            # one scan of a pre-existing active segment after restart; afterwards it is built while writing
+            if self._file.exists():
+                with self._file.open("rb") as f:
+                    self._active_idx = SegmentIndex.scan(f)
+            else:
+                self._active_idx = SegmentIndex()
+        return self._active_idx
+
+    def _open(self) -> BinaryIO:
+        if self._fh is None:
+            self._fh = self._file.open("ab")
+            self._fh.seek(0, os.SEEK_END)
+            self._segment_started = time.time()
+        return self._fh
+
+    def _close(self) -> None:
+        with self._io_lock:
+            self._close_locked()
+
+    def _close_locked(self) -> None:
+        if self._fh is not None:
+            self._fh.flush()
+            if self._fsync != "never":
+                os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
+
+    def _recover(self) -> None:
+        # segments renamed by a rotation that never got to compress them (crash, kill)
+        for sealed in sorted(self._path.glob("audit-*.log")):
+            with sealed.open("rb") as f:
+                self._sealing[sealed] = SegmentIndex.scan(f)
+            self._seal(sealed)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        sealed = self._append(batch)
+        if sealed is not None:
+            # compression runs outside _io_lock, so queries (and a write-through log()) are not stalled by it
+            self._seal(sealed)
+
+    def _append(self, batch: List[Dict[str, Any]]) -> Optional[Path]:
+        with self._io_lock:
+            idx = self._active_index()
+            fh = self._open()
+            offset = fh.tell()
+            lines = []
+            for e in batch:
+                line = json.dumps(e, separators=(",", ":")).encode("utf-8") + b"\n"
+                idx.add(offset, e)
+                offset += len(line)
+                lines.append(line)
+            fh.write(b"".join(lines))
+            fh.flush()
+            now = time.time()
+            if self._fsync == "always" or (self._fsync == "interval" and now - self._last_fsync >= self._fsync_interval_s):
+                os.fsync(fh.fileno())
+                self._last_fsync = now
+            if fh.tell() >= self._max_bytes or now - self._segment_started >= self._rotate_interval_s:
+                return self._rotate()
+            return None
+
+    def _rotate(self) -> Optional[Path]:
+        # under _io_lock: only the rename happens here, _seal compresses afterwards
+        self._close_locked()
+        if not self._file.exists() or self._file.stat().st_size == 0:
+            return None
+        idx = self._active_index()
+        # epoch-ms names sort chronologically; bump on collision within the same millisecond
+        stamp = int(time.time() * 1000)
+        while (self._path / f"audit-{stamp}.log.gz").exists() or (self._path / f"audit-{stamp}.log").exists():
+            stamp += 1
+        sealed = self._path / f"audit-{stamp}.log"
+        self._file.rename(sealed)
+        self._sealing[sealed] = idx
+        self._active_idx = SegmentIndex()
+        return sealed
+
+    def _seal(self, sealed: Path) -> None:
+        idx = self._sealing[sealed]
+        gz = sealed.with_name(sealed.name + ".gz")
+        # compressed under a name queries do not glob, indexed, then renamed into place
+        part = sealed.with_name(sealed.name + ".gz.part")
+        compress_blocks(sealed, part, idx)
+        save_index(gz, idx)
+        with self._io_lock:
+            part.replace(gz)
+            self._sealed_idx[gz] = idx
+            del self._sealing[sealed]
+            segments = sorted(self._path.glob("audit-*.log.gz"))
+            for old in segments[: max(0, len(segments) - self._max_segments)]:
+                old.unlink()
+                index_path(old).unlink(missing_ok=True)
+                self._sealed_idx.pop(old, None)
+        sealed.unlink()
+
+    async def query(
+        self,
+        trace_id: Optional[str] = None,
+        action: Optional[str] = None,
+        role: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self._query, trace_id, action, role, since, until, limit)
 
+    def _query(
+        self,
+        trace_id: Optional[str],
+        action: Optional[str],
+        role: Optional[str],
+        since: Optional[float],
+        until: Optional[float],
+        limit: int,
+    ) -> List[Dict[str, Any]]:
+        filters = dict(trace_id=trace_id, action=action, role=role, since=since, until=until)
+        out: List[Dict[str, Any]] = []
+        active = None
+        with self._io_lock:
+            # only a snapshot is taken under the lock. The active segment is opened here because rotation
+            # may rename it, and reads stop at its current size because the writer keeps appending
+            if self._file.exists():
+                fh = self._file.open("rb")
+                active = (fh, self._active_index(), os.fstat(fh.fileno()).st_size)
+            sealing = sorted(self._sealing.items(), reverse=True)
+            segments = sorted(self._path.glob("audit-*.log.gz"), reverse=True)
+        if active is not None:
+            fh, idx, size = active
+            out += query_segment(self._file, idx, False, limit=limit, size=size, fh=fh, **filters)
+        for seg, idx in sealing:
+            if len(out) >= limit:
+                break
+            try:
+                out += query_segment(seg, idx, False, limit=limit - len(out), **filters)
+            except (FileNotFoundError, OSError):
+                # compressed and removed meanwhile; by then its .gz is in place
+                segments.insert(0, seg.with_name(seg.name + ".gz"))
+        for seg in segments:
+            if len(out) >= limit:
+                break
+            try:
+                idx = self._sealed_index(seg)
+                out += query_segment(seg, idx, True, limit=limit - len(out), **filters)
+            except (FileNotFoundError, OSError):
+                # pruned while we were reading
+                continue
+        return out[:limit]
 
+    def _sealed_index(self, seg: Path) -> SegmentIndex:
+        idx = self._sealed_idx.get(seg)
+        if idx is None:
+            idx = load_index(seg)
+            self._sealed_idx[seg] = idx
+        return idx
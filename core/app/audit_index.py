@@ -0,0 +1,294 @@
+import bisect
+import gzip
+import json
+from collections import deque
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# time bucket width for range queries; offsets are monotonic in time within a segment
+BUCKET_S = 60
+# uncompressed bytes per independent gzip member in sealed segments
+BLOCK_BYTES = 64 * 1024
+
+
+class SegmentIndex:
+    def __init__(self) -> None:
+        self.count = 0
+        self.t_min: Optional[float] = None
+        self.t_max: Optional[float] = None
+        # active segments grow a dict; sealed ones are loaded as sorted parallel arrays for bisect
+        self._trace: Dict[str, List[int]] = {}
+        self._trace_ids: List[str] = []
+        self._trace_offs: List[int] = []
+        self.actions: Dict[str, List[int]] = {}
+        self.roles: Dict[str, List[int]] = {}
+        self.buckets: List[Tuple[int, int]] = []  # (bucket_start_ts, first_offset)
+        self.blocks: List[Tuple[int, int]] = [(0, 0)]  # (uncompressed_offset, compressed_offset)
+
+    def add(self, offset: int, entry: Dict[str, Any]) -> None:
+        ts = float(entry.get("timestamp") or 0.0)
+        self.count += 1
+        self.t_min = ts if self.t_min is None else min(self.t_min, ts)
+        self.t_max = ts if self.t_max is None else max(self.t_max, ts)
+        tid = entry.get("trace_id")
+        if tid:
+            self._trace.setdefault(str(tid), []).append(offset)
+        self.actions.setdefault(str(entry.get("action")), []).append(offset)
+        self.roles.setdefault(str(entry.get("role")), []).append(offset)
+        bucket = int(ts // BUCKET_S) * BUCKET_S
+        if not self.buckets or bucket > self.buckets[-1][0]:
+            self.buckets.append((bucket, offset))
+
+    def trace_offsets(self, trace_id: str) -> List[int]:
+        if self._trace:
+            return list(self._trace.get(trace_id, []))
+        lo = bisect.bisect_left(self._trace_ids, trace_id)
+        hi = bisect.bisect_right(self._trace_ids, trace_id, lo)
+        return self._trace_offs[lo:hi]
+
+    def offset_range(self, since: Optional[float], until: Optional[float]) -> Tuple[int, Optional[int]]:
+        # [start, end) byte range that can contain entries in [since, until)
+        starts = [b[0] for b in self.buckets]
+        start = 0
+        end: Optional[int] = None
+        if since is not None and self.buckets:
+            i = bisect.bisect_right(starts, since) - 1
+            start = self.buckets[max(i, 0)][1]
+        if until is not None and self.buckets:
+            j = bisect.bisect_right(starts, until)
+            if j < len(self.buckets):
+                end = self.buckets[j][1]
+        return start, end
+
+    def overlaps(self, since: Optional[float], until: Optional[float]) -> bool:
+        if self.count == 0:
+            return False
+        if since is not None and self.t_max is not None and self.t_max < since:
+            return False
+        if until is not None and self.t_min is not None and self.t_min >= until:
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        pairs = sorted((tid, off) for tid, offs in self._trace.items() for off in offs) if self._trace else list(zip(self._trace_ids, self._trace_offs))
+        return {
+            "version": 1,
+            "count": self.count,
+            "t_min": self.t_min,
+            "t_max": self.t_max,
+            "trace_ids": [p[0] for p in pairs],
+            "trace_offs": [p[1] for p in pairs],
+            "actions": self.actions,
+            "roles": self.roles,
+            "buckets": self.buckets,
+            "blocks": self.blocks,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SegmentIndex":
+        idx = cls()
+        idx.count = int(data.get("count", 0))
+        idx.t_min = data.get("t_min")
+        idx.t_max = data.get("t_max")
+        idx._trace_ids = list(data.get("trace_ids", []))
+        idx._trace_offs = [int(o) for o in data.get("trace_offs", [])]
+        idx.actions = {k: list(v) for k, v in (data.get("actions") or {}).items()}
+        idx.roles = {k: list(v) for k, v in (data.get("roles") or {}).items()}
+        idx.buckets = [(int(b), int(o)) for b, o in data.get("buckets", [])]
+        idx.blocks = [(int(u), int(c)) for u, c in data.get("blocks", [[0, 0]])]
+        return idx
+
+    @classmethod
+    def scan(cls, lines: Iterable[bytes]) -> "SegmentIndex":
+        idx = cls()
+        offset = 0
+        for line in lines:
+            try:
+                idx.add(offset, json.loads(line))
+            except Exception:
+                pass
+            offset += len(line)
+        return idx
+
+
+def index_path(segment: Path) -> Path:
+    return segment.with_name(segment.name + ".idx")
+
+
+def save_index(segment: Path, idx: SegmentIndex) -> None:
+    tmp = index_path(segment).with_suffix(".tmp")
+    tmp.write_text(json.dumps(idx.to_dict(), separators=(",", ":")), encoding="utf-8")
+    tmp.replace(index_path(segment))
+
+
+def load_index(segment: Path) -> SegmentIndex:
+    path = index_path(segment)
+    if path.exists():
+        return SegmentIndex.from_dict(json.loads(path.read_text(encoding="utf-8")))
+    # segment sealed before indexing existed: one scan, a single block, then persisted
+    with gzip.open(segment, "rb") as f:
+        idx = SegmentIndex.scan(f)
+    save_index(segment, idx)
+    return idx
+
+
+def compress_blocks(src: Path, dst: Path, idx: SegmentIndex) -> None:
+    # independent gzip members let a reader inflate just the block holding an offset;
+    # the result is still a valid multi-member .gz for zcat/gzip.open
+    blocks: List[Tuple[int, int]] = []
+    u_off = 0
+    with src.open("rb") as fin, dst.open("wb") as fout:
+        chunk: List[bytes] = []
+        size = 0
+
+        def flush() -> None:
+            nonlocal size
+            if chunk:
+                blocks.append((u_off - size, fout.tell()))
+                fout.write(gzip.compress(b"".join(chunk)))
+                chunk.clear()
+                size = 0
+
+        for line in fin:
+            chunk.append(line)
+            size += len(line)
+            u_off += len(line)
+            if size >= BLOCK_BYTES:
+                flush()
+        flush()
+    idx.blocks = blocks or [(0, 0)]
+
+
+class BlockReader:
+    def __init__(self, path: Path, blocks: List[Tuple[int, int]], compressed: bool, fh: Optional[BinaryIO] = None) -> None:
+        self._path = path
+        self._blocks = blocks
+        self._starts = [b[0] for b in blocks]
+        self._compressed = compressed
+        self._cache: Dict[int, bytes] = {}
+        self._fh = fh if fh is not None else path.open("rb")
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def _block(self, i: int) -> bytes:
+        if i not in self._cache:
+            c_start = self._blocks[i][1]
+            self._fh.seek(c_start)
+            if i + 1 < len(self._blocks):
+                raw = self._fh.read(self._blocks[i + 1][1] - c_start)
+            else:
+                raw = self._fh.read()
+            self._cache = {i: gzip.decompress(raw)}
+        return self._cache[i]
+
+    def read_at(self, offset: int) -> Optional[Dict[str, Any]]:
+        if not self._compressed:
+            self._fh.seek(offset)
+            line = self._fh.readline()
+        else:
+            i = bisect.bisect_right(self._starts, offset) - 1
+            data = self._block(max(i, 0))
+            rel = offset - self._blocks[max(i, 0)][0]
+            end = data.find(b"\n", rel)
+            line = data[rel:] if end < 0 else data[rel:end]
+        try:
+            return json.loads(line)
+        except Exception:
+            return None
+
+    def iter_from(self, start: int, end: Optional[int]) -> Iterable[Tuple[int, bytes]]:
+        if not self._compressed:
+            self._fh.seek(start)
+            offset = start
+            for line in self._fh:
+                if end is not None and offset >= end:
+                    return
+                yield offset, line
+                offset += len(line)
+            return
+        i = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        while i < len(self._blocks):
+            base = self._blocks[i][0]
+            data = self._block(i)
+            pos = max(start - base, 0)
+            while pos < len(data):
+                nl = data.find(b"\n", pos)
+                nl = len(data) if nl < 0 else nl + 1
+                offset = base + pos
+                if end is not None and offset >= end:
+                    return
+                yield offset, data[pos:nl]
+                pos = nl
+            i += 1
+
+
+def _matches(entry: Dict[str, Any], action: Optional[str], role: Optional[str], trace_id: Optional[str], since: Optional[float], until: Optional[float]) -> bool:
+    ts = float(entry.get("timestamp") or 0.0)
+    if since is not None and ts < since:
+        return False
+    if until is not None and ts >= until:
+        return False
+    if action is not None and entry.get("action") != action:
+        return False
+    if role is not None and entry.get("role") != role:
+        return False
+    if trace_id is not None and entry.get("trace_id") != trace_id:
+        return False
+    return True
+
+
+def query_segment(
+    path: Path,
+    idx: SegmentIndex,
+    compressed: bool,
+    trace_id: Optional[str] = None,
+    action: Optional[str] = None,
+    role: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+    size: Optional[int] = None,
+    fh: Optional[BinaryIO] = None,
+) -> List[Dict[str, Any]]:
+    # `size` caps reads of a segment that is still growing; `fh` is an already-open handle to read from
+    if not idx.overlaps(since, until):
+        if fh is not None:
+            fh.close()
+        return []
+    start, end = idx.offset_range(since, until)
+    if size is not None:
+        end = size if end is None else min(end, size)
+    candidates: Optional[Set[int]] = None
+    if trace_id is not None:
+        candidates = set(idx.trace_offsets(trace_id))
+    for posting in ((idx.actions.get(action, []) if action is not None else None), (idx.roles.get(role, []) if role is not None else None)):
+        if posting is None:
+            continue
+        candidates = set(posting) if candidates is None else candidates & set(posting)
+    out: List[Dict[str, Any]] = []
+    reader = BlockReader(path, idx.blocks, compressed, fh)
+    try:
+        if candidates is not None:
+            # newest first; sorted offsets keep block decompression sequential
+            for off in sorted((o for o in candidates if o >= start and (end is None or o < end)), reverse=True):
+                entry = reader.read_at(off)
+                if entry and _matches(entry, action, role, trace_id, since, until):
+                    out.append(entry)
+                    if len(out) >= limit:
+                        break
+        else:
+            # pure time range: walk only the bucketed byte range, keep the newest `limit`
+            newest: deque = deque(maxlen=limit)
+            for _, line in reader.iter_from(start, end):
+                try:
+                    entry = json.loads(line)
+                except Exception:
+                    continue
+                if _matches(entry, None, None, None, since, until):
+                    newest.append(entry)
+            out = list(reversed(newest))
+    finally:
+        reader.close()
+    return out
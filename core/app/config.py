@@ -37,3 +37,11 @@ class ConfigLoader:
         return rules_list
 
 
+
+    def load_plans(self) -> Dict[str, Any]:
+        # optional: without plans.json the Supervisor simply plans nothing
+        if not (self.config_dir / "plans.json").exists():
+            return {"templates": []}
+        plans: Dict[str, Any] = self._load_json("plans.json")
+        self._validate(plans, "plans.schema.json")
+        return plans
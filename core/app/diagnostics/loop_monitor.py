@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from ..metrics import event_loop_lag_ms, event_loop_stalls_total
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval_s: float = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "50")) / 1000.0,
+        stall_threshold_s: float = float(os.getenv("LOOP_STALL_MS", "200")) / 1000.0,
+        max_stalls: int = 100,
+    ) -> None:
+        self._interval_s = interval_s
+        self._stall_threshold_s = stall_threshold_s
+        self._stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.perf_counter()
+        self._open_stall: Optional[Dict[str, Any]] = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick(), name="LoopMonitor._tick")
+        self._thread = threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def stalls(self) -> List[Dict[str, Any]]:
+        return list(self._stalls)
+
+    async def _tick(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self._interval_s)
+            now = time.perf_counter()
+            lag = max(0.0, now - t0 - self._interval_s)
+            self._heartbeat = now
+            event_loop_lag_ms.observe(lag * 1000)
+            stall = self._open_stall
+            if stall is not None:
+                # the watchdog captured this stall while it was happening; record how long it lasted
+                stall["duration_ms"] = round(lag * 1000, 1)
+                self._open_stall = None
+
+    def _watchdog(self) -> None:
+        # runs off-loop: if the heartbeat stops advancing, grab the loop thread's stack right now
+        poll = max(self._stall_threshold_s / 4, 0.005)
+        while not self._stop.wait(poll):
+            beat = self._heartbeat
+            overdue = time.perf_counter() - beat - self._interval_s
+            if overdue < self._stall_threshold_s or self._open_stall is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id or 0)
+            stack = traceback.format_stack(frame) if frame is not None else []
+            stall = {
+                "ts": time.time(),
+                "blocked_ms_at_capture": round(overdue * 1000, 1),
+                "duration_ms": None,
+                "stack": [line.rstrip() for line in stack[-30:]],
+            }
+            self._open_stall = stall
+            self._stalls.append(stall)
+            event_loop_stalls_total.inc()
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _task_label(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "loop:callbacks"
+    name = task.get_name()
+    if name.startswith("Task-"):
+        # unnamed tasks (request handlers, background loops) are identified by their coroutine
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", None) or name
+    return f"task:{name}"
+
+
+class SamplingProfiler:
+    def __init__(self) -> None:
+        self._busy = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._busy.locked()
+
+    async def profile(self, seconds: float, interval_s: float = 0.005, all_threads: bool = False) -> Dict[str, Any]:
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Profiler already running")
+        try:
+            loop = asyncio.get_running_loop()
+            loop_thread = threading.get_ident()
+            # nothing is installed while idle: the sampler thread only exists for the duration of a profile
+            return await asyncio.to_thread(self._sample, loop, loop_thread, seconds, interval_s, all_threads)
+        finally:
+            self._busy.release()
+
+    def _sample(self, loop: asyncio.AbstractEventLoop, loop_thread: int, seconds: float, interval_s: float, all_threads: bool) -> Dict[str, Any]:
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: Counter = Counter()
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            frames = sys._current_frames()
+            for tid, frame in frames.items():
+                if tid == me or (not all_threads and tid != loop_thread):
+                    continue
+                labels: List[str] = []
+                f = frame
+                while f is not None:
+                    labels.append(_frame_label(f))
+                    f = f.f_back
+                labels.reverse()
+                if tid == loop_thread:
+                    # current_task(loop) only reads a dict keyed by loop, which is safe from another thread
+                    task = asyncio.current_task(loop)
+                    root = _task_label(task)
+                    if task is None and labels and labels[-1].startswith(("EpollSelector.select", "KqueueSelector.select", "SelectSelector.select")):
+                        root = "loop:idle"
+                    # drop the event loop machinery above the callback so stacks start at the coroutine
+                    for i in range(len(labels) - 1, -1, -1):
+                        if labels[i].startswith("Handle._run ("):
+                            labels = labels[i + 1:]
+                            break
+                else:
+                    root = f"thread:{names.get(tid, tid)}"
+                stacks[(root,) + tuple(labels)] += 1
+            samples += 1
+            time.sleep(interval_s)
+        return {
+            "samples": samples,
+            "interval_ms": interval_s * 1000,
+            "duration_ms": (time.perf_counter() - start) * 1000,
+            "stacks": stacks,
+        }
+
+
+def to_collapsed(result: Dict[str, Any]) -> str:
+    stacks: Counter = result["stacks"]
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+def to_speedscope(result: Dict[str, Any], name: str = "smarthouse-core") -> Dict[str, Any]:
+    stacks: Counter = result["stacks"]
+    frames: List[Dict[str, Any]] = []
+    index: Dict[str, int] = {}
+    samples: List[List[int]] = []
+    weights: List[float] = []
+    for stack, count in stacks.items():
+        ids = []
+        for label in stack:
+            if label not in index:
+                index[label] = len(frames)
+                frames.append({"name": label})
+            ids.append(index[label])
+        samples.append(ids)
+        weights.append(count * result["interval_ms"])
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "smarthouse-core",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+profiler = SamplingProfiler()
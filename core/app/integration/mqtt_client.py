@@ -1,9 +1,13 @@
 import asyncio
 import json
-from typing import Any, Callable, Optional
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Optional
 
-from aiomqtt import Client
-from ..metrics import mqtt_publish_total, mqtt_wait_time_ms
+from aiomqtt import Client, MqttCodeError
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from ..metrics import mqtt_phase_latency_ms, mqtt_publish_total, mqtt_wait_time_ms
+from ..tracing import tracer
 
 
 class AsyncMqttClient:
@@ -37,41 +41,108 @@ class AsyncMqttClient:
             await self._client.disconnect()
             self._client = None
 
-    async def publish_json(self, topic: str, payload: Any, qos: int = 1) -> None:
+    async def _publish_acked(self, topic: str, data: bytes, qos: int, device_type: str, timeout: float = 10.0) -> None:
+        # "publish" is paho serialising and queueing the packet, "puback" the broker's ack after that. aiomqtt
+        # 1.2's publish() does both in one call, so its two halves are done here the way it does them: paho's
+        # publish(), then an asyncio.Event in _pending_publishes that aiomqtt's on_publish callback sets
+        client = self._client
+        paho = getattr(client, "_client", None)
+        pending = getattr(client, "_pending_publishes", None)
+        if paho is None or not isinstance(pending, dict):
+            # other aiomqtt versions: one timed call, send + ack at QoS >= 1
+            t0 = time.perf_counter()
+            with tracer.span("mqtt.publish", topic=topic, qos=qos):
+                await asyncio.wait_for(client.publish(topic, data, qos=qos), timeout=timeout)
+            phase = "publish" if qos == 0 else "puback"
+            mqtt_phase_latency_ms.labels(phase=phase, device_type=device_type).observe((time.perf_counter() - t0) * 1000)
+            return
+        t0 = time.perf_counter()
+        with tracer.span("mqtt.publish", topic=topic, qos=qos):
+            info = paho.publish(topic, data, qos)
+            if info.rc != MQTT_ERR_SUCCESS:
+                raise MqttCodeError(info.rc, "Could not publish message")
+        t_sent = time.perf_counter()
+        mqtt_phase_latency_ms.labels(phase="publish", device_type=device_type).observe((t_sent - t0) * 1000)
+        if qos == 0 or info.is_published():
+            return
+        # registered before the next await: on_publish runs on this loop, so the ack cannot slip past it
+        confirmation = asyncio.Event()
+        pending[info.mid] = confirmation
+        try:
+            with tracer.span("mqtt.ack", topic=topic, mid=info.mid):
+                await asyncio.wait_for(confirmation.wait(), timeout=timeout)
+        finally:
+            pending.pop(info.mid, None)
+        mqtt_phase_latency_ms.labels(phase="puback", device_type=device_type).observe((time.perf_counter() - t_sent) * 1000)
+
+    async def publish_json(self, topic: str, payload: Any, qos: int = 1, device_type: str = "unknown") -> None:
         assert self._client is not None, "MQTT not connected"
         data = json.dumps(payload, separators=(",", ":"))
-        await self._client.publish(topic, data.encode("utf-8"), qos=qos)
-        mqtt_publish_total.labels(topic=topic).inc()
+        await self._publish_acked(topic, data.encode("utf-8"), qos, device_type)
+        mqtt_publish_total.labels(device_type=device_type).inc()
+
+    @asynccontextmanager
+    async def _subscribed(self, topic: str) -> AsyncIterator[Any]:
+        assert self._client is not None, "MQTT not connected"
+        # enter the message filter before subscribing so no state message slips through in between
+        async with self._client.filtered_messages(topic) as msgs:
+            await self._client.subscribe(topic, qos=1)
+            try:
+                yield msgs
+            finally:
+                await self._client.unsubscribe(topic)
+
+    async def _await_state(
+        self,
+        msgs: Any,
+        topic: str,
+        match: Optional[Callable[[Any], bool]],
+        timeout: float,
+        device_type: str,
+        t0: float,
+    ) -> Any:
+        # t0 is the start of the command (or of the wait for plain reads); phases are measured from it
+        with tracer.span("mqtt.state_confirm", topic=topic) as sp:
+            t_wait = time.perf_counter()
+            deadline = t_wait + timeout
+            seen = 0
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    sp.set(messages=seen)
+                    raise asyncio.TimeoutError("Timeout waiting for state message")
+                msg_task = asyncio.create_task(msgs.__anext__())
+                done, _pending = await asyncio.wait(
+                    {msg_task}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    msg_task.cancel()
+                    sp.set(messages=seen)
+                    raise asyncio.TimeoutError("Timeout waiting for state message")
+                message = msg_task.result()
+                seen += 1
+                if seen == 1:
+                    mqtt_phase_latency_ms.labels(phase="first_state", device_type=device_type).observe((time.perf_counter() - t0) * 1000)
+                try:
+                    data = json.loads(message.payload.decode("utf-8"))
+                except json.JSONDecodeError:
+                    continue
+                if match is None or match(data):
+                    now = time.perf_counter()
+                    sp.set(messages=seen)
+                    mqtt_phase_latency_ms.labels(phase="matching_state", device_type=device_type).observe((now - t0) * 1000)
+                    mqtt_wait_time_ms.labels(device_type=device_type).observe((now - t_wait) * 1000)
+                    return data
 
     async def wait_for_state(
         self,
         topic: str,
         match: Optional[Callable[[Any], bool]] = None,
         timeout: float = 2.0,
+        device_type: str = "unknown",
     ) -> Any:
-        assert self._client is not None, "MQTT not connected"
-        messages = self._client.filtered_messages(topic)
-        await self._client.subscribe(topic, qos=1)
-        async with messages as msgs:
-            try:
-                while True:
-                    msg_task = asyncio.create_task(msgs.__anext__())
-                    done, _pending = await asyncio.wait(
-                        {msg_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
-                    )
-                    if not done:
-                        msg_task.cancel()
-                        raise asyncio.TimeoutError("Timeout waiting for state message")
-                    message = msg_task.result()
-                    try:
-                        data = json.loads(message.payload.decode("utf-8"))
-                    except json.JSONDecodeError:
-                        continue
-                    if match is None or match(data):
-                        mqtt_wait_time_ms.labels(topic=topic).observe(0.0)
-                        return data
-            finally:
-                await self._client.unsubscribe(topic)
+        async with self._subscribed(topic) as msgs:
+            return await self._await_state(msgs, topic, match, timeout, device_type, time.perf_counter())
 
     async def publish_and_wait(
         self,
@@ -80,11 +151,14 @@ class AsyncMqttClient:
         state_topic: str,
         match: Optional[Callable[[Any], bool]] = None,
         timeout: float = 2.0,
+        device_type: str = "unknown",
     ) -> Any:
-        await self.publish_json(set_topic, payload)
-        return await self.wait_for_state(state_topic, match=match, timeout=timeout)
-
-    async def publish_without_wait(self, topic: str, payload: Any) -> None:
-        await self.publish_json(topic, payload)
-
+        with tracer.span("mqtt.command", set_topic=set_topic, state_topic=state_topic, device_type=device_type):
+            # subscribe first: a fast device can answer before a late subscription is in place
+            async with self._subscribed(state_topic) as msgs:
+                t0 = time.perf_counter()
+                await self.publish_json(set_topic, payload, device_type=device_type)
+                return await self._await_state(msgs, state_topic, match, timeout, device_type, t0)
 
+    async def publish_without_wait(self, topic: str, payload: Any, device_type: str = "unknown") -> None:
+        await self.publish_json(topic, payload, device_type=device_type)
@@ -0,0 +1,229 @@
+import asyncio
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import aiohttp
+
+from ..storage.snapshots import SnapshotStore
+from ..metrics import stream_viewers, stream_upstreams, stream_frames_total, stream_frames_dropped_total
+
+
+BOUNDARY = "frame"
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+CONTENT_LENGTH = re.compile(rb"content-length:[ \t]*(\d+)", re.IGNORECASE)
+# bytes kept while no SOI is in sight: enough for the part headers that precede it
+HEAD_KEEP = 1024
+
+
+def _find_eoi(buf: bytearray, start: int) -> int:
+    # walk the marker segments by their length fields up to SOS, so an EOI nested in one
+    # (the EXIF thumbnail in APP1) is skipped; scan data after SOS is byte-stuffed and cannot hold FFD9
+    pos = start + 2
+    while pos + 4 <= len(buf):
+        if buf[pos] != 0xFF:
+            # no marker where one should be: fall back to a plain scan
+            return buf.find(EOI, pos)
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+        elif marker == 0xD9:
+            return pos
+        elif 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+        else:
+            end = pos + 2 + int.from_bytes(buf[pos + 2:pos + 4], "big")
+            if marker == 0xDA:
+                return buf.find(EOI, end)
+            pos = end
+    return -1
+
+
+def _next_frame(buf: bytearray, max_frame_bytes: int) -> Optional[bytes]:
+    # pops the next complete JPEG off the front of buf, or None until more data arrives
+    start = buf.find(SOI)
+    if start < 0:
+        # keep the tail: it may hold part headers, or the first half of the next SOI
+        del buf[:-HEAD_KEEP]
+        return None
+    head = bytes(buf[:start])
+    lengths = CONTENT_LENGTH.findall(head)
+    if lengths and head.endswith(b"\n") and int(lengths[-1]) <= max_frame_bytes:
+        # the part says how long its body is: trust that over anything inside the image
+        end = start + int(lengths[-1])
+        if len(buf) < end:
+            return None
+    else:
+        end = _find_eoi(buf, start)
+        if end < 0:
+            if start:
+                del buf[:start]
+            if len(buf) > max_frame_bytes:
+                buf.clear()
+            return None
+        end += 2
+    frame = bytes(buf[start:end])
+    del buf[:end]
+    return frame
+
+
+def _part(jpeg: bytes) -> bytes:
+    # framed once per upstream frame; every viewer gets the same bytes object
+    head = f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode()
+    return head + jpeg + b"\r\n"
+
+
+class _Channel:
+    def __init__(self, camera_id: str) -> None:
+        self.camera_id = camera_id
+        self.viewers: Set[asyncio.Queue] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+        self.latest: Optional[bytes] = None
+        self.frames = 0
+        self.started = time.time()
+
+
+class StreamRelay:
+    def __init__(
+        self,
+        store: SnapshotStore,
+        mjpeg_url: str = os.getenv("STREAM_SOURCE_URL", ""),
+        poll_fps: float = float(os.getenv("STREAM_POLL_FPS", "5")),
+        client_buffer: int = int(os.getenv("STREAM_CLIENT_BUFFER", "2")),
+        idle_grace_s: float = float(os.getenv("STREAM_IDLE_GRACE_S", "1")),
+        max_frame_bytes: int = int(os.getenv("STREAM_MAX_FRAME_BYTES", str(8 * 1024 * 1024))),
+    ) -> None:
+        self._store = store
+        # upstream MJPEG endpoint template ({id}); without one the relay polls the snapshot source
+        self._mjpeg_url = mjpeg_url
+        self._poll_interval_s = 1.0 / max(poll_fps, 0.1)
+        self._client_buffer = max(1, client_buffer)
+        self._idle_grace_s = idle_grace_s
+        self._max_frame_bytes = max_frame_bytes
+        self._channels: Dict[str, _Channel] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def path(self, camera_id: str) -> str:
+        return f"/camera/{camera_id}/stream.mjpeg"
+
+    def media_type(self) -> str:
+        return f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+
+    def info(self, camera_id: str) -> Dict[str, Any]:
+        ch = self._channels.get(camera_id)
+        return {
+            "viewers": len(ch.viewers) if ch else 0,
+            "upstream": bool(ch and ch.task and not ch.task.done()),
+            "frames": ch.frames if ch else 0,
+        }
+
+    async def stop(self) -> None:
+        for ch in list(self._channels.values()):
+            self._teardown(ch)
+        self._channels.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def subscribe(self, camera_id: str) -> AsyncIterator[bytes]:
+        ch = self._channels.get(camera_id)
+        if ch is None:
+            ch = _Channel(camera_id)
+            self._channels[camera_id] = ch
+        if ch.idle_timer is not None:
+            # a viewer came back within the grace period: keep the upstream we already have
+            ch.idle_timer.cancel()
+            ch.idle_timer = None
+        q: asyncio.Queue = asyncio.Queue(maxsize=self._client_buffer)
+        ch.viewers.add(q)
+        stream_viewers.labels(camera_id=camera_id).set(len(ch.viewers))
+        if ch.task is None or ch.task.done():
+            ch.task = asyncio.create_task(self._upstream(ch), name=f"StreamRelay.upstream-{camera_id}")
+            stream_upstreams.inc()
+        elif ch.latest is not None:
+            # late joiner starts on the newest frame instead of a blank page
+            q.put_nowait(ch.latest)
+        try:
+            while True:
+                yield await q.get()
+        finally:
+            ch.viewers.discard(q)
+            stream_viewers.labels(camera_id=camera_id).set(len(ch.viewers))
+            if not ch.viewers:
+                self._schedule_teardown(ch)
+
+    def _schedule_teardown(self, ch: _Channel) -> None:
+        if self._idle_grace_s <= 0:
+            self._teardown(ch)
+            return
+        loop = asyncio.get_running_loop()
+        ch.idle_timer = loop.call_later(self._idle_grace_s, self._teardown_if_idle, ch)
+
+    def _teardown_if_idle(self, ch: _Channel) -> None:
+        ch.idle_timer = None
+        if not ch.viewers:
+            self._teardown(ch)
+
+    def _teardown(self, ch: _Channel) -> None:
+        if ch.idle_timer is not None:
+            ch.idle_timer.cancel()
+            ch.idle_timer = None
+        if ch.task is not None and not ch.task.done():
+            ch.task.cancel()
+            stream_upstreams.dec()
+        ch.task = None
+        ch.latest = None
+        if self._channels.get(ch.camera_id) is ch and not ch.viewers:
+            del self._channels[ch.camera_id]
+
+    def _publish(self, ch: _Channel, jpeg: bytes) -> None:
+        part = _part(jpeg)
+        ch.latest = part
+        ch.frames += 1
+        stream_frames_total.labels(camera_id=ch.camera_id).inc()
+        for q in ch.viewers:
+            if q.full():
+                # slow client: drop its oldest buffered frame, never block the camera or other viewers
+                try:
+                    q.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+                stream_frames_dropped_total.labels(camera_id=ch.camera_id).inc()
+            q.put_nowait(part)
+
+    async def _upstream(self, ch: _Channel) -> None:
+        backoff = 0.5
+        while True:
+            try:
+                if self._mjpeg_url:
+                    await self._read_mjpeg(ch)
+                else:
+                    await self._poll(ch)
+                backoff = 0.5
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 10.0)
+
+    async def _poll(self, ch: _Channel) -> None:
+        while True:
+            t0 = time.monotonic()
+            self._publish(ch, await self._store.fetch(ch.camera_id))
+            await asyncio.sleep(max(0.0, self._poll_interval_s - (time.monotonic() - t0)))
+
+    async def _read_mjpeg(self, ch: _Channel) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_read=15))
+        url = self._mjpeg_url.replace("{id}", ch.camera_id)
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            buf = bytearray()
+            async for chunk in resp.content.iter_any():
+                buf += chunk
+                # part Content-Length when the camera sends it, else the JPEG's own segment structure
+                while (frame := _next_frame(buf, self._max_frame_bytes)) is not None:
+                    self._publish(ch, frame)
@@ -0,0 +1,116 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from ..metrics import llm_http_clients_created_total, llm_http_requests_total, llm_http_pool_connections, llm_model_handles
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ClientRegistry:
+    def __init__(
+        self,
+        http2: bool = os.getenv("LLM_HTTP2", "1") == "1",
+        max_connections: int = int(os.getenv("LLM_MAX_CONNECTIONS", "32")),
+        max_keepalive: int = int(os.getenv("LLM_MAX_KEEPALIVE", "16")),
+        keepalive_expiry_s: float = float(os.getenv("LLM_KEEPALIVE_S", "60")),
+        connect_timeout_s: float = float(os.getenv("LLM_CONNECT_TIMEOUT_S", "5")),
+    ) -> None:
+        # HTTP/2 needs the optional h2 package (httpx[http2]); fall back to HTTP/1.1 keep-alive without it
+        self._http2 = http2 and _h2_available()
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry_s,
+        )
+        self._connect_timeout_s = connect_timeout_s
+        self._http: Dict[str, httpx.AsyncClient] = {}
+        self._models: Dict[Tuple[str, str], Any] = {}
+        self._sdk_key: Optional[str] = None
+        # SDK handles are created from executor threads
+        self._sdk_lock = threading.Lock()
+
+    async def start(self, pools: str = os.getenv("LLM_PREWARM_POOLS", "gemini,vision")) -> None:
+        # build the hot pools up front so the first chat/vision call only pays for the TCP+TLS handshake
+        for pool in (p.strip() for p in pools.split(",")):
+            if pool:
+                self.http(pool)
+
+    async def aclose(self) -> None:
+        clients = list(self._http.values())
+        self._http.clear()
+        for client in clients:
+            await client.aclose()
+        with self._sdk_lock:
+            self._models.clear()
+            llm_model_handles.set(0)
+
+    def http(self, pool: str, timeout_s: float = 30.0, read_timeout_s: Optional[float] = None) -> httpx.AsyncClient:
+        client = self._http.get(pool)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=self._http2,
+                timeout=httpx.Timeout(timeout_s, read=read_timeout_s or timeout_s, connect=self._connect_timeout_s),
+                limits=self._limits,
+                event_hooks={"request": [self._on_request(pool)]},
+            )
+            self._http[pool] = client
+            llm_http_clients_created_total.labels(pool=pool).inc()
+            for state in ("active", "idle"):
+                llm_http_pool_connections.labels(pool=pool, state=state).set_function(self._pool_gauge(pool, state))
+        return client
+
+    def _on_request(self, pool: str):
+        async def hook(request: httpx.Request) -> None:
+            llm_http_requests_total.labels(pool=pool).inc()
+        return hook
+
+    def _pool_gauge(self, pool: str, state: str):
+        def value() -> float:
+            return float(self.pool_stats(pool).get(state, 0))
+        return value
+
+    def pool_stats(self, pool: str) -> Dict[str, Any]:
+        client = self._http.get(pool)
+        if client is None:
+            return {}
+        try:
+            # httpcore's pool is not public API; stats are best-effort
+            conns = list(client._transport._pool.connections)
+        except Exception:
+            return {"http2": self._http2}
+        idle = sum(1 for c in conns if c.is_idle())
+        return {"http2": self._http2, "connections": len(conns), "idle": idle, "active": len(conns) - idle}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self._http2,
+            "pools": {pool: self.pool_stats(pool) for pool in self._http},
+            "model_handles": sorted(name for _key, name in self._models),
+        }
+
+    def gemini_model(self, model_name: str, api_key: str) -> Any:
+        # genai.configure is process-global; configure once per key and reuse model handles
+        import google.generativeai as genai
+        with self._sdk_lock:
+            if self._sdk_key != api_key:
+                genai.configure(api_key=api_key)
+                self._sdk_key = api_key
+                self._models.clear()
+            model = self._models.get((api_key, model_name))
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                self._models[(api_key, model_name)] = model
+                llm_model_handles.set(len(self._models))
+            return model
+
+
+clients = ClientRegistry()
@@ -0,0 +1,189 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .response_cache import TYPE_STEMS, normalize
+from ..metrics import llm_context_tokens, llm_context_lines_dropped_total
+
+
+# device state fields worth a model's attention, in display order
+STATE_FIELDS = ("state", "brightness", "position", "current", "temperature", "target", "value", "lux", "kind", "label", "mode")
+EVENT_FIELDS = ("kind", "tool", "status", "result", "rule_id", "decision")
+SKIP_EVENTS = {"state_update", "heartbeat", "audit_log"}
+
+
+def _fmt(v: Any) -> str:
+    if isinstance(v, bool):
+        return "yes" if v else "no"
+    if isinstance(v, float):
+        return f"{v:g}"
+    s = str(v)
+    return s if len(s) <= 24 else s[:23] + "…"
+
+
+def _event_entity(ev: Dict[str, Any]) -> Optional[str]:
+    args = ev.get("args") if isinstance(ev.get("args"), dict) else {}
+    entity = ev.get("device_id") or ev.get("camera_id") or args.get("device_id") or args.get("camera_id")
+    if not entity and ev.get("topic"):
+        entity = str(ev["topic"]).rsplit("/", 1)[-1]
+    return entity or ev.get("room")
+
+
+class _Line:
+    __slots__ = ("section", "order", "text", "refs", "base")
+
+    def __init__(self, section: int, order: float, text: str, refs: Set[str], base: float) -> None:
+        self.section = section
+        self.order = order
+        self.text = text
+        self.refs = refs
+        self.base = base
+
+
+class ContextBuilder:
+    def __init__(
+        self,
+        budget_tokens: int = int(os.getenv("LLM_CONTEXT_TOKENS", "512")),
+        max_events: int = int(os.getenv("LLM_CONTEXT_EVENTS", "50")),
+        chars_per_token: float = float(os.getenv("LLM_CONTEXT_CHARS_PER_TOKEN", "3.5")),
+        memo_size: int = 64,
+    ) -> None:
+        self.budget_tokens = budget_tokens
+        self.max_events = max_events
+        self._chars_per_token = chars_per_token
+        self._memo_size = memo_size
+        self._registry: Dict[str, Dict[str, Any]] = {}
+        # rendered state lines for the last snapshot version, and final contexts per (version, query, events)
+        self._state_memo: Tuple[Any, List[_Line]] = (None, [])
+        self._memo: "OrderedDict[Tuple[Any, ...], str]" = OrderedDict()
+
+    def bind(self, registry: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        self._registry = registry or {}
+        self._state_memo = (None, [])
+        self._memo.clear()
+
+    def tokens(self, text: str) -> int:
+        return int(len(text) / self._chars_per_token) + 1
+
+    def _mentions(self, query: str) -> Set[str]:
+        # refs a query points at: device ids, rooms, device types
+        words = normalize(query).split()
+        word_set = set(words)
+        refs = {w for w in word_set if w in self._registry}
+        refs |= {m["room"] for m in self._registry.values() if m.get("room") in word_set}
+        refs |= {f"type:{t}" for t, stems in TYPE_STEMS.items() if any(w.startswith(stems) for w in words)}
+        return refs
+
+    def _state_lines(self, snapshot: Dict[str, Any]) -> List[_Line]:
+        version = snapshot.get("version")
+        if version is not None and self._state_memo[0] == version:
+            return self._state_memo[1]
+        lines: List[_Line] = []
+        for room in sorted(snapshot.get("zones", {})):
+            zone = snapshot["zones"][room]
+            fields = " ".join(f"{k}={_fmt(zone[k])}" for k in sorted(zone) if zone[k] is not None)
+            refs = {room} | {f"type:{k}" for k in zone if k in TYPE_STEMS}
+            lines.append(_Line(1, len(lines), f"zone {room}: {fields}", refs, 2.0))
+        devices = snapshot.get("devices", {})
+        for dev_id in sorted(devices):
+            data = devices[dev_id] if isinstance(devices[dev_id], dict) else {}
+            meta = self._registry.get(dev_id, {})
+            dtype, room = meta.get("type") or data.get("type") or "device", meta.get("room")
+            fields = " ".join(f"{k}={_fmt(data[k])}" for k in STATE_FIELDS if data.get(k) is not None)
+            where = f"@{room}" if room else ""
+            refs = {dev_id, f"type:{dtype}"} | ({room} if room else set())
+            # safety-critical devices (locks, alarms) win ties against lights and sensors
+            base = 1.5 if meta.get("safety_class") == "critical" else 1.0
+            lines.append(_Line(2, len(lines), f"{dev_id} {dtype}{where}: {fields or '-'}", refs, base))
+        if version is not None:
+            self._state_memo = (version, lines)
+        return lines
+
+    def _event_lines(self, events: List[Dict[str, Any]]) -> List[_Line]:
+        # newest-first input; identical consecutive events collapse into one line with a count
+        lines: List[_Line] = []
+        last_key, count, i = None, 0, -1
+        for ev in events:
+            etype = ev.get("type", "event")
+            if etype in SKIP_EVENTS:
+                continue
+            i += 1
+            if i >= self.max_events:
+                break
+            entity = _event_entity(ev)
+            fields = " ".join(f"{k}={_fmt(ev[k])}" for k in EVENT_FIELDS if ev.get(k) is not None)
+            key = (etype, entity, fields)
+            if key == last_key:
+                count += 1
+                lines[-1].text = lines[-1].text.split(" ×")[0] + f" ×{count}"
+                continue
+            last_key, count = key, 1
+            ts = ev.get("ts")
+            when = time.strftime("%H:%M:%S", time.localtime(float(ts))) if isinstance(ts, (int, float)) else "--:--:--"
+            text = f"{when} {etype}" + (f" {entity}" if entity else "") + (f" {fields}" if fields else "")
+            refs = {entity} if entity else set()
+            meta = self._registry.get(entity or "", {})
+            if meta.get("room"):
+                refs.add(meta["room"])
+            if meta.get("type"):
+                refs.add(f"type:{meta['type']}")
+            # newer events rank higher; order keeps them chronological in the output
+            lines.append(_Line(3, -i, text, refs, 1.8 - min(i, 30) * 0.04))
+        return lines
+
+    def build(self, query: str, snapshot: Dict[str, Any], recent_events: Any) -> str:
+        events = [e for e in (recent_events or []) if isinstance(e, dict)]
+        head = events[0].get("ts") if events else None
+        memo_key = (snapshot.get("version"), normalize(query), head, len(events))
+        if memo_key[0] is not None and memo_key in self._memo:
+            self._memo.move_to_end(memo_key)
+            return self._memo[memo_key]
+
+        header = (
+            f"security_mode={snapshot.get('security_mode')} occupancy={snapshot.get('occupancy')} "
+            f"energy_mode={snapshot.get('energy_mode')} devices={len(snapshot.get('devices', {}))} "
+            f"zones={len(snapshot.get('zones', {}))}"
+        )
+        refs = self._mentions(query)
+        candidates = self._state_lines(snapshot) + self._event_lines(events)
+
+        def weight(ref: str) -> float:
+            # a named device or room is specific; a device type ("light") only narrows a little
+            return 4.0 if ref.startswith("type:") else 12.0 if ref in self._registry else 10.0
+
+        def score(line: _Line) -> float:
+            return line.base + sum(weight(r) for r in line.refs & refs)
+
+        # section titles and the omitted-entries trailer come out of the same budget
+        budget = self.budget_tokens - self.tokens(header) - 16
+        chosen: List[_Line] = []
+        for line in sorted(candidates, key=lambda ln: (-score(ln), ln.section, ln.order)):
+            cost = self.tokens("- " + line.text)
+            if cost <= budget:
+                chosen.append(line)
+                budget -= cost
+        dropped = len(candidates) - len(chosen)
+
+        chosen.sort(key=lambda ln: (ln.section, ln.order))
+        titles = {1: "Zones:", 2: "Devices:", 3: "Recent events:"}
+        out = ["System: " + header]
+        for section, title in titles.items():
+            rows = [ln.text for ln in chosen if ln.section == section]
+            if rows:
+                out.append(title)
+                out.extend("- " + r for r in rows)
+        if dropped:
+            out.append(f"(+{dropped} less relevant entries omitted)")
+            llm_context_lines_dropped_total.inc(dropped)
+        text = "\n".join(out)
+        llm_context_tokens.observe(self.tokens(text))
+
+        if memo_key[0] is not None:
+            self._memo[memo_key] = text
+            while len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+        return text
+
+
+context_builder = ContextBuilder()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..metrics import vision_gate_total, vision_gate_score
+
+
+GATE_SIZE = (64, 48)  # reference frame (w, h): enough to see a person, cheap to diff
+
+
+def _small_gray(image: bytes) -> Any:
+    import cv2
+    import numpy as np
+    # REDUCED_GRAYSCALE_4 lets libjpeg skip most of the IDCT work on large frames
+    img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        return None
+    small = cv2.resize(img, GATE_SIZE, interpolation=cv2.INTER_AREA)
+    # blur away sensor noise and JPEG blocking so they don't count as change
+    small = cv2.GaussianBlur(small, (3, 3), 0).astype(np.float32)
+    # normalise global brightness so auto-exposure steps alone don't trigger analysis
+    return small - float(small.mean())
+
+
+def _diff(ref: Any, cur: Any, pixel_delta: float) -> Tuple[float, float]:
+    import numpy as np
+    d = np.abs(cur - ref)
+    return float(d.mean()) / 255.0, float(np.count_nonzero(d > pixel_delta)) / d.size
+
+
+class _Ref:
+    __slots__ = ("frame", "analysis", "ts")
+
+    def __init__(self, frame: Any, analysis: Dict[str, Any], ts: float) -> None:
+        self.frame = frame
+        self.analysis = analysis
+        self.ts = ts
+
+
+class FrameGate:
+    def __init__(
+        self,
+        enabled: bool = os.getenv("FRAME_GATE", "1") == "1",
+        change_ratio: float = float(os.getenv("FRAME_GATE_CHANGE_RATIO", "0.02")),
+        pixel_delta: float = float(os.getenv("FRAME_GATE_PIXEL_DELTA", "25")),
+        max_age_s: float = float(os.getenv("FRAME_GATE_MAX_AGE_S", "600")),
+        max_refs: int = 256,
+    ) -> None:
+        self._enabled = enabled
+        self._change_ratio = change_ratio
+        self._pixel_delta = pixel_delta
+        self._max_age_s = max_age_s
+        self._max_refs = max_refs
+        # (camera_id, prompt) -> frame the last analysis was made on, and that analysis
+        self._refs: "OrderedDict[Tuple[str, str], _Ref]" = OrderedDict()
+        self._last: Dict[str, Dict[str, Any]] = {}
+
+    async def check(self, camera_id: str, prompt: str, image: bytes) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Any]:
+        # -> (decision, cached analysis when the scene is unchanged, small frame to pass to commit())
+        t0 = time.perf_counter()
+        decision: Dict[str, Any] = {
+            "camera_id": camera_id,
+            "changed": True,
+            "reason": "disabled",
+            "score": None,
+            "changed_ratio": None,
+            "threshold": self._change_ratio,
+        }
+        frame = None
+        cached = None
+        if self._enabled:
+            try:
+                frame = await asyncio.to_thread(_small_gray, image)
+            except Exception:
+                frame = None
+            ref = self._refs.get((camera_id, prompt))
+            if frame is None:
+                decision["reason"] = "undecodable"
+            elif ref is None:
+                decision["reason"] = "no_reference"
+            elif time.time() - ref.ts > self._max_age_s:
+                decision["reason"] = "stale"
+            else:
+                score, ratio = _diff(ref.frame, frame, self._pixel_delta)
+                vision_gate_score.observe(ratio)
+                decision["score"] = round(score, 5)
+                decision["changed_ratio"] = round(ratio, 5)
+                if ratio > self._change_ratio:
+                    decision["reason"] = "changed"
+                else:
+                    decision["changed"] = False
+                    decision["reason"] = "unchanged"
+                    cached = ref.analysis
+                    self._refs.move_to_end((camera_id, prompt))
+        decision["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        decision["ts"] = time.time()
+        self._last[camera_id] = decision
+        vision_gate_total.labels(decision="skip" if cached is not None else "analyze").inc()
+        return decision, cached, frame
+
+    def commit(self, camera_id: str, prompt: str, frame: Any, analysis: Dict[str, Any]) -> None:
+        # the reference only moves when a fresh analysis exists, so slow drift still adds up to a change
+        if frame is None:
+            return
+        key = (camera_id, prompt)
+        self._refs.pop(key, None)
+        self._refs[key] = _Ref(frame, analysis, time.time())
+        while len(self._refs) > self._max_refs:
+            self._refs.popitem(last=False)
+
+    def decisions(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._last)
+
+
+frame_gate = FrameGate()
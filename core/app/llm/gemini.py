@@ -0,0 +1,68 @@
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+import httpx
+
+from .clients import clients
+
+
+# overridable so a local stand-in server can play Gemini in tests/offline setups
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_CHAT_MODEL = os.getenv("GEMINI_CHAT_MODEL", "gemini-1.5-flash")
+
+
+def _url(model: str, method: str) -> str:
+    return f"{GEMINI_API_BASE}/models/{model}:{method}"
+
+
+def _body(prompt: str) -> Dict[str, Any]:
+    return {
+        "contents": [
+            {
+                "role": "user",
+                "parts": [{"text": prompt}],
+            }
+        ]
+    }
+
+
+def _chunk_text(data: Dict[str, Any]) -> str:
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+        return "".join(p.get("text", "") for p in parts)
+    except Exception:
+        return ""
+
+
+async def generate_with_gemini(prompt: str, model: str = GEMINI_CHAT_MODEL) -> Optional[str]:
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return None
+    headers = {"Content-Type": "application/json"}
+    r = await clients.http("gemini").post(f"{_url(model, 'generateContent')}?key={api_key}", headers=headers, json=_body(prompt), timeout=30)
+    r.raise_for_status()
+    return _chunk_text(r.json()) or None
+
+
+async def stream_with_gemini(prompt: str, model: str = GEMINI_CHAT_MODEL, client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[str]:
+    # streamGenerateContent?alt=sse: one JSON candidate chunk per `data:` line, forwarded as soon as it lands
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        return
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    client = client or clients.http("gemini")
+    # leaving this block (normal end, error, or the consumer being cancelled) closes the upstream request
+    async with client.stream("POST", f"{_url(model, 'streamGenerateContent')}?alt=sse&key={api_key}", headers=headers, json=_body(prompt), timeout=httpx.Timeout(30, read=60)) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if not payload or payload == "[DONE]":
+                continue
+            try:
+                text = _chunk_text(json.loads(payload))
+            except ValueError:
+                continue
+            if text:
+                yield text
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import yaml
+
+from .clients import clients
+from .gemini import GEMINI_CHAT_MODEL, stream_with_gemini
+from ..metrics import router_requests_total, router_ttft_ms, router_hedges_total, router_backend_ewma_ms, router_backend_error_rate
+
+
+ROUTER_PATH = os.getenv("ROUTER_CONFIG", "/configs/router.yaml")
+
+# kinds that can answer a text prompt; triton hosts detectors/policies unless a policy names it explicitly
+TEXT_KINDS = ("vllm", "ollama", "gemini")
+DEFAULT_URLS = {
+    "vllm": os.getenv("ROUTER_VLLM_URL", ""),
+    "ollama": os.getenv("ROUTER_OLLAMA_URL", ""),
+    "triton": os.getenv("ROUTER_TRITON_URL", ""),
+}
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class Backend:
+    def __init__(self, spec: Dict[str, Any], alpha: float) -> None:
+        self.name: str = spec["name"]
+        self.kind: str = spec.get("kind") or self.name.split("/", 1)[0]
+        self.model: str = spec.get("model") or self.name.split("/", 1)[-1]
+        self.url: str = (spec.get("url") or DEFAULT_URLS.get(self.kind, "")).rstrip("/")
+        self._alpha = alpha
+        self.ewma_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def configured(self) -> bool:
+        if self.kind == "gemini":
+            return bool(os.getenv("GEMINI_API_KEY"))
+        return bool(self.url) and self.kind in ("vllm", "ollama", "triton")
+
+    def available(self, now: float) -> bool:
+        return self.configured and now >= self.open_until
+
+    def score(self, budget_ms: float) -> float:
+        # unknown latency counts as on-budget so new backends get tried; errors weigh heavily
+        latency = self.ewma_ms if self.ewma_ms is not None else budget_ms
+        return latency * (1.0 + 4.0 * self.error_rate)
+
+    def record(self, ok: bool, ttft_ms: Optional[float], cooldown_s: float, trip_after: int) -> None:
+        self.error_rate += self._alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok and ttft_ms is not None:
+            self.ewma_ms = ttft_ms if self.ewma_ms is None else self.ewma_ms + self._alpha * (ttft_ms - self.ewma_ms)
+            router_backend_ewma_ms.labels(backend=self.name).set(self.ewma_ms)
+        router_backend_error_rate.labels(backend=self.name).set(self.error_rate)
+        if ok:
+            self.failures = 0
+        else:
+            self.failures += 1
+            if self.failures >= trip_after:
+                # circuit open: stop sending traffic for a while, then let one request probe it
+                self.open_until = time.time() + cooldown_s
+
+    def record_censored(self, elapsed_ms: float) -> None:
+        # abandoned after elapsed_ms without a first chunk: a lower bound, so it can only push the estimate up
+        if self.ewma_ms is None or elapsed_ms > self.ewma_ms:
+            self.ewma_ms = elapsed_ms if self.ewma_ms is None else self.ewma_ms + self._alpha * (elapsed_ms - self.ewma_ms)
+            router_backend_ewma_ms.labels(backend=self.name).set(self.ewma_ms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "configured": self.configured,
+            "ewma_ttft_ms": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "open": time.time() < self.open_until,
+        }
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        alpha: float = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2")),
+        cooldown_s: float = float(os.getenv("ROUTER_COOLDOWN_S", "30")),
+        trip_after: int = int(os.getenv("ROUTER_TRIP_AFTER", "3")),
+        hedge: bool = os.getenv("ROUTER_HEDGE", "1") == "1",
+    ) -> None:
+        self._alpha = alpha
+        self._cooldown_s = cooldown_s
+        self._trip_after = max(1, trip_after)
+        self._hedge = hedge
+        self._policies: Dict[str, Dict[str, Any]] = {}
+        self._backends: Dict[str, Backend] = {}
+        self._fallbacks: Dict[str, List[str]] = {}
+        self.configure({})
+
+    def configure(self, cfg: Dict[str, Any]) -> None:
+        old = self._backends
+        self._policies = dict(cfg.get("policies") or {})
+        self._policies.setdefault("default", {"latency_ms": 600})
+        backends: Dict[str, Backend] = {}
+        for spec in cfg.get("backends") or []:
+            if isinstance(spec, dict) and spec.get("name"):
+                b = Backend(spec, self._alpha)
+                prev = old.get(b.name)
+                if prev is not None:
+                    # keep learned latency/error stats across reloads
+                    b.ewma_ms, b.error_rate, b.failures, b.open_until = prev.ewma_ms, prev.error_rate, prev.failures, prev.open_until
+                backends[b.name] = b
+        if not any(b.kind == "gemini" for b in backends.values()):
+            # the hosted model stays reachable (when keyed) even if router.yaml doesn't list it
+            name = f"gemini/{GEMINI_CHAT_MODEL}"
+            backends[name] = Backend({"name": name}, self._alpha)
+        self._backends = backends
+        self._fallbacks = {}
+        for fb in cfg.get("fallbacks") or []:
+            primary, to = self._resolve(fb.get("primary")), self._resolve(fb.get("to"))
+            if primary and to:
+                self._fallbacks.setdefault(primary, []).append(to)
+
+    def load(self, path: str = ROUTER_PATH) -> None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cfg = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            cfg = {}
+        self.configure(cfg if isinstance(cfg, dict) else {})
+
+    def _resolve(self, name: Optional[str]) -> Optional[str]:
+        # fallbacks may use a short name ("ollama/mistral-7b" for "ollama/mistral-7b-instruct")
+        if not name:
+            return None
+        if name in self._backends:
+            return name
+        for full in self._backends:
+            if full.startswith(name):
+                return full
+        return None
+
+    def _client(self, b: Backend) -> httpx.AsyncClient:
+        # one app-lifetime pool per backend host; Gemini shares the chat pool
+        if b.kind == "gemini":
+            return clients.http("gemini")
+        return clients.http(f"router:{b.url}", read_timeout_s=60)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"policies": self._policies, "backends": [b.to_dict() for b in self._backends.values()], "fallbacks": self._fallbacks}
+
+    def plan(self, request_class: str = "default") -> Tuple[Dict[str, Any], List[Backend]]:
+        policy = self._policies.get(request_class) or self._policies["default"]
+        if policy.get("prefer") == "non_llm":
+            return policy, []
+        budget = float(policy.get("latency_ms", 600))
+        now = time.time()
+        if policy.get("backends"):
+            names = [n for n in (self._resolve(x) for x in policy["backends"]) if n]
+            pool = [self._backends[n] for n in names]
+        else:
+            pool = [b for b in self._backends.values() if b.kind in TEXT_KINDS]
+        chain: List[Backend] = []
+        for b in sorted(pool, key=lambda b: b.score(budget)):
+            # a primary with an open circuit drops out, but its fallbacks still stand in for it
+            for cand in [b] + [self._backends[fb] for fb in self._fallbacks.get(b.name, [])]:
+                if cand not in chain and cand.available(now):
+                    chain.append(cand)
+        return policy, chain
+
+    async def stream(self, prompt: str, request_class: str = "default") -> AsyncIterator[str]:
+        policy, chain = self.plan(request_class)
+        if not chain:
+            raise NoBackendAvailable(request_class)
+        budget_s = float(policy.get("latency_ms", 600)) / 1000.0
+        i = 0
+        while i < len(chain):
+            primary = chain[i]
+            hedge = chain[i + 1] if self._hedge and i + 1 < len(chain) else None
+            winner = await self._first_chunk(prompt, primary, hedge, budget_s)
+            if winner is None:
+                # both failed before producing anything: move down the chain
+                i += 2 if hedge is not None else 1
+                continue
+            backend, gen, first = winner
+            async with aclosing(gen):
+                yield first
+                async for text in gen:
+                    yield text
+            return
+        raise NoBackendAvailable(request_class)
+
+    async def _first_chunk(self, prompt: str, primary: Backend, hedge: Optional[Backend], budget_s: float) -> Optional[Tuple[Backend, AsyncIterator[str], str]]:
+        # race for the first chunk: the hedge is only launched once the primary has blown its budget
+        start = time.time()
+        running: Dict[asyncio.Task, Tuple[Backend, AsyncIterator[str], float]] = {}
+
+        def launch(b: Backend) -> None:
+            gen = self._open(b, prompt)
+            running[asyncio.ensure_future(gen.__anext__())] = (b, gen, time.time())
+
+        launch(primary)
+        hedged = hedge is None
+        fired = False
+        try:
+            while running:
+                timeout = None if hedged else max(0.0, budget_s - (time.time() - start))
+                done, _ = await asyncio.wait(list(running), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = fired = True
+                    router_hedges_total.labels(result="fired").inc()
+                    launch(hedge)
+                    continue
+                for task in done:
+                    b, gen, t0 = running.pop(task)
+                    ttft_ms = (time.time() - t0) * 1000
+                    exc = task.exception()
+                    if exc is None:
+                        b.record(True, ttft_ms, self._cooldown_s, self._trip_after)
+                        router_requests_total.labels(backend=b.name, result="ok").inc()
+                        router_ttft_ms.labels(backend=b.name).observe(ttft_ms)
+                        if fired and b is hedge:
+                            router_hedges_total.labels(result="won").inc()
+                        return b, gen, task.result()
+                    # an empty stream counts as a failure too: nothing to show the user
+                    b.record(False, None, self._cooldown_s, self._trip_after)
+                    router_requests_total.labels(backend=b.name, result="error").inc()
+                    await gen.aclose()
+                    if not hedged:
+                        # primary failed fast: don't wait out the budget, bring the hedge in now
+                        hedged = True
+                        launch(hedge)
+            return None
+        finally:
+            for task, (b, gen, t0) in running.items():
+                task.cancel()
+                b.record_censored((time.time() - t0) * 1000)
+                router_requests_total.labels(backend=b.name, result="cancelled").inc()
+            for task, (b, gen, _t0) in running.items():
+                try:
+                    await task
+                except BaseException:
+                    pass
+                await gen.aclose()
+
+    def _open(self, b: Backend, prompt: str) -> AsyncIterator[str]:
+        if b.kind == "gemini":
+            return stream_with_gemini(prompt, model=b.model, client=self._client(b))
+        if b.kind == "vllm":
+            return self._stream_openai(b, prompt)
+        if b.kind == "ollama":
+            return self._stream_ollama(b, prompt)
+        return self._stream_triton(b, prompt)
+
+    async def _stream_openai(self, b: Backend, prompt: str) -> AsyncIterator[str]:
+        # vLLM's OpenAI-compatible server
+        body = {"model": b.model, "messages": [{"role": "user", "content": prompt}], "stream": True}
+        async with self._client(b).stream("POST", f"{b.url}/v1/chat/completions", json=body) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if not payload or payload == "[DONE]":
+                    continue
+                try:
+                    delta = json.loads(payload)["choices"][0].get("delta") or {}
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta.get("content"):
+                    yield delta["content"]
+
+    async def _stream_ollama(self, b: Backend, prompt: str) -> AsyncIterator[str]:
+        body = {"model": b.model, "prompt": prompt, "stream": True}
+        async with self._client(b).stream("POST", f"{b.url}/api/generate", json=body) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    return
+
+    async def _stream_triton(self, b: Backend, prompt: str) -> AsyncIterator[str]:
+        # Triton generate extension (text models only); streamed via generate_stream
+        body = {"text_input": prompt, "parameters": {"stream": True}}
+        async with self._client(b).stream("POST", f"{b.url}/v2/models/{b.model}/generate_stream", json=body) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                try:
+                    text = json.loads(line[5:].strip()).get("text_output")
+                except ValueError:
+                    continue
+                if text:
+                    yield text
+
+
+model_router = ModelRouter()
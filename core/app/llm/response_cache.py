@@ -0,0 +1,242 @@
+import math
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from ..metrics import response_cache_total, response_cache_entries
+
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# query words -> device type whose state the answer depends on (ru/en stems)
+TYPE_STEMS = {
+    "lock": ("замк", "замок", "двер", "запер", "door", "lock"),
+    "thermostat": ("температур", "градус", "термостат", "отоплен", "тепл", "холодн", "temperature", "thermostat", "heating", "degree"),
+    "light": ("свет", "ламп", "light", "lamp"),
+    "cover": ("штор", "жалюз", "cover", "blind", "curtain"),
+    "camera": ("камер", "camera"),
+}
+SECURITY_STEMS = ("охран", "сигнализ", "security", "alarm")
+
+# words that flip a command's meaning; two queries only share a semantic hit when these match exactly
+POLAR_WORDS = {"on", "off", "not", "no", "arm", "disarm", "lock", "unlock", "open", "close", "не", "нет"}
+POLAR_STEMS = ("откр", "закр", "вкл", "выкл", "снять", "сним", "постав", "запер", "отпер")
+
+QUESTION_WORDS = {"ли", "какая", "какой", "какие", "сколько", "где", "статус", "is", "are", "what", "how", "status", "which"}
+COMMAND_WORDS = {"закрой", "открой", "запри", "отопри", "включи", "выключи", "поставь", "установи", "сделай", "lock", "unlock", "set", "turn", "open", "close"}
+# action verbs and requests to act: anywhere in the query they mean "do", not "tell me the state";
+# the English imperatives above are left out, they double as nouns/adjectives ("lock status", "is it open")
+ACTION_WORDS = {
+    "закрой", "открой", "запри", "отопри", "включи", "выключи", "поставь", "установи", "сделай", "настрой", "измени", "поменяй",
+    "закрыть", "открыть", "запереть", "отпереть", "включить", "выключить", "поставить", "установить", "сделать", "настроить",
+    "изменить", "поменять", "можешь", "можете", "сможешь", "сможете", "пожалуйста", "почему", "зачем",
+    "unlock", "switch", "adjust", "change", "configure", "please", "why",
+}
+# "can you ...", "how do I ...": a request for an action or for instructions
+REQUEST_PAIRS = {
+    ("can", "you"), ("could", "you"), ("would", "you"), ("will", "you"), ("can", "i"),
+    ("how", "do"), ("how", "does"), ("how", "can"), ("how", "to"), ("how", "should"),
+}
+
+
+def normalize(query: str) -> str:
+    return " ".join(_WORD.findall(query.lower().replace("ё", "е")))
+
+
+def _has_stem(words: List[str], stems: Tuple[str, ...]) -> bool:
+    return any(w.startswith(stems) for w in words)
+
+
+def _signature(words: List[str]) -> FrozenSet[str]:
+    return frozenset(w for w in words if w.isdigit() or w in POLAR_WORDS or w.startswith(POLAR_STEMS))
+
+
+def _embed(norm: str, buckets: int = 1024) -> Dict[int, float]:
+    # local embedding stand-in: hashed character trigrams, L2-normalised; good at rephrasings and typos
+    text = f" {norm} "
+    vec: Dict[int, float] = {}
+    for i in range(len(text) - 2):
+        b = zlib.crc32(text[i:i + 3].encode()) % buckets
+        vec[b] = vec.get(b, 0.0) + 1.0
+    norm2 = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {k: v / norm2 for k, v in vec.items()}
+
+
+def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class _Probe:
+    __slots__ = ("norm", "words", "deps", "versions", "request_class")
+
+    def __init__(self, norm: str, words: List[str], deps: Tuple[str, ...], versions: Tuple[int, ...], request_class: str) -> None:
+        self.norm = norm
+        self.words = words
+        self.deps = deps
+        self.versions = versions
+        self.request_class = request_class
+
+
+class _Entry:
+    __slots__ = ("text", "versions", "expires", "vec", "signature")
+
+    def __init__(self, text: str, versions: Tuple[int, ...], expires: float, vec: Dict[int, float], signature: FrozenSet[str]) -> None:
+        self.text = text
+        self.versions = versions
+        self.expires = expires
+        self.vec = vec
+        self.signature = signature
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        enabled: bool = os.getenv("RESPONSE_CACHE", "1") == "1",
+        max_entries: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512")),
+        ttl_s: float = float(os.getenv("RESPONSE_CACHE_TTL_S", "600")),
+        similarity: float = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9")),
+        fast_path: bool = os.getenv("RESPONSE_FAST_PATH", "1") == "1",
+    ) -> None:
+        self._enabled = enabled
+        self._max_entries = max_entries
+        self._ttl_s = ttl_s
+        # 0 disables the embedding lookup (exact matches only)
+        self._similarity = similarity
+        self._fast_path = fast_path
+        self._context: Any = None
+        self._registry: Dict[str, Dict[str, Any]] = {}
+        self._entries: "OrderedDict[Tuple[str, Tuple[str, ...], str], _Entry]" = OrderedDict()
+        response_cache_entries.set_function(lambda: len(self._entries))
+
+    def bind(self, context: Any, registry: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        # entries are validated against the context's change counters, so nothing is cached until bound
+        self._context = context
+        self._registry = registry or {}
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self._enabled and self._context is not None, "entries": len(self._entries), "similarity": self._similarity}
+
+    def _deps(self, words: List[str]) -> Tuple[str, ...]:
+        # state slice a question depends on: named devices/rooms, device types, security mode;
+        # an empty slice means "anything", i.e. the global version
+        deps = set()
+        word_set = set(words)
+        types = {t for t, stems in TYPE_STEMS.items() if _has_stem(words, stems)}
+        for dev_id, meta in self._registry.items():
+            room = meta.get("room")
+            if dev_id in word_set or meta.get("type") in types:
+                deps.add(dev_id)
+            if room and room in word_set:
+                deps.add(dev_id)
+                deps.add(f"zone:{room}")
+        if _has_stem(words, SECURITY_STEMS):
+            deps.add("security_mode")
+        return tuple(sorted(deps))
+
+    def _versions(self, deps: Tuple[str, ...]) -> Tuple[int, ...]:
+        return self._context.versions(deps) if deps else (self._context.version,)
+
+    def lookup(self, query: str, request_class: str = "default") -> Tuple[Optional[_Probe], Optional[str]]:
+        if not self._enabled or self._context is None:
+            return None, None
+        norm = normalize(query)
+        if not norm:
+            return None, None
+        words = norm.split()
+        deps = self._deps(words)
+        probe = _Probe(norm, words, deps, self._versions(deps), request_class)
+        now = time.time()
+        key = (norm, deps, request_class)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.versions == probe.versions and entry.expires > now:
+                self._entries.move_to_end(key)
+                response_cache_total.labels(result="hit").inc()
+                return probe, entry.text
+            # the state it was answered from has moved on
+            del self._entries[key]
+            response_cache_total.labels(result="stale").inc()
+        if self._similarity > 0:
+            vec = _embed(norm)
+            sig = _signature(words)
+            best, best_key = self._similarity, None
+            for k, e in self._entries.items():
+                if k[1] != deps or k[2] != request_class or e.signature != sig:
+                    continue
+                if e.versions != probe.versions or e.expires <= now:
+                    continue
+                score = _cosine(vec, e.vec)
+                if score >= best:
+                    best, best_key = score, k
+            if best_key is not None:
+                self._entries.move_to_end(best_key)
+                response_cache_total.labels(result="semantic_hit").inc()
+                return probe, self._entries[best_key].text
+        response_cache_total.labels(result="miss").inc()
+        return probe, None
+
+    def store(self, probe: Optional[_Probe], text: str) -> None:
+        if probe is None or not text:
+            return
+        if self._versions(probe.deps) != probe.versions:
+            # state changed while the model was answering; the answer may already be stale
+            return
+        key = (probe.norm, probe.deps, probe.request_class)
+        self._entries[key] = _Entry(text, probe.versions, time.time() + self._ttl_s, _embed(probe.norm), _signature(probe.words))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def fast_answer(self, query: str, snapshot: Dict[str, Any]) -> Optional[str]:
+        # state-only questions (lock status, temperatures) are answered straight from the snapshot
+        if not self._fast_path:
+            return None
+        words = normalize(query).split()
+        if not words:
+            return None
+        is_question = "?" in query or words[0] in QUESTION_WORDS or "ли" in words
+        word_set = set(words)
+        # only pure status reads: a question that also asks for an action or instructions goes to the model
+        if not is_question or words[0] in COMMAND_WORDS or word_set & ACTION_WORDS or REQUEST_PAIRS & set(zip(words, words[1:])):
+            return None
+        devices = snapshot.get("devices", {})
+        rooms = {m.get("room") for m in self._registry.values() if m.get("room") in word_set}
+        named = {d for d in self._registry if d in word_set}
+
+        def selected(dtype: str) -> List[str]:
+            ids = [d for d, m in self._registry.items() if m.get("type") == dtype]
+            narrowed = [d for d in ids if d in named or self._registry[d].get("room") in rooms]
+            return sorted(narrowed or ids)
+
+        lines: List[str] = []
+        if _has_stem(words, TYPE_STEMS["lock"]):
+            for dev_id in selected("lock"):
+                st = (devices.get(dev_id) or {}).get("state")
+                label = {"LOCKED": "заперт", "UNLOCKED": "не заперт"}.get(st, "нет данных")
+                lines.append(f"{dev_id} ({self._registry[dev_id].get('room', '-')}): {label}")
+        if _has_stem(words, TYPE_STEMS["thermostat"]):
+            for dev_id in selected("thermostat"):
+                data = devices.get(dev_id) or {}
+                current = data.get("current", data.get("temperature"))
+                line = f"{dev_id} ({self._registry[dev_id].get('room', '-')}): "
+                line += f"{current} °C" if current is not None else "нет данных"
+                if data.get("target") is not None:
+                    line += f", цель {data['target']} °C"
+                lines.append(line)
+            for dev_id in selected("sensor"):
+                data = devices.get(dev_id) or {}
+                if data.get("type") == "temperature" and data.get("value") is not None:
+                    lines.append(f"{dev_id} ({self._registry[dev_id].get('room', '-')}): {data['value']} °C")
+        if not lines:
+            return None
+        response_cache_total.labels(result="fast_path").inc()
+        return "\n".join(lines)
+
+
+response_cache = ResponseCache()
@@ -1,48 +1,75 @@
-import os
-from typing import Any, Dict, Optional
-import httpx
-
-
-GEMINI_API = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
-
-
-async def generate_with_gemini(prompt: str) -> Optional[str]:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        return None
-    headers = {"Content-Type": "application/json"}
-    body: Dict[str, Any] = {
-        "contents": [
-            {
-                "role": "user",
-                "parts": [{"text": prompt}],
-            }
-        ]
-    }
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(f"{GEMINI_API}?key={api_key}", headers=headers, json=body)
-        r.raise_for_status()
-        data = r.json()
-        try:
-            parts = data["candidates"][0]["content"]["parts"]
-            text = "".join(p.get("text", "") for p in parts)
-            return text or None
-        except Exception:
-            return None
+import asyncio
+import inspect
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict
+
+from .model_router import NoBackendAvailable, model_router
+from .response_cache import response_cache
+from .context_builder import context_builder
+from ..metrics import llm_ttft_ms, llm_streams_total
+
+
+def _build_prompt(query: str, snapshot: Dict[str, Any], recent_events: Any) -> str:
+    # ranked, token-budgeted summary of state and events; prompt size stays flat as the home grows
+    return context_builder.build(query, snapshot, recent_events) + "\n\nUser: " + query
+
+
+def _fallback_text(query: str) -> str:
+    # Fallback minimal heuristic
+    return "Пока без модели: «" + query + "». Система активна; данных достаточно для ответа после включения модели."
 
 
 async def generate_response(query: str, snapshot: Dict[str, Any], recent_events: Any) -> str:
-    context = (
-        f"System: devices={len(snapshot.get('devices', {}))}, "
-        f"zones={len(snapshot.get('zones', {}))}, "
-        f"security_mode={snapshot.get('security_mode')}\n"
-        f"Recent events: " + ", ".join([e.get("type", "event") for e in (recent_events or [])][-10:])
-    )
-    prompt = context + "\n\nUser: " + query
-    text = await generate_with_gemini(prompt)
-    if not text:
-        # Fallback minimal heuristic
-        return "Пока без модели: «" + query + "». Система активна; данных достаточно для ответа после включения модели."
-    return text
+    return "".join([t async for t in stream_response(query, snapshot, recent_events)])
 
 
+async def stream_response(query: str, snapshot: Dict[str, Any], recent_events: Any, request_class: str = "default") -> AsyncIterator[str]:
+    start = time.time()
+    # state-only questions and repeats never reach a model
+    answer = response_cache.fast_answer(query, snapshot)
+    backend = "state"
+    if answer is None:
+        probe, answer = response_cache.lookup(query, request_class)
+        backend = "cache"
+    if answer is not None:
+        llm_ttft_ms.labels(backend=backend).observe((time.time() - start) * 1000)
+        yield answer
+        llm_streams_total.labels(backend=backend, result="ok").inc()
+        return
+    if inspect.isawaitable(recent_events):
+        # callers may hand in a pending fetch; cache and fast-path answers never wait for it
+        recent_events = await recent_events
+    prompt = _build_prompt(query, snapshot, recent_events)
+    sent = False
+    backend = "router"
+    parts = []
+    try:
+        # backend choice, hedging and failover happen in the ModelRouter (router.yaml policies)
+        # aclosing: if our consumer stops early, the upstream stream is closed now, not at GC time
+        async with aclosing(model_router.stream(prompt, request_class)) as chunks:
+            async for text in chunks:
+                if not sent:
+                    llm_ttft_ms.labels(backend=backend).observe((time.time() - start) * 1000)
+                    sent = True
+                parts.append(text)
+                yield text
+    except (asyncio.CancelledError, GeneratorExit):
+        # client went away; aclosing has already shut the upstream request
+        llm_streams_total.labels(backend=backend, result="cancelled").inc()
+        raise
+    except NoBackendAvailable:
+        backend = "heuristic"
+    except Exception:
+        llm_streams_total.labels(backend=backend, result="error").inc()
+        if sent:
+            # mid-stream failure: the client already has part of the answer, so just end it
+            return
+        backend = "heuristic"
+    if not sent:
+        llm_ttft_ms.labels(backend="heuristic").observe((time.time() - start) * 1000)
+        yield _fallback_text(query)
+    else:
+        # only complete model answers are cached, never the heuristic placeholder
+        response_cache.store(probe, "".join(parts))
+    llm_streams_total.labels(backend=backend, result="ok").inc()
@@ -1,30 +1,85 @@
 import os
+import asyncio
 import base64
-from typing import Any, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import httpx
 import time
-import google.generativeai as genai
 from google.cloud import vision
 from ..metrics import vision_calls_total, vision_call_latency_ms, gemini_calls_total, gemini_call_latency_ms
+from .vision_cache import VisionCache, vision_cache
+from .clients import clients
 
 
-def _detect_mime(path: str) -> str:
-    lp = path.lower()
-    if lp.endswith(".png"):
+GEMINI_REST = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+GV_REST = "https://vision.googleapis.com/v1/images:annotate"
+
+VISION_TIMEOUT_S = float(os.getenv("VISION_TIMEOUT_S", "20"))
+# frames travel through the pipeline as one in-memory buffer; nothing here copies or touches disk
+ImageBytes = Union[bytes, bytearray, memoryview]
+GEMINI_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "45"))
+
+# SDK-only calls and OpenCV run here, never on the event loop
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("VISION_THREADS", "4")), thread_name_prefix="vision")
+
+# per-provider concurrency caps, created lazily inside the running loop
+_limits = {
+    "gv": int(os.getenv("VISION_GV_CONCURRENCY", "4")),
+    "gemini": int(os.getenv("VISION_GEMINI_CONCURRENCY", "2")),
+    "cv": int(os.getenv("VISION_CV_CONCURRENCY", "2")),
+}
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+_sdk_client: Any = None
+
+
+class VisionApiError(Exception):
+    pass
+
+
+def _semaphore(provider: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(provider)
+    if sem is None:
+        sem = asyncio.Semaphore(_limits[provider])
+        _semaphores[provider] = sem
+    return sem
+
+
+def _http() -> httpx.AsyncClient:
+    # app-lifetime pooled keep-alive client shared by all REST vision/Gemini calls
+    return clients.http("vision", timeout_s=VISION_TIMEOUT_S)
+
+
+async def _offload(fn: Callable[..., Any], *args: Any, timeout: float) -> Any:
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(_executor, fn, *args), timeout=timeout)
+
+
+def preload() -> None:
+    # importing cv2 holds the GIL for tens of ms; pay that at startup, not in the first analysis's worker thread
+    try:
+        import cv2  # noqa: F401
+    except Exception:
+        pass
+
+
+def _detect_mime(image: ImageBytes) -> str:
+    head = bytes(image[:12])
+    if head.startswith(b"\x89PNG"):
         return "image/png"
-    if lp.endswith(".gif"):
+    if head.startswith(b"GIF8"):
         return "image/gif"
-    if lp.endswith(".webp"):
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
         return "image/webp"
     return "image/jpeg"
 
 
-def basic_opencv_metrics(image_path: str) -> Dict[str, Any]:
+def _opencv_metrics(image: ImageBytes) -> Dict[str, Any]:
     try:
         import cv2
         import numpy as np
-        img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
         if img is None:
             return {}
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -39,26 +94,71 @@ def basic_opencv_metrics(image_path: str) -> Dict[str, Any]:
         return {}
 
 
-def _read_bytes(path: str) -> bytes:
-    with open(path, "rb") as f:
-        return f.read()
+async def basic_opencv_metrics(image: ImageBytes) -> Dict[str, Any]:
+    async with _semaphore("cv"):
+        try:
+            return await _offload(_opencv_metrics, image, timeout=VISION_TIMEOUT_S)
+        except Exception:
+            return {}
+
+
+# feature name -> Vision API feature type
+GV_FEATURES = {
+    "labels": "LABEL_DETECTION",
+    "objects": "OBJECT_LOCALIZATION",
+    "ocr": "TEXT_DETECTION",
+}
+
+
+def _gv_sdk() -> Any:
+    global _sdk_client
+    if _sdk_client is None:
+        _sdk_client = vision.ImageAnnotatorClient()
+    return _sdk_client
+
 
+def _gv_request_features(features: Tuple[str, ...], max_results: int) -> List[Dict[str, Any]]:
+    out = []
+    for name in features:
+        feat: Dict[str, Any] = {"type": GV_FEATURES[name]}
+        if name == "labels":
+            feat["maxResults"] = max_results
+        out.append(feat)
+    return out
 
-def _gv_annotate_api_key(image_path: str, features: List[Dict[str, Any]]) -> Dict[str, Any] | None:
+
+def _gv_parse(resp: Dict[str, Any], features: Tuple[str, ...]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    if "labels" in features:
+        anns = resp.get("labelAnnotations") or []
+        out["labels"] = [a.get("description", "").strip() for a in anns if a.get("description")]
+    if "objects" in features:
+        anns = resp.get("localizedObjectAnnotations") or []
+        out["objects"] = [a.get("name", "").strip() for a in anns if a.get("name")]
+    if "ocr" in features:
+        out["ocr"] = ((resp.get("fullTextAnnotation") or {}).get("text", "") or "").strip()
+    return out
+
+
+async def _gv_annotate_api_key(image: ImageBytes, features: List[Dict[str, Any]]) -> Dict[str, Any] | None:
     api_key = os.getenv("GOOGLE_CLOUD_VISION_API_KEY")
     if not api_key:
         return None
-    url = f"https://vision.googleapis.com/v1/images:annotate?key={api_key}"
-    img_b64 = base64.b64encode(_read_bytes(image_path)).decode()
+    img_b64 = base64.b64encode(image).decode()
     body = {"requests": [{"image": {"content": img_b64}, "features": features}]}
     start = time.time()
     try:
-        r = httpx.post(url, json=body, timeout=20)
+        r = await _http().post(f"{GV_REST}?key={api_key}", json=body, timeout=VISION_TIMEOUT_S)
         r.raise_for_status()
+        data = r.json()
+        # a 200 can still carry a per-image failure (bad image, quota, permission); that is not an empty scene
+        err = ((data.get("responses") or [{}])[0] or {}).get("error")
+        if err:
+            raise VisionApiError(err.get("message") or str(err))
         latency_ms = (time.time() - start) * 1000
         vision_call_latency_ms.labels(provider="gv", op="annotate").observe(latency_ms)
         vision_calls_total.labels(provider="gv", op="annotate", result="ok").inc()
-        return r.json()
+        return data
     except Exception:
         latency_ms = (time.time() - start) * 1000
         vision_call_latency_ms.labels(provider="gv", op="annotate").observe(latency_ms)
@@ -66,91 +166,114 @@ def _gv_annotate_api_key(image_path: str, features: List[Dict[str, Any]]) -> Dic
         raise
 
 
-def gv_labels(image_path: str, max_results: int = 10) -> List[str]:
-    # Try API key path first
+def _gv_annotate_sdk(image: ImageBytes, features: List[Dict[str, Any]]) -> Dict[str, Any]:
+    start = time.time()
     try:
-        data = _gv_annotate_api_key(image_path, [{"type": "LABEL_DETECTION", "maxResults": max_results}])
-        if data:
-            anns = (data.get("responses") or [{}])[0].get("labelAnnotations") or []
-            return [a.get("description", "").strip() for a in anns if a.get("description")]
+        res = _gv_sdk().annotate_image({
+            "image": {"content": bytes(image)},
+            "features": [{"type_": getattr(vision.Feature.Type, f["type"]), **({"max_results": f["maxResults"]} if "maxResults" in f else {})} for f in features],
+        })
+        if res.error.code:
+            raise VisionApiError(res.error.message or f"code {res.error.code}")
+        vision_call_latency_ms.labels(provider="gv_sdk", op="annotate").observe((time.time() - start) * 1000)
+        vision_calls_total.labels(provider="gv_sdk", op="annotate", result="ok").inc()
     except Exception:
-        pass
+        vision_call_latency_ms.labels(provider="gv_sdk", op="annotate").observe((time.time() - start) * 1000)
+        vision_calls_total.labels(provider="gv_sdk", op="annotate", result="error").inc()
+        raise
+    # normalise the proto response to the REST field names so one parser serves both paths
+    return {
+        "labelAnnotations": [{"description": l.description} for l in (res.label_annotations or [])],
+        "localizedObjectAnnotations": [{"name": o.name} for o in (res.localized_object_annotations or [])],
+        "fullTextAnnotation": {"text": getattr(getattr(res, "full_text_annotation", None), "text", "") or ""},
+    }
 
-    # Fallback to SDK (service account)
-    client = vision.ImageAnnotatorClient()
-    img = vision.Image(content=_read_bytes(image_path))
-    res = client.label_detection(image=img, max_results=max_results)
-    return [l.description for l in (res.label_annotations or [])]
 
+async def gv_annotate(image: ImageBytes, features: Tuple[str, ...] = ("labels", "objects", "ocr"), max_results: int = 10) -> Dict[str, Any]:
+    # one images:annotate request for all features instead of one upload per feature
+    req = _gv_request_features(features, max_results)
+    variant = VisionCache.variant("gv", sorted(features), max_results)
+    cached, _how = await vision_cache.get(image, variant)
+    if cached is not None:
+        return cached
+    async with _semaphore("gv"):
+        out = None
+        try:
+            data = await _gv_annotate_api_key(image, req)
+            if data:
+                resp = (data.get("responses") or [{}])[0]
+                out = _gv_parse(resp, features)
+        except Exception:
+            pass
+        if out is None:
+            # Fallback to SDK (service account), off the loop; an error here propagates and nothing is cached
+            resp = await _offload(_gv_annotate_sdk, image, req, timeout=VISION_TIMEOUT_S)
+            out = _gv_parse(resp, features)
+    await vision_cache.put(image, variant, out)
+    return out
 
-def gv_objects(image_path: str) -> List[str]:
-    # Try API key via annotate
-    try:
-        data = _gv_annotate_api_key(image_path, [{"type": "OBJECT_LOCALIZATION"}])
-        if data:
-            anns = (data.get("responses") or [{}])[0].get("localizedObjectAnnotations") or []
-            return [a.get("name", "").strip() for a in anns if a.get("name")]
-    except Exception:
-        pass
 
-    # Fallback SDK
-    client = vision.ImageAnnotatorClient()
-    img = vision.Image(content=_read_bytes(image_path))
-    res = client.object_localization(image=img)
-    return [o.name for o in (res.localized_object_annotations or [])]
+async def gv_labels(image: ImageBytes, max_results: int = 10) -> List[str]:
+    return (await gv_annotate(image, ("labels",), max_results))["labels"]
 
 
-def gv_ocr(image_path: str) -> str:
-    # Try API key via annotate
-    try:
-        data = _gv_annotate_api_key(image_path, [{"type": "TEXT_DETECTION"}])
-        if data:
-            full = ((data.get("responses") or [{}])[0].get("fullTextAnnotation") or {}).get("text", "")
-            return (full or "").strip()
-    except Exception:
-        pass
+async def gv_objects(image: ImageBytes) -> List[str]:
+    return (await gv_annotate(image, ("objects",)))["objects"]
 
-    # Fallback SDK
-    client = vision.ImageAnnotatorClient()
-    img = vision.Image(content=_read_bytes(image_path))
-    res = client.text_detection(image=img)
-    return (getattr(getattr(res, "full_text_annotation", None), "text", "") or "").strip()
 
+async def gv_ocr(image: ImageBytes) -> str:
+    return (await gv_annotate(image, ("ocr",)))["ocr"]
 
-def analyze_with_gemini(image_path: str, prompt: str, models=("gemini-1.5-pro", "gemini-1.5-flash")) -> str:
+
+async def _gemini_rest(model: str, api_key: str, image: ImageBytes, mime: str, prompt: str) -> str:
+    body = {
+        "contents": [{
+            "role": "user",
+            "parts": [
+                {"text": prompt},
+                {"inline_data": {"mime_type": mime, "data": base64.b64encode(image).decode()}},
+            ],
+        }]
+    }
+    r = await _http().post(f"{GEMINI_REST.format(model=model)}?key={api_key}", json=body, timeout=GEMINI_TIMEOUT_S)
+    r.raise_for_status()
+    parts = r.json()["candidates"][0]["content"]["parts"]
+    return "".join(p.get("text", "") for p in parts)
+
+
+def _gemini_sdk(model_name: str, api_key: str, image: ImageBytes, mime: str, prompt: str) -> str:
+    model = clients.gemini_model(model_name, api_key)
+    resp = model.generate_content([{"mime_type": mime, "data": bytes(image)}, {"text": prompt}])
+    return getattr(resp, "text", str(resp))
+
+
+async def analyze_with_gemini(image: ImageBytes, prompt: str, models=("gemini-1.5-pro", "gemini-1.5-flash"), cache_prompt: Optional[str] = None) -> str:
+    # cache_prompt: the stable instruction to key the cache on when `prompt` embeds per-frame noise
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         return "Gemini API key missing"
-    genai.configure(api_key=api_key)
-    mime = _detect_mime(image_path)
+    mime = _detect_mime(image)
+    variant = VisionCache.variant("gemini", list(models), cache_prompt if cache_prompt is not None else prompt)
+    cached, _how = await vision_cache.get(image, variant)
+    if cached is not None:
+        return cached
     last_err = None
-    for m in models:
-        try:
-            model = genai.GenerativeModel(m)
+    async with _semaphore("gemini"):
+        for m in models:
+            start = time.time()
             try:
-                up = genai.upload_file(image_path, mime_type=mime)
-                parts = [{"text": prompt}, {"file_data": {"file_uri": up.uri, "mime_type": mime}}]
-                start = time.time()
-                resp = model.generate_content(parts)
+                try:
+                    text = await _gemini_rest(m, api_key, image, mime, prompt)
+                except Exception:
+                    # REST refused (quota/format): same request through the SDK in the executor
+                    text = await _offload(_gemini_sdk, m, api_key, image, mime, prompt, timeout=GEMINI_TIMEOUT_S)
                 latency_ms = (time.time() - start) * 1000
                 gemini_call_latency_ms.labels(model=m).observe(latency_ms)
                 gemini_calls_total.labels(model=m, result="ok").inc()
-                return getattr(resp, "text", str(resp))
-            except Exception:
-                with open(image_path, "rb") as f:
-                    img = f.read()
-                parts = [{"mime_type": mime, "data": img}, {"text": prompt}]
-                start = time.time()
-                resp = model.generate_content(parts)
-                latency_ms = (time.time() - start) * 1000
-                gemini_call_latency_ms.labels(model=m).observe(latency_ms)
-                gemini_calls_total.labels(model=m, result="ok").inc()
-                return getattr(resp, "text", str(resp))
-        except Exception as e:
-            gemini_calls_total.labels(model=m, result="error").inc()
-            last_err = str(e)
-            continue
+                await vision_cache.put(image, variant, text)
+                return text
+            except Exception as e:
+                gemini_calls_total.labels(model=m, result="error").inc()
+                last_err = str(e) or type(e).__name__
+                continue
     return f"Gemini error: {last_err or 'unknown'}"
-
-
-
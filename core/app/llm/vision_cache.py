@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from ..metrics import vision_cache_total, vision_cache_bytes
+
+
+PHASH_BANDS = 8  # 8 x 8-bit bands: any pair within 7 bits shares at least one band
+PHASH_MASK = 0xFFFFFFFFFFFFFFFF
+
+log = logging.getLogger(__name__)
+
+
+def _dhash(image: bytes) -> Optional[int]:
+    # 64-bit difference hash: robust to sensor noise, compression and small overlays
+    try:
+        import cv2
+        import numpy as np
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        # signed, so it fits SQLite's INTEGER column; compare under PHASH_MASK
+        return int(np.packbits(bits).view(">i8")[0])
+    except Exception:
+        return None
+
+
+class _Entry:
+    __slots__ = ("value", "size", "stored", "expires", "phash", "variant")
+
+    def __init__(self, value: Any, size: int, stored: float, expires: float, phash: Optional[int], variant: str) -> None:
+        self.value = value
+        self.size = size
+        self.stored = stored
+        self.expires = expires
+        self.phash = phash
+        self.variant = variant
+
+
+class VisionCache:
+    def __init__(
+        self,
+        max_bytes: int = int(os.getenv("VISION_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        ttl_s: float = float(os.getenv("VISION_CACHE_TTL_S", "3600")),
+        phash: bool = os.getenv("VISION_CACHE_PHASH", "0") == "1",
+        phash_distance: int = int(os.getenv("VISION_CACHE_PHASH_DIST", "6")),
+        phash_ttl_s: float = float(os.getenv("VISION_CACHE_PHASH_TTL_S", "30")),
+        db_path: str = os.getenv("VISION_CACHE_DB", ""),
+    ) -> None:
+        self._max_bytes = max_bytes
+        self._ttl_s = ttl_s
+        self._phash = phash
+        self._phash_distance = min(phash_distance, PHASH_BANDS - 1)
+        # a similar-looking frame is only trusted for a short while: the scene may have changed since
+        self._phash_ttl_s = phash_ttl_s
+        self._db_path = db_path
+        self._db: Any = None
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        # (variant, band index, band value) -> entry keys, for near-duplicate lookups
+        self._bands: Dict[Tuple[str, int, int], Set[str]] = {}
+        # sha256 -> dHash, so one frame is decoded once even when several ops look it up
+        self._phash_memo: "OrderedDict[str, Optional[int]]" = OrderedDict()
+
+    async def start(self) -> None:
+        if self._db_path and self._db is None:
+            import aiosqlite
+            self._db = await aiosqlite.connect(self._db_path)
+            await self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS vision_cache (
+                    key TEXT PRIMARY KEY,
+                    variant TEXT NOT NULL,
+                    phash INTEGER,
+                    value TEXT NOT NULL,
+                    expires REAL NOT NULL
+                );
+                """
+            )
+            await self._db.execute("DELETE FROM vision_cache WHERE expires < ?", (time.time(),))
+            await self._db.commit()
+
+    async def stop(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    @staticmethod
+    def variant(op: str, *parts: Any) -> str:
+        return op + ":" + json.dumps(parts, separators=(",", ":"), ensure_ascii=False)
+
+    async def _phash_of(self, digest: str, image: bytes) -> Optional[int]:
+        if digest in self._phash_memo:
+            self._phash_memo.move_to_end(digest)
+            return self._phash_memo[digest]
+        ph = await asyncio.to_thread(_dhash, image)
+        self._phash_memo[digest] = ph
+        if len(self._phash_memo) > 256:
+            self._phash_memo.popitem(last=False)
+        return ph
+
+    def _bands_of(self, ph: int):
+        for i in range(PHASH_BANDS):
+            yield i, (ph >> (8 * i)) & 0xFF
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        if entry.phash is not None:
+            for i, band in self._bands_of(entry.phash):
+                keys = self._bands.get((entry.variant, i, band))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._bands[(entry.variant, i, band)]
+
+    def _live(self, key: str, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def get(self, image: bytes, variant: str) -> Tuple[Optional[Any], str]:
+        op = variant.split(":", 1)[0]
+        now = time.time()
+        digest = hashlib.sha256(image).hexdigest()
+        key = f"{variant}|{digest}"
+        entry = self._live(key, now)
+        if entry is not None:
+            vision_cache_total.labels(op=op, result="hit").inc()
+            return entry.value, "hit"
+        if self._phash:
+            ph = await self._phash_of(digest, image)
+            if ph is not None:
+                best: Optional[Tuple[int, str]] = None
+                seen: Set[str] = set()
+                for i, band in self._bands_of(ph):
+                    for cand in list(self._bands.get((variant, i, band), ())):
+                        if cand in seen:
+                            continue
+                        seen.add(cand)
+                        ce = self._live(cand, now)
+                        if ce is None or ce.phash is None or now - ce.stored > self._phash_ttl_s:
+                            continue
+                        dist = bin((ce.phash ^ ph) & PHASH_MASK).count("1")
+                        if dist <= self._phash_distance and (best is None or dist < best[0]):
+                            best = (dist, cand)
+                if best is not None:
+                    vision_cache_total.labels(op=op, result="phash_hit").inc()
+                    return self._entries[best[1]].value, "phash_hit"
+        if self._db is not None:
+            async with self._db.execute("SELECT value, expires, phash FROM vision_cache WHERE key = ?", (key,)) as cur:
+                row = await cur.fetchone()
+            if row and row[1] >= now:
+                value = json.loads(row[0])
+                self._insert(key, variant, value, row[1] - self._ttl_s, row[1], row[2])
+                vision_cache_total.labels(op=op, result="hit").inc()
+                return value, "hit"
+        vision_cache_total.labels(op=op, result="miss").inc()
+        return None, "miss"
+
+    async def put(self, image: bytes, variant: str, value: Any) -> None:
+        digest = hashlib.sha256(image).hexdigest()
+        key = f"{variant}|{digest}"
+        now = time.time()
+        expires = now + self._ttl_s
+        ph = await self._phash_of(digest, image) if self._phash else None
+        self._insert(key, variant, value, now, expires, ph)
+        if self._db is not None:
+            try:
+                await self._db.execute(
+                    "INSERT OR REPLACE INTO vision_cache (key, variant, phash, value, expires) VALUES (?, ?, ?, ?, ?)",
+                    (key, variant, ph, json.dumps(value, ensure_ascii=False), expires),
+                )
+                await self._db.commit()
+            except Exception:
+                log.warning("vision cache: failed to persist %s", key, exc_info=True)
+                vision_cache_total.labels(op=variant.split(":", 1)[0], result="persist_error").inc()
+
+    def _insert(self, key: str, variant: str, value: Any, stored: float, expires: float, ph: Optional[int]) -> None:
+        self._drop(key)
+        try:
+            size = len(json.dumps(value, ensure_ascii=False)) + len(key)
+        except Exception:
+            return
+        if size > self._max_bytes:
+            return
+        self._entries[key] = _Entry(value, size, stored, expires, ph, variant)
+        self._bytes += size
+        if ph is not None:
+            for i, band in self._bands_of(ph):
+                self._bands.setdefault((variant, i, band), set()).add(key)
+        while self._bytes > self._max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+        vision_cache_bytes.set(self._bytes)
+
+
+vision_cache = VisionCache()
@@ -0,0 +1,186 @@
+import asyncio
+import itertools
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..events import bus
+from ..metrics import vision_jobs_total, vision_jobs_coalesced_total, vision_queue_depth, vision_job_wait_ms
+
+
+# lower runs first: security events jump ahead of automations and UI curiosity
+PRIORITIES = {"security": 0, "automation": 5, "ui": 10}
+
+
+class VisionQueueFull(Exception):
+    pass
+
+
+class VisionJobAborted(Exception):
+    pass
+
+
+class VisionJob:
+    def __init__(self, camera_id: str, prompt: str, priority: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.camera_id = camera_id
+        self.prompt = prompt
+        self.priority = priority
+        self.status = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.coalesced = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.camera_id, self.prompt)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "camera_id": self.camera_id,
+            "priority": self.priority,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "coalesced": self.coalesced,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class VisionJobQueue:
+    def __init__(
+        self,
+        runner: Callable[[str, str], Awaitable[Any]],
+        workers: int = int(os.getenv("VISION_JOB_WORKERS", "2")),
+        max_queue: int = int(os.getenv("VISION_JOB_QUEUE", "100")),
+        keep_s: float = float(os.getenv("VISION_JOB_KEEP_S", "600")),
+        max_jobs: int = 1000,
+    ) -> None:
+        self._runner = runner
+        self._workers_n = max(1, workers)
+        self._max_queue = max_queue
+        self._keep_s = keep_s
+        self._max_jobs = max_jobs
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._jobs: "OrderedDict[str, VisionJob]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], VisionJob] = {}
+        self._queued = 0
+
+    async def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.create_task(self._worker(), name=f"VisionJobQueue.worker-{i}") for i in range(self._workers_n)]
+
+    async def stop(self) -> None:
+        for t in self._workers:
+            t.cancel()
+        for t in self._workers:
+            try:
+                await t
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        self._queue = None
+        # queued jobs never ran and a cancelled worker may not have resolved its job: nobody may wait forever
+        for job in self._jobs.values():
+            self._abort(job, "Vision job queue stopped")
+        self._inflight.clear()
+        self._queued = 0
+        vision_queue_depth.set(0)
+
+    def get(self, job_id: str) -> Optional[VisionJob]:
+        return self._jobs.get(job_id)
+
+    def submit(self, camera_id: str, prompt: str, priority: str = "ui") -> VisionJob:
+        assert self._queue is not None, "Vision job queue not started"
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self._evict()
+        existing = self._inflight.get((camera_id, prompt))
+        if existing is not None:
+            # identical work already queued or running: share it
+            existing.coalesced += 1
+            vision_jobs_coalesced_total.inc()
+            if existing.status == "queued" and PRIORITIES[priority] < PRIORITIES[existing.priority]:
+                # re-queue at the higher priority; the stale heap entry is skipped by the workers
+                existing.priority = priority
+                self._queue.put_nowait((PRIORITIES[priority], next(self._seq), existing.id))
+            return existing
+        if self._queued >= self._max_queue:
+            raise VisionQueueFull("Vision job queue is full")
+        job = VisionJob(camera_id, prompt, priority)
+        self._jobs[job.id] = job
+        self._inflight[job.key] = job
+        self._queued += 1
+        vision_queue_depth.set(self._queued)
+        self._queue.put_nowait((PRIORITIES[priority], next(self._seq), job.id))
+        return job
+
+    async def wait(self, job: VisionJob, timeout: Optional[float] = None) -> Any:
+        # shield: a caller giving up must not cancel work other waiters share
+        return await asyncio.wait_for(asyncio.shield(job.future), timeout=timeout)
+
+    def _abort(self, job: VisionJob, reason: str) -> None:
+        if job.future.done():
+            return
+        job.status = "error"
+        job.error = reason
+        job.finished = job.finished or time.time()
+        job.future.set_exception(VisionJobAborted(reason))
+        # nobody may be awaiting; mark the exception retrieved
+        job.future.exception()
+
+    def _evict(self) -> None:
+        now = time.time()
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            done = job.status in ("done", "error")
+            if not done or (now - (job.finished or now) < self._keep_s and len(self._jobs) <= self._max_jobs):
+                break
+            self._jobs.popitem(last=False)
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            _prio, _seq, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+            job.status = "running"
+            job.started = time.time()
+            self._queued -= 1
+            vision_queue_depth.set(self._queued)
+            vision_job_wait_ms.labels(priority=job.priority).observe((job.started - job.created) * 1000)
+            try:
+                job.result = await self._runner(job.camera_id, job.prompt)
+                job.status = "done"
+                job.future.set_result(job.result)
+            except Exception as e:
+                job.status = "error"
+                job.error = str(e) or type(e).__name__
+                job.future.set_exception(e)
+                # nobody may be awaiting; mark the exception retrieved
+                job.future.exception()
+            except asyncio.CancelledError:
+                # fail the job either way; only a cancelled worker (shutdown) stops, a runner that merely
+                # raised CancelledError must not take the worker down with it
+                self._abort(job, "Vision job cancelled")
+                task = asyncio.current_task()
+                if task is not None and task.cancelling():
+                    raise
+            finally:
+                job.finished = time.time()
+                self._inflight.pop(job.key, None)
+            vision_jobs_total.labels(priority=job.priority, result=job.status).inc()
+            await bus.publish({"type": "vision_result", **job.to_dict(), "ts": time.time()})
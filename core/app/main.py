@@ -2,10 +2,10 @@ import os
 import asyncio
 import time
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Set
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,8 +14,10 @@ from prometheus_fastapi_instrumentator import Instrumentator
 from .config import ConfigLoader
 from .integration.mqtt_client import AsyncMqttClient
 from .tools.smarthome import SmartHomeTools
+from .tools.capture import CaptureScheduler
 from .state.context import HomeContextManager
 from .security.rbac import RBAC
+from .security.limiter import RateLimited, limiter
 from .audit import AuditLogger
 from .triggers.engine import TriggerEngine
 from .models import (
@@ -25,17 +27,30 @@ from .models import (
     CoverSetPositionReq,
     ArmSecurityReq,
     CameraSnapshotReq,
+    VisionJobReq,
 )
-from .metrics import tool_calls_total, tool_call_latency_ms, agent_commands_total
+from .metrics import tool_calls_total, tool_call_latency_ms, agent_commands_total, chat_plan_start_ms
 from .agent.supervisor import Supervisor
 from .metrics import rules_version
 from .api_router import router as router_api
 from .events import bus, format_sse
 from .analysis.analyzer import BackgroundAnalyzer
 from .storage.db import EventStore
+from .storage.export import MEDIA_TYPES, export_stream, resolve_format
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from .llm.router import generate_response
+from .llm.router import stream_response
+from .llm.model_router import model_router
+from .llm.clients import clients as llm_clients
+from .llm.vision_jobs import VisionJobAborted, VisionJobQueue, VisionQueueFull
+from .llm.vision import GEMINI_TIMEOUT_S, VISION_TIMEOUT_S, preload as vision_preload
+from .llm.vision_cache import vision_cache
+from .llm.frame_gate import frame_gate
+from .llm.response_cache import response_cache
+from .llm.context_builder import context_builder
+from .tracing import current_trace_id, tracer
+from .diagnostics.loop_monitor import loop_monitor
+from .diagnostics.profiler import profiler, to_collapsed, to_speedscope
 
 
 app = FastAPI(title="ΔΣ Guardian Core", version="0.1.0")
@@ -50,6 +65,47 @@ app.add_middleware(
 )
 Instrumentator().instrument(app).expose(app, include_in_schema=False, endpoint="/metrics")
 app.include_router(router_api)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # one root span per request; the trace id is accepted from and echoed to clients
+    trace_id = request.headers.get("X-Trace-Id") or str(uuid.uuid4())
+    with tracer.span("http.request", trace_id=trace_id, method=request.method, path=request.url.path) as sp:
+        response = await call_next(request)
+        sp.set(status=response.status_code)
+    response.headers["X-Trace-Id"] = trace_id
+    return response
+
+
+# POSTs that move devices or spend model/vision budget go through admission control; so does chat,
+# which can execute plans
+ADMISSION_PATHS = tuple(p for p in os.getenv("LIMIT_PATHS", "/tools/,/agent/command,/vision/jobs").split(",") if p)
+
+
+@app.middleware("http")
+async def admission(request: Request, call_next):
+    path = request.url.path
+    guarded = (request.method == "POST" and path.startswith(ADMISSION_PATHS)) or path == "/chat/stream"
+    if not guarded:
+        return await call_next(request)
+    # keyed on the peer, not on X-Actor: a client could send a fresh header per request and never run dry
+    actor = request.client.host if request.client else "unknown"
+    role = request.headers.get("X-Role", "admin")
+    tool = path[len("/tools/"):] if path.startswith("/tools/") else path
+    wait, scope = limiter.take_all([("actor", actor), ("role", role), ("tool", tool)])
+    if wait:
+        err = RateLimited(scope[0], scope[1], wait)
+        return JSONResponse({"detail": str(err)}, status_code=429, headers={"Retry-After": err.retry_after_header})
+    return await call_next(request)
+
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited) -> JSONResponse:
+    # raised deeper down, e.g. by the per-device bucket in SmartHomeTools
+    return JSONResponse({"detail": str(exc)}, status_code=429, headers={"Retry-After": exc.retry_after_header})
+
+
 static_dir = Path(os.getenv("STATIC_DIR", "/configs/static"))
 if static_dir.exists():
     app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
@@ -72,6 +128,8 @@ class AppState:
     supervisor: Optional[Supervisor] = None
     analyzer: Optional[BackgroundAnalyzer] = None
     store: Optional[EventStore] = None
+    vision_jobs: Optional[VisionJobQueue] = None
+    capture: Optional[CaptureScheduler] = None
     boot_ts: float = time.time()
 
 
@@ -81,7 +139,12 @@ state = AppState()
 @app.on_event("startup")
 async def on_startup() -> None:
     config_dir = os.getenv("CONFIG_DIR", "/configs")
+    await tracer.start()
+    model_router.load()
+    await llm_clients.start()
+    await loop_monitor.start()
     state.config_loader = ConfigLoader(config_dir=config_dir)
+    await state.audit.start()
     state.devices = state.config_loader.load_devices()
     state.rules = state.config_loader.load_rules()
 
@@ -100,6 +163,13 @@ async def on_startup() -> None:
     await state.mqtt.connect()
 
     state.tools = SmartHomeTools(mqtt=state.mqtt, devices=state.devices)
+    await state.tools.snapshots.start()
+    state.capture = CaptureScheduler(store=state.tools.snapshots, devices=state.devices or {})
+    await state.capture.start()
+    await vision_cache.start()
+    vision_preload()
+    state.vision_jobs = VisionJobQueue(runner=state.tools.analyze_snapshot)
+    await state.vision_jobs.start()
     state.context = HomeContextManager(
         host=mqtt_host,
         port=mqtt_port,
@@ -108,9 +178,11 @@ async def on_startup() -> None:
         devices_registry=state.devices,
     )
     await state.context.start()
+    response_cache.bind(state.context, state.devices)
+    context_builder.bind(state.devices)
     state.triggers = TriggerEngine(context=state.context, tools=state.tools, rules=state.rules or [])
     await state.triggers.start()
-    state.supervisor = Supervisor(state.tools)
+    state.supervisor = Supervisor(state.tools, plans=state.config_loader.load_plans(), devices=state.devices)
     state.analyzer = BackgroundAnalyzer(state.context)
     await state.analyzer.start()
     state.store = EventStore(path=os.getenv("DB_PATH", "/data/core.db"))
@@ -131,6 +203,18 @@ async def on_shutdown() -> None:
         await state.analyzer.stop()
     if state.store is not None:
         await state.store.stop()
+    if state.vision_jobs is not None:
+        await state.vision_jobs.stop()
+    if state.capture is not None:
+        await state.capture.stop()
+    if state.tools is not None:
+        await state.tools.streams.stop()
+        await state.tools.snapshots.stop()
+    await state.audit.stop()
+    await llm_clients.aclose()
+    await vision_cache.stop()
+    await tracer.stop()
+    await loop_monitor.stop()
     state.supervisor = None
 
 
@@ -145,34 +229,75 @@ async def ui_stream() -> StreamingResponse:
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+async def _chat_events() -> Any:
+    if state.store is None:
+        return []
+    try:
+        # state_update rows dominate the log; over-fetch so the builder still sees max_events others
+        return await state.store.recent(limit=context_builder.max_events * 4)
+    except Exception:
+        return []
+
+
+async def _chat_answer(q: str, snap: Dict[str, Any], events: "asyncio.Task", out: asyncio.Queue) -> None:
+    try:
+        # events are awaited only if the answer actually needs a model prompt
+        async for text in stream_response(q, snap, events):
+            await out.put(("chunk", {"text": text}))
+    except Exception:
+        await out.put(("chunk", {"text": "Ошибка генерации ответа."}))
+    finally:
+        out.put_nowait(None)
+
+
+async def _chat_actions(q: str, out: asyncio.Queue, t0: float) -> None:
+    try:
+        plan = await state.supervisor.plan_from_intent(q)
+        if plan:
+            chat_plan_start_ms.observe((time.time() - t0) * 1000)
+            await out.put(("action", {"phase": "planned", "steps": plan}))
+            steps = []
+            async for step in state.supervisor.iter_plan(plan, dry_run=False, require_confirm=False):
+                steps.append(step)
+                await out.put(("action", {"phase": "step", **step}))
+            await out.put(("action", {"phase": "done", "steps": sorted(steps, key=lambda r: r["index"])}))
+    except Exception as e:
+        await out.put(("action", {"phase": "error", "error": str(e)}))
+    finally:
+        out.put_nowait(None)
+
+
+# plans keep running if the chat client disconnects mid-answer; hold references until they finish
+_chat_plans: Set[asyncio.Task] = set()
+
+
 @app.get("/chat/stream")
 async def chat_stream(q: str, exec: bool = True) -> StreamingResponse:
     async def gen():
+        t0 = time.time()
         snap = state.context.snapshot() if state.context else {}
-        events = []
-        if state.store:
-            try:
-                events = await state.store.recent(limit=20)
-            except Exception:
-                events = []
-        # Try model via Router (Gemini), fallback to heuristic
-        try:
-            text = await generate_response(q, snap, events)
-        except Exception:
-            text = "Ошибка генерации ответа."
-        for token in text.split(" "):
-            yield format_sse("chunk", {"text": token + " "})
-            await asyncio.sleep(0.01)
-        # Optional intent execution via Supervisor (idempotent demo path)
+        out: asyncio.Queue = asyncio.Queue()
+        # event fetch, answer generation and intent planning run side by side; device actions start
+        # as soon as the plan is ready and their progress is interleaved with the answer chunks
+        events = asyncio.create_task(_chat_events())
+        answer = asyncio.create_task(_chat_answer(q, snap, events, out))
+        producers = 1
         if exec and state.supervisor:
-            try:
-                plan = await state.supervisor.plan_from_intent(q)
-                if plan:
-                    yield format_sse("chunk", {"text": "\n[Действия] запланировано: " + str(plan) + "\n"})
-                    steps = await state.supervisor.execute_plan(plan, dry_run=False, require_confirm=False)
-                    yield format_sse("chunk", {"text": "[Выполнено] " + str(steps) + "\n"})
-            except Exception as e:
-                yield format_sse("chunk", {"text": f"[Ошибка при выполнении действий] {e}\n"})
+            plan = asyncio.create_task(_chat_actions(q, out, t0))
+            _chat_plans.add(plan)
+            plan.add_done_callback(_chat_plans.discard)
+            producers += 1
+        try:
+            while producers:
+                item = await out.get()
+                if item is None:
+                    producers -= 1
+                    continue
+                yield format_sse(*item)
+        finally:
+            # client gone or stream finished: stop the model call, never a half-applied plan
+            answer.cancel()
+            events.cancel()
         yield format_sse("done", {"ok": True})
     return StreamingResponse(gen(), media_type="text/event-stream")
 
@@ -185,6 +310,113 @@ async def history_events(limit: int = 200, etype: Optional[str] = None) -> Dict[
     return {"events": rows}
 
 
+@app.get("/history/search")
+async def history_search(
+    q: Optional[str] = None,
+    entity: Optional[str] = None,
+    rule_id: Optional[str] = None,
+    kind: Optional[str] = None,
+    tool: Optional[str] = None,
+    etype: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 50,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    if state.store is None:
+        raise HTTPException(status_code=503, detail="Store not ready")
+    limit = max(1, min(int(limit), 500))
+    offset = max(0, int(offset))
+    rows = await state.store.search(
+        text=q,
+        attrs={"entity": entity, "rule_id": rule_id, "kind": kind, "tool": tool},
+        etype=etype,
+        since=since,
+        until=until,
+        limit=limit,
+        offset=offset,
+    )
+    next_offset = offset + limit if len(rows) == limit else None
+    return {"results": rows, "offset": offset, "next_offset": next_offset}
+
+
+@app.get("/history/export")
+async def history_export(
+    fmt: str = "ndjson",
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    etype: Optional[str] = None,
+    columns: Optional[str] = None,
+) -> StreamingResponse:
+    if state.store is None:
+        raise HTTPException(status_code=503, detail="Store not ready")
+    try:
+        out_fmt = resolve_format(fmt)
+        body = export_stream(out_fmt, state.store.iter_events(since=since, until=until, etype=etype), columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ext = {"ndjson": "ndjson", "csv": "csv", "arrow": "arrows", "parquet": "parquet"}[out_fmt]
+    headers = {"Content-Disposition": f'attachment; filename="events.{ext}"'}
+    return StreamingResponse(body, media_type=MEDIA_TYPES[out_fmt], headers=headers)
+
+
+@app.get("/audit/query")
+async def audit_query(
+    request: Request,
+    trace_id: Optional[str] = None,
+    action: Optional[str] = None,
+    role: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100,
+) -> Dict[str, Any]:
+    caller_role = request.headers.get("X-Role", "admin")
+    if not state.rbac.is_allowed(caller_role, "audit_query"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    limit = max(1, min(int(limit), 1000))
+    entries = await state.audit.query(trace_id=trace_id, action=action, role=role, since=since, until=until, limit=limit)
+    return {"entries": entries}
+
+
+@app.get("/traces")
+async def traces_recent(limit: int = 200) -> Dict[str, Any]:
+    return {"spans": tracer.recent(limit=max(1, min(int(limit), 2000)))}
+
+
+@app.get("/traces/{trace_id}")
+async def trace_get(trace_id: str) -> Dict[str, Any]:
+    spans = tracer.recent(trace_id=trace_id, limit=2000)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"trace_id": trace_id, "spans": spans}
+
+
+@app.get("/debug/loop")
+async def debug_loop(request: Request) -> Dict[str, Any]:
+    role = request.headers.get("X-Role", "admin")
+    if not state.rbac.is_allowed(role, "debug"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return {"stalls": loop_monitor.stalls()}
+
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 5.0, interval_ms: float = 5.0, fmt: str = "collapsed", all_threads: bool = False) -> Any:
+    role = request.headers.get("X-Role", "admin")
+    if not state.rbac.is_allowed(role, "profile"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if fmt not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="fmt must be collapsed or speedscope")
+    seconds = max(0.1, min(float(seconds), 60.0))
+    interval_s = max(1.0, min(float(interval_ms), 100.0)) / 1000.0
+    try:
+        result = await profiler.profile(seconds, interval_s=interval_s, all_threads=all_threads)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if fmt == "speedscope":
+        return JSONResponse(to_speedscope(result))
+    return PlainTextResponse(to_collapsed(result))
+
+
 @app.get("/health")
 async def health() -> Dict[str, Any]:
     return {
@@ -200,6 +432,29 @@ async def get_state() -> Dict[str, Any]:
     return state.context.snapshot() if state.context else {}
 
 
+@app.get("/camera/{camera_id}/stream.mjpeg")
+async def camera_stream(camera_id: str) -> StreamingResponse:
+    if state.tools is None:
+        raise HTTPException(status_code=503, detail="Tools not initialized")
+    # every subscribed id gets a channel, an upstream and metric series, so only registered cameras may open one
+    if (state.devices or {}).get(camera_id, {}).get("type") != "camera":
+        raise HTTPException(status_code=404, detail="Camera not found")
+    relay = state.tools.streams
+    return StreamingResponse(relay.subscribe(camera_id), media_type=relay.media_type())
+
+
+@app.get("/tools/camera_stream_info")
+async def tool_camera_stream_info(camera_id: str) -> Dict[str, Any]:
+    if state.tools is None:
+        raise HTTPException(status_code=503, detail="Tools not initialized")
+    return await state.tools.camera_stream_info(camera_id)
+
+
+@app.get("/capture/status")
+async def capture_status() -> Dict[str, Any]:
+    return state.capture.status() if state.capture else {"enabled": False}
+
+
 @app.get("/tools/camera_snapshot_url")
 async def tool_camera_snapshot_url(camera_id: str) -> Dict[str, Any]:
     if state.tools is None:
@@ -213,7 +468,7 @@ async def agent_command(payload: Dict[str, Any]) -> JSONResponse:
     if state.tools is None:
         raise HTTPException(status_code=503, detail="Tools not initialized")
 
-    trace_id = str(uuid.uuid4())
+    trace_id = current_trace_id() or str(uuid.uuid4())
     command = payload.get("command")
     dry_run = bool(payload.get("dry_run", False))
     role = payload.get("role", "admin")
@@ -234,7 +489,7 @@ async def agent_command(payload: Dict[str, Any]) -> JSONResponse:
             start = time.time()
             tool_res = await state.tools.control_light(device_id=device_id, state=state_on, brightness=brightness)
             latency_ms = (time.time() - start) * 1000
-            state.audit.log(actor="api", role=role, action="control_light", args=args, result="ok", latency_ms=latency_ms, trace_id=trace_id)
+            await state.audit.log(actor="api", role=role, action="control_light", args=args, result="ok", latency_ms=latency_ms, trace_id=trace_id)
             tool_calls_total.labels(tool="control_light", result="ok").inc()
             tool_call_latency_ms.labels(tool="control_light").observe(latency_ms)
             result.update({"result": tool_res, "status": "ok"})
@@ -287,7 +542,7 @@ async def tool_control_light(payload: ControlLightReq, request: Request) -> Dict
     start = time.time()
     res = await state.tools.control_light(payload.device_id, payload.state, payload.brightness)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="control_light", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="control_light", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="control_light", result="ok").inc()
     tool_call_latency_ms.labels(tool="control_light").observe(latency_ms)
     return {"result": res}
@@ -301,7 +556,7 @@ async def tool_set_thermostat(payload: SetThermostatReq, request: Request) -> Di
     start = time.time()
     res = await state.tools.set_thermostat(payload.device_id, float(payload.temperature))
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="set_thermostat", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="set_thermostat", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="set_thermostat", result="ok").inc()
     tool_call_latency_ms.labels(tool="set_thermostat").observe(latency_ms)
     return {"result": res}
@@ -315,7 +570,7 @@ async def tool_lock_door(payload: DeviceIdReq, request: Request) -> Dict[str, An
     start = time.time()
     res = await state.tools.lock_door(payload.device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="lock_door", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="lock_door", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="lock_door", result="ok").inc()
     tool_call_latency_ms.labels(tool="lock_door").observe(latency_ms)
     return {"result": res}
@@ -329,7 +584,7 @@ async def tool_unlock_door(payload: DeviceIdReq, request: Request) -> Dict[str,
     start = time.time()
     res = await state.tools.unlock_door(payload.device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="unlock_door", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="unlock_door", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="unlock_door", result="ok").inc()
     tool_call_latency_ms.labels(tool="unlock_door").observe(latency_ms)
     return {"result": res}
@@ -343,7 +598,7 @@ async def tool_cover_set_position(payload: CoverSetPositionReq, request: Request
     start = time.time()
     res = await state.tools.cover_set_position(payload.device_id, int(payload.position))
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="cover_set_position", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="cover_set_position", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="cover_set_position", result="ok").inc()
     tool_call_latency_ms.labels(tool="cover_set_position").observe(latency_ms)
     return {"result": res}
@@ -357,7 +612,7 @@ async def tool_switch_on(payload: DeviceIdReq, request: Request) -> Dict[str, An
     start = time.time()
     res = await state.tools.switch_on(payload.device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="switch_on", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="switch_on", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="switch_on", result="ok").inc()
     tool_call_latency_ms.labels(tool="switch_on").observe(latency_ms)
     return {"result": res}
@@ -371,7 +626,7 @@ async def tool_switch_off(payload: DeviceIdReq, request: Request) -> Dict[str, A
     start = time.time()
     res = await state.tools.switch_off(payload.device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="switch_off", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="switch_off", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="switch_off", result="ok").inc()
     tool_call_latency_ms.labels(tool="switch_off").observe(latency_ms)
     return {"result": res}
@@ -385,7 +640,7 @@ async def tool_siren_on(payload: DeviceIdReq, request: Request) -> Dict[str, Any
     start = time.time()
     res = await state.tools.siren_on(payload.device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="siren_on", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="siren_on", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="siren_on", result="ok").inc()
     tool_call_latency_ms.labels(tool="siren_on").observe(latency_ms)
     return {"result": res}
@@ -399,7 +654,7 @@ async def tool_siren_off(payload: DeviceIdReq, request: Request) -> Dict[str, An
     start = time.time()
     res = await state.tools.siren_off(payload.device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="siren_off", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="siren_off", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="siren_off", result="ok").inc()
     tool_call_latency_ms.labels(tool="siren_off").observe(latency_ms)
     return {"result": res}
@@ -414,7 +669,7 @@ async def tool_arm_security(payload: ArmSecurityReq, request: Request) -> Dict[s
     start = time.time()
     res = await state.tools.arm_security(mode)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="arm_security", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="arm_security", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="arm_security", result="ok").inc()
     tool_call_latency_ms.labels(tool="arm_security").observe(latency_ms)
     return {"result": res}
@@ -428,7 +683,7 @@ async def tool_disarm_security(request: Request) -> Dict[str, Any]:
     start = time.time()
     res = await state.tools.disarm_security()
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="disarm_security", args={}, result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="disarm_security", args={}, result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="disarm_security", result="ok").inc()
     tool_call_latency_ms.labels(tool="disarm_security").observe(latency_ms)
     return {"result": res}
@@ -442,7 +697,7 @@ async def tool_camera_snapshot(payload: CameraSnapshotReq, request: Request) ->
     start = time.time()
     res = await state.tools.camera_snapshot(payload.camera_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="camera_snapshot", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="camera_snapshot", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="camera_snapshot", result="ok").inc()
     tool_call_latency_ms.labels(tool="camera_snapshot").observe(latency_ms)
     return {"result": res}
@@ -450,19 +705,59 @@ async def tool_camera_snapshot(payload: CameraSnapshotReq, request: Request) ->
 
 @app.post("/tools/camera_analyze")
 async def tool_camera_analyze(payload: CameraSnapshotReq, request: Request) -> Dict[str, Any]:
-    if state.tools is None:
+    if state.tools is None or state.vision_jobs is None:
         raise HTTPException(status_code=503, detail="Tools not initialized")
     role = request.headers.get("X-Role", "admin")
     prompt = request.headers.get("X-Prompt", "Опиши сцену кратко по фактам.")
     start = time.time()
-    res = await state.tools.analyze_snapshot(payload.camera_id, prompt)
+    # goes through the job queue so concurrent requests for the same camera share one analysis
+    try:
+        job = state.vision_jobs.submit(payload.camera_id, prompt, priority="ui")
+    except VisionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    try:
+        # bounded by the provider timeouts of one analysis; the job itself keeps running for other waiters
+        res = await state.vision_jobs.wait(job, timeout=VISION_TIMEOUT_S + GEMINI_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Vision analysis timed out")
+    except VisionJobAborted as e:
+        raise HTTPException(status_code=503, detail=str(e))
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="camera_analyze", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="camera_analyze", args=payload.model_dump(), result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     tool_calls_total.labels(tool="camera_analyze", result="ok").inc()
     tool_call_latency_ms.labels(tool="camera_analyze").observe(latency_ms)
     return {"result": res}
 
 
+@app.post("/vision/jobs")
+async def vision_job_submit(payload: VisionJobReq, request: Request) -> JSONResponse:
+    if state.vision_jobs is None:
+        raise HTTPException(status_code=503, detail="Vision jobs not initialized")
+    role = request.headers.get("X-Role", "admin")
+    if not state.rbac.is_allowed(role, "camera_analyze"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        job = state.vision_jobs.submit(payload.camera_id, payload.prompt, priority=payload.priority)
+    except VisionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    await state.audit.log(actor="api", role=role, action="vision_job_submit", args=payload.model_dump(), result="accepted", latency_ms=0.0, trace_id=current_trace_id())
+    return JSONResponse({"job_id": job.id, "status": job.status, "coalesced": job.coalesced > 0}, status_code=202)
+
+
+@app.get("/vision/gate")
+async def vision_gate() -> Dict[str, Any]:
+    # last frame-change gate decision per camera
+    return {"cameras": frame_gate.decisions()}
+
+
+@app.get("/vision/jobs/{job_id}")
+async def vision_job_get(job_id: str) -> Dict[str, Any]:
+    job = state.vision_jobs.get(job_id) if state.vision_jobs else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @app.get("/tools/get_device_status")
 async def tool_get_device_status(device_id: str, request: Request) -> Dict[str, Any]:
     if state.tools is None:
@@ -471,7 +766,7 @@ async def tool_get_device_status(device_id: str, request: Request) -> Dict[str,
     start = time.time()
     res = await state.tools.get_device_status(device_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="get_device_status", args={"device_id": device_id}, result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="get_device_status", args={"device_id": device_id}, result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     return {"result": res}
 
 
@@ -483,7 +778,7 @@ async def tool_get_sensor_data(sensor_id: str, request: Request) -> Dict[str, An
     start = time.time()
     res = await state.tools.get_sensor_data(sensor_id)
     latency_ms = (time.time() - start) * 1000
-    state.audit.log(actor="api", role=role, action="get_sensor_data", args={"sensor_id": sensor_id}, result="ok", latency_ms=latency_ms, trace_id=None)
+    await state.audit.log(actor="api", role=role, action="get_sensor_data", args={"sensor_id": sensor_id}, result="ok", latency_ms=latency_ms, trace_id=current_trace_id())
     return {"result": res}
 
 
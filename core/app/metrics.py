@@ -15,19 +15,27 @@ tool_call_latency_ms = Histogram(
     buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2000),
 )
 
+# MQTT metrics are labelled by device type, not topic, to keep cardinality fixed as devices are added
 mqtt_publish_total = Counter(
     "mqtt_publish_total",
     "MQTT publish operations",
-    labelnames=("topic",),
+    labelnames=("device_type",),
 )
 
 mqtt_wait_time_ms = Histogram(
     "mqtt_wait_time_ms",
     "Wait time for MQTT state messages in ms",
-    labelnames=("topic",),
+    labelnames=("device_type",),
     buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2000, 5000),
 )
 
+mqtt_phase_latency_ms = Histogram(
+    "mqtt_phase_latency_ms",
+    "MQTT command phase latency in ms (publish, puback, first_state, matching_state)",
+    labelnames=("phase", "device_type"),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2000, 5000),
+)
+
 trigger_firings_total = Counter(
     "trigger_firings_total",
     "Number of trigger firings",
@@ -100,3 +108,304 @@ gemini_call_latency_ms = Histogram(
 )
 
 
+
+
+# Audit pipeline metrics
+audit_entries_total = Counter(
+    "audit_entries_total",
+    "Audit entries accepted",
+)
+
+audit_backpressure_total = Counter(
+    "audit_backpressure_total",
+    "Audit log calls that waited on a full buffer",
+)
+
+audit_queue_depth = Gauge(
+    "audit_queue_depth",
+    "Audit entries buffered and not yet written",
+)
+
+audit_flush_latency_ms = Histogram(
+    "audit_flush_latency_ms",
+    "Audit batch write latency in ms",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+
+
+# Event loop health
+event_loop_lag_ms = Histogram(
+    "event_loop_lag_ms",
+    "Event loop scheduling lag in ms",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+
+event_loop_stalls_total = Counter(
+    "event_loop_stalls_total",
+    "Event loop stalls longer than the stall threshold",
+)
+
+
+# Vision job queue
+vision_queue_depth = Gauge(
+    "vision_queue_depth",
+    "Vision jobs waiting for a worker",
+)
+
+vision_job_wait_ms = Histogram(
+    "vision_job_wait_ms",
+    "Time vision jobs spend queued before a worker picks them up",
+    labelnames=("priority",),
+    buckets=(5, 25, 100, 250, 500, 1000, 2500, 5000, 10000, 30000),
+)
+
+vision_jobs_total = Counter(
+    "vision_jobs_total",
+    "Vision jobs completed",
+    labelnames=("priority", "result"),
+)
+
+vision_jobs_coalesced_total = Counter(
+    "vision_jobs_coalesced_total",
+    "Vision submissions served by an identical in-flight job",
+)
+
+
+# Vision result cache
+vision_cache_total = Counter(
+    "vision_cache_total",
+    "Vision/Gemini cache lookups",
+    labelnames=("op", "result"),
+)
+
+vision_cache_bytes = Gauge(
+    "vision_cache_bytes",
+    "Approximate size of the in-memory vision cache",
+)
+
+
+# Local frame-change gate
+vision_gate_total = Counter(
+    "vision_gate_total",
+    "Frame-change gate decisions",
+    labelnames=("decision",),
+)
+
+vision_gate_score = Histogram(
+    "vision_gate_score",
+    "Fraction of changed pixels versus the last analysed frame",
+    buckets=(0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0),
+)
+
+
+# Snapshot storage
+snapshot_ops_total = Counter(
+    "snapshot_ops_total",
+    "Snapshot storage operations",
+    labelnames=("op", "result"),
+)
+
+snapshot_op_latency_ms = Histogram(
+    "snapshot_op_latency_ms",
+    "Snapshot storage operation latency",
+    labelnames=("op",),
+    buckets=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+
+
+# Periodic camera capture
+snapshot_captures_total = Counter(
+    "snapshot_captures_total",
+    "Scheduled camera captures by outcome (ok, error, dropped_busy, dropped_late)",
+    labelnames=("result",),
+)
+
+snapshot_capture_lag_ms = Histogram(
+    "snapshot_capture_lag_ms",
+    "Delay between a capture's scheduled time and its start",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+
+snapshot_capture_inflight = Gauge(
+    "snapshot_capture_inflight",
+    "Camera captures currently fetching or uploading",
+)
+
+
+# MJPEG live-stream relay
+stream_viewers = Gauge(
+    "stream_viewers",
+    "Connected live-stream viewers",
+    labelnames=("camera_id",),
+)
+
+stream_upstreams = Gauge(
+    "stream_upstreams",
+    "Open upstream camera connections",
+)
+
+stream_frames_total = Counter(
+    "stream_frames_total",
+    "Frames received from upstream cameras",
+    labelnames=("camera_id",),
+)
+
+stream_frames_dropped_total = Counter(
+    "stream_frames_dropped_total",
+    "Frames dropped for slow viewers",
+    labelnames=("camera_id",),
+)
+
+
+# LLM chat streaming
+llm_ttft_ms = Histogram(
+    "llm_ttft_ms",
+    "Time to first streamed chunk",
+    labelnames=("backend",),
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+
+llm_streams_total = Counter(
+    "llm_streams_total",
+    "Chat response streams by outcome",
+    labelnames=("backend", "result"),
+)
+
+
+# Model router
+router_requests_total = Counter(
+    "router_requests_total",
+    "Model router backend attempts",
+    labelnames=("backend", "result"),
+)
+
+router_ttft_ms = Histogram(
+    "router_ttft_ms",
+    "Backend time to first chunk",
+    labelnames=("backend",),
+    buckets=(25, 50, 100, 200, 400, 600, 1000, 2000, 4000, 8000),
+)
+
+router_hedges_total = Counter(
+    "router_hedges_total",
+    "Hedged requests fired after the primary exceeded its budget, and how many the hedge won",
+    labelnames=("result",),
+)
+
+router_backend_ewma_ms = Gauge(
+    "router_backend_ewma_ms",
+    "EWMA time to first chunk per backend",
+    labelnames=("backend",),
+)
+
+router_backend_error_rate = Gauge(
+    "router_backend_error_rate",
+    "EWMA error rate per backend",
+    labelnames=("backend",),
+)
+
+
+# Outbound LLM/vision HTTP client pools
+llm_http_clients_created_total = Counter(
+    "llm_http_clients_created_total",
+    "HTTP clients built per pool (stays at 1 per pool while keep-alive reuse works)",
+    labelnames=("pool",),
+)
+
+llm_http_requests_total = Counter(
+    "llm_http_requests_total",
+    "Requests sent through pooled LLM/vision HTTP clients",
+    labelnames=("pool",),
+)
+
+llm_http_pool_connections = Gauge(
+    "llm_http_pool_connections",
+    "Open connections per client pool",
+    labelnames=("pool", "state"),
+)
+
+llm_model_handles = Gauge(
+    "llm_model_handles",
+    "Cached SDK model handles",
+)
+
+
+# Chat response cache
+response_cache_total = Counter(
+    "response_cache_total",
+    "Chat response cache lookups by outcome",
+    labelnames=("result",),
+)
+
+response_cache_entries = Gauge(
+    "response_cache_entries",
+    "Cached chat answers",
+)
+
+
+# LLM prompt context
+llm_context_tokens = Histogram(
+    "llm_context_tokens",
+    "Estimated tokens in the built chat context",
+    buckets=(64, 128, 256, 384, 512, 768, 1024, 2048),
+)
+
+llm_context_lines_dropped_total = Counter(
+    "llm_context_lines_dropped_total",
+    "State/event lines left out of chat context by the token budget",
+)
+
+
+# Chat pipeline
+chat_plan_start_ms = Histogram(
+    "chat_plan_start_ms",
+    "Time from chat request to the start of plan execution",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+
+
+# Plan executor
+agent_plan_steps_total = Counter(
+    "agent_plan_steps_total",
+    "Plan steps by outcome (ok, err, skipped, timeout, rate_limited, ...)",
+    labelnames=("status",),
+)
+
+agent_plan_latency_ms = Histogram(
+    "agent_plan_latency_ms",
+    "Wall time of a whole plan",
+    buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000),
+)
+
+
+# Intent matching
+intent_matches_total = Counter(
+    "intent_matches_total",
+    "Intents matched to a plan template",
+    labelnames=("template",),
+)
+
+plan_cache_total = Counter(
+    "plan_cache_total",
+    "Plan cache lookups by outcome (hit, miss, no_match)",
+    labelnames=("result",),
+)
+
+
+# Rate limiting / admission control
+ratelimit_decisions_total = Counter(
+    "ratelimit_decisions_total",
+    "Token-bucket decisions by scope (actor, role, tool, device, critical, rule...)",
+    labelnames=("scope", "result"),
+)
+
+ratelimit_buckets = Gauge(
+    "ratelimit_buckets",
+    "Live token buckets (full, idle buckets are evicted)",
+)
+
+# Event history store
+events_store_dropped_total = Counter(
+    "events_store_dropped_total",
+    "Events that could not be written to the history store",
+)
@@ -30,3 +30,9 @@ class CameraSnapshotReq(BaseModel):
     camera_id: str
 
 
+
+
+class VisionJobReq(BaseModel):
+    camera_id: str
+    prompt: str = "Опиши сцену кратко по фактам."
+    priority: str = Field(default="ui", pattern="^(security|automation|ui)$")
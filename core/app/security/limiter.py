@@ -0,0 +1,144 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from ..metrics import ratelimit_decisions_total, ratelimit_buckets
+
+
+class RateLimited(Exception):
+    def __init__(self, scope: str, key: str, retry_after: float) -> None:
+        super().__init__(f"Rate limited ({scope}:{key}); retry in {retry_after:.1f}s")
+        self.scope = scope
+        self.key = key
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class _Bucket:
+    __slots__ = ("tokens", "stamp", "rate", "burst")
+
+    def __init__(self, burst: float, rate: float, now: float) -> None:
+        self.tokens = burst
+        self.stamp = now
+        self.rate = rate
+        self.burst = burst
+
+    def refill(self, now: float, rate: float, burst: float) -> None:
+        self.tokens = min(burst, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        self.rate = rate
+        self.burst = burst
+
+
+def _env_policy(name: str, per_min: str, burst: str) -> Tuple[float, float]:
+    return float(os.getenv(f"LIMIT_{name}_PER_MIN", per_min)), float(os.getenv(f"LIMIT_{name}_BURST", burst))
+
+
+class RateLimiter:
+    def __init__(self, max_buckets: int = int(os.getenv("LIMIT_MAX_BUCKETS", "10000"))) -> None:
+        # scope -> (tokens per minute, burst); callers may override per key (e.g. per-rule limits)
+        self._policies: Dict[str, Tuple[float, float]] = {
+            "actor": _env_policy("ACTOR", "120", "30"),
+            "role": _env_policy("ROLE", "600", "100"),
+            "tool": _env_policy("TOOL", "300", "50"),
+            "device": _env_policy("DEVICE", "60", "10"),
+            "critical": _env_policy("CRITICAL", "3", "3"),
+        }
+        self._max_buckets = max_buckets
+        # least recently used first, so idle eviction only ever looks at the front
+        self._buckets: "OrderedDict[Tuple[str, str], _Bucket]" = OrderedDict()
+        ratelimit_buckets.set_function(lambda: len(self._buckets))
+
+    def configure(self, scope: str, per_min: float, burst: float) -> None:
+        self._policies[scope] = (float(per_min), float(burst))
+
+    def _policy(self, scope: str, per_min: Optional[float], burst: Optional[float]) -> Tuple[float, float]:
+        default_rate, default_burst = self._policies.get(scope, (60.0, 10.0))
+        rate = (per_min if per_min is not None else default_rate) / 60.0
+        return rate, float(burst if burst is not None else default_burst)
+
+    def _bucket(self, scope: str, key: str, rate: float, burst: float, now: float) -> Optional[_Bucket]:
+        b = self._buckets.get((scope, key))
+        if b is None:
+            if not self._evict(now):
+                return None
+            b = _Bucket(burst, rate, now)
+            self._buckets[(scope, key)] = b
+        else:
+            b.refill(now, rate, burst)
+            self._buckets.move_to_end((scope, key))
+        return b
+
+    def _evict(self, now: float) -> bool:
+        # a bucket that has refilled to burst is indistinguishable from a new one, so dropping it is free.
+        # Partly drained buckets are never dropped (that would hand out a fresh burst); at the cap a few
+        # are rotated to the back looking for a full one, and if none turns up the new key is refused
+        probes = 0
+        while self._buckets:
+            k, b = next(iter(self._buckets.items()))
+            if b.tokens + (now - b.stamp) * b.rate >= b.burst:
+                del self._buckets[k]
+                continue
+            if len(self._buckets) < self._max_buckets:
+                return True
+            if probes >= 8:
+                return False
+            self._buckets.move_to_end(k)
+            probes += 1
+        return True
+
+    def check(self, scope: str, key: str, per_min: Optional[float] = None, burst: Optional[float] = None, cost: float = 1.0) -> float:
+        # seconds until `cost` tokens are available; 0 means it would be allowed. Nothing is consumed
+        rate, burst = self._policy(scope, per_min, burst)
+        if rate <= 0:
+            return 0.0
+        b = self._bucket(scope, key, rate, burst, time.monotonic())
+        if b is None:
+            # too many active keys: fail closed until some buckets refill
+            return 1.0
+        return 0.0 if b.tokens >= cost else (cost - b.tokens) / rate
+
+    def take(self, scope: str, key: str, per_min: Optional[float] = None, burst: Optional[float] = None, cost: float = 1.0) -> float:
+        wait = self.check(scope, key, per_min, burst, cost)
+        if wait:
+            ratelimit_decisions_total.labels(scope=scope, result="shed").inc()
+            return wait
+        rate, _ = self._policy(scope, per_min, burst)
+        if rate > 0:
+            self._buckets[(scope, key)].tokens -= cost
+        ratelimit_decisions_total.labels(scope=scope, result="allowed").inc()
+        return 0.0
+
+    def take_all(self, keys: Iterable[Tuple[str, str]]) -> Tuple[float, Optional[Tuple[str, str]]]:
+        # all-or-nothing admission across several buckets: nothing is consumed unless every one has room
+        keys = list(keys)
+        for scope, key in keys:
+            wait = self.check(scope, key)
+            if wait:
+                ratelimit_decisions_total.labels(scope=scope, result="shed").inc()
+                return wait, (scope, key)
+        for scope, key in keys:
+            self.take(scope, key)
+        return 0.0, None
+
+    def require(self, scope: str, key: str, per_min: Optional[float] = None, burst: Optional[float] = None) -> None:
+        wait = self.take(scope, key, per_min, burst)
+        if wait:
+            raise RateLimited(scope, key, wait)
+
+    def refund(self, scope: str, key: str, cost: float = 1.0) -> None:
+        b = self._buckets.get((scope, key))
+        if b is not None:
+            b.tokens = min(b.burst, b.tokens + cost)
+
+    def reset(self, scope: str) -> None:
+        for k in [k for k in self._buckets if k[0] == scope]:
+            del self._buckets[k]
+
+
+limiter = RateLimiter()
@@ -1,7 +1,7 @@
 import asyncio
 import json
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 from aiomqtt import Client as MqttClient
 from ..events import bus
@@ -34,9 +34,31 @@ class HomeContextManager:
             "ts": time.time(),
         }
         self._task: Optional[asyncio.Task] = None
+        # change counters: one global, one per device / zone / security mode; caches key on these
+        self._version = 0
+        self._versions: Dict[str, int] = {}
 
     def snapshot(self) -> Dict[str, Any]:
-        return self._state.copy()
+        snap = self._state.copy()
+        snap["version"] = self._version
+        return snap
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def versions(self, keys: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(self._versions.get(k, 0) for k in keys)
+
+    def _bump(self, *keys: str) -> None:
+        self._version += 1
+        for k in keys:
+            if k:
+                self._versions[k] = self._versions.get(k, 0) + 1
+
+    def _zone_key(self, entity_id: str) -> str:
+        room = (self._registry.get(entity_id) or {}).get("room")
+        return f"zone:{room}" if room else ""
 
     async def start(self) -> None:
         if self._task is None:
@@ -84,9 +106,20 @@ class HomeContextManager:
             async with self._lock:
                 self._state["devices"][entity_id] = data
                 self._state["ts"] = time.time()
+                self._bump(entity_id)
             await bus.publish({"type": "vision_event", "topic": entity_id, "data": data, "ts": time.time()})
             return
 
+        if topic == "home/security/state":
+            mode = data.get("mode")
+            if mode:
+                async with self._lock:
+                    self._state["security_mode"] = mode
+                    self._state["ts"] = time.time()
+                    self._bump("security_mode")
+                await bus.publish({"type": "state_update", "snapshot": self._state.copy()})
+            return
+
         if len(parts) < 4:
             return
         kind, _, entity_id, path = parts[0], parts[1], parts[2], parts[3]
@@ -96,6 +129,7 @@ class HomeContextManager:
                     self._state["devices"][entity_id] = {}
                 self._state["devices"][entity_id] = data
                 self._state["ts"] = time.time()
+                self._bump(entity_id, self._zone_key(entity_id))
                 device_meta = self._registry.get(entity_id)
                 if device_meta:
                     room = device_meta.get("room")
@@ -119,6 +153,7 @@ class HomeContextManager:
         async with self._lock:
             self._state["devices"][entity_id] = data
             self._state["ts"] = time.time()
+            self._bump(entity_id, self._zone_key(entity_id))
             device_meta = self._registry.get(entity_id)
             if device_meta:
                 room = device_meta.get("room")
@@ -1,19 +1,72 @@
 import asyncio
 import json
+import logging
+import os
 import aiosqlite
-from typing import Any, Dict, Optional, List
+from typing import Any, AsyncIterator, Dict, Optional, List, Tuple
+
+from ..metrics import events_store_dropped_total
+
+
+# attribute columns extracted from payloads at write time so searches never parse JSON
+ATTR_COLUMNS = ("entity", "rule_id", "kind", "tool")
+# bumped whenever _extract_attrs changes, so stored rows are re-extracted once (PRAGMA user_version)
+ATTRS_VERSION = 2
+INSERT_EVENT = "INSERT INTO events (ts, type, payload, entity, rule_id, kind, tool) VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+log = logging.getLogger(__name__)
+
+
+def _extract_attrs(ev: Dict[str, Any]) -> Tuple[Optional[str], ...]:
+    data = ev.get("data") if isinstance(ev.get("data"), dict) else {}
+    args = ev.get("args") if isinstance(ev.get("args"), dict) else {}
+    entity = ev.get("device_id") or ev.get("camera_id") or args.get("device_id") or args.get("camera_id")
+    if not entity and ev.get("topic"):
+        # vision/events/<camera_id> -> <camera_id>
+        entity = str(ev["topic"]).rsplit("/", 1)[-1]
+    entity = entity or ev.get("room")
+    kind = ev.get("kind") or data.get("kind")
+    # audit entries name the tool they record in `action`
+    tool = ev.get("tool") or (ev.get("action") if ev.get("type") == "audit_log" else None)
+    vals = (entity, ev.get("rule_id"), kind, tool)
+    return tuple(str(v) if v is not None else None for v in vals)
+
+
+def _fts_query(text: str) -> str:
+    # quote every term so user input cannot inject FTS syntax; a trailing * keeps prefix search
+    terms = []
+    for raw in text.split():
+        prefix = raw.endswith("*")
+        term = raw.rstrip("*").replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
 
 
 class EventStore:
-    def __init__(self, path: str = "/data/core.db") -> None:
+    def __init__(
+        self,
+        path: str = "/data/core.db",
+        batch_size: int = int(os.getenv("EVENTS_BATCH_SIZE", "200")),
+        flush_interval_s: float = float(os.getenv("EVENTS_FLUSH_MS", "250")) / 1000.0,
+    ) -> None:
         self._path = path
         self._db: Optional[aiosqlite.Connection] = None
         self._task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
         self._bus = None
+        self._batch_size = max(1, batch_size)
+        self._flush_interval_s = flush_interval_s
+        self._pending: List[Tuple[Any, ...]] = []
+        self._flush_lock = asyncio.Lock()
+        # whole-home snapshots mention every device; indexing them would drown real matches
+        self._fts_skip = tuple(t for t in os.getenv("EVENTS_FTS_SKIP_TYPES", "state_update").split(",") if t)
 
     async def start(self, bus) -> None:
         self._bus = bus
         self._db = await aiosqlite.connect(self._path)
+        # WAL lets long-running exports read on their own connection without blocking the writer
+        await self._db.execute("PRAGMA journal_mode=WAL")
         await self._db.execute(
             """
             CREATE TABLE IF NOT EXISTS events (
@@ -24,19 +77,84 @@ class EventStore:
             );
             """
         )
+        async with self._db.execute("PRAGMA table_info(events)") as cur:
+            existing = {row[1] async for row in cur}
+        for col in ATTR_COLUMNS:
+            if col not in existing:
+                await self._db.execute(f"ALTER TABLE events ADD COLUMN {col} TEXT")
+        await self._db.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+        await self._db.execute("CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events (type, ts)")
+        for col in ATTR_COLUMNS:
+            await self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_events_{col}_ts ON events ({col}, ts)")
+        async with self._db.execute("PRAGMA user_version") as cur:
+            version = (await cur.fetchone())[0]
+        if version < ATTRS_VERSION:
+            # rows stored before the attribute columns existed (or before _extract_attrs last changed) are filled
+            # in once; user_version marks it done, so an interrupted backfill resumes on the next start
+            await self._backfill_attrs()
+            await self._db.execute(f"PRAGMA user_version = {ATTRS_VERSION}")
+        # external-content FTS over the stored payload; kept in sync by an insert trigger
+        async with self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'events_fts'") as cur:
+            fts_exists = await cur.fetchone() is not None
+        await self._db.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+                payload, content='events', content_rowid='id', tokenize="unicode61 tokenchars '_'"
+            );
+            """
+        )
+        skip = ", ".join("'" + t.replace("'", "''") + "'" for t in self._fts_skip) or "''"
+        if not fts_exists:
+            # the trigger only covers new rows; history already in the table is indexed once here
+            await self._db.execute(f"INSERT INTO events_fts (rowid, payload) SELECT id, payload FROM events WHERE type NOT IN ({skip})")
+        await self._db.execute("DROP TRIGGER IF EXISTS events_fts_ai")
+        await self._db.execute(
+            f"""
+            CREATE TRIGGER events_fts_ai AFTER INSERT ON events
+            WHEN new.type NOT IN ({skip})
+            BEGIN
+                INSERT INTO events_fts (rowid, payload) VALUES (new.id, new.payload);
+            END;
+            """
+        )
         await self._db.commit()
         if self._task is None:
             self._task = asyncio.create_task(self._consume())
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _backfill_attrs(self, chunk: int = 1000) -> None:
+        assert self._db is not None
+        last = 0
+        while True:
+            async with self._db.execute("SELECT id, payload FROM events WHERE id > ? ORDER BY id LIMIT ?", (last, chunk)) as cur:
+                rows = await cur.fetchall()
+            if not rows:
+                return
+            updates = []
+            for row_id, payload in rows:
+                try:
+                    ev = json.loads(payload)
+                except Exception:
+                    continue
+                if isinstance(ev, dict):
+                    updates.append(_extract_attrs(ev) + (row_id,))
+            await self._db.executemany("UPDATE events SET entity = ?, rule_id = ?, kind = ?, tool = ? WHERE id = ?", updates)
+            await self._db.commit()
+            last = rows[-1][0]
 
     async def stop(self) -> None:
-        if self._task is not None:
-            self._task.cancel()
-            try:
-                await self._task
-            except asyncio.CancelledError:
-                pass
-            self._task = None
+        for task in (self._task, self._flush_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._flush_task = None
         if self._db is not None:
+            await self._flush()
             await self._db.close()
             self._db = None
 
@@ -51,15 +169,49 @@ class EventStore:
                 payload = json.dumps(ev, separators=(",", ":"))
             except Exception:
                 continue
+            self._pending.append((ts, etype, payload) + _extract_attrs(ev))
+            if len(self._pending) >= self._batch_size:
+                await self._flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval_s)
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._pending or self._db is None:
+            return
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
             try:
-                await self._db.execute(
-                    "INSERT INTO events (ts, type, payload) VALUES (?, ?, ?)",
-                    (ts, etype, payload),
-                )
-                await self._db.commit()
+                # one transaction per batch instead of one commit per event
+                await self._insert(batch)
+            except Exception:
+                log.warning("event store: batch of %d failed, retrying row by row", len(batch), exc_info=True)
+                # one bad row fails the whole batch; row by row, only the rows that still fail are lost
+                dropped = 0
+                for row in batch:
+                    try:
+                        await self._insert([row])
+                    except Exception:
+                        dropped += 1
+                if dropped:
+                    log.warning("event store: dropped %d of %d events", dropped, len(batch))
+                    events_store_dropped_total.inc(dropped)
+
+    async def _insert(self, rows: List[Tuple[Any, ...]]) -> None:
+        assert self._db is not None
+        try:
+            await self._db.executemany(INSERT_EVENT, rows)
+            await self._db.commit()
+        except Exception:
+            try:
+                await self._db.rollback()
             except Exception:
-                # ignore db write errors to not break the loop
                 pass
+            raise
 
     async def recent(self, limit: int = 200, etype: Optional[str] = None) -> List[Dict[str, Any]]:
         assert self._db is not None
@@ -80,4 +232,87 @@ class EventStore:
                 rows.append(data)
         return rows
 
+    async def search(
+        self,
+        text: Optional[str] = None,
+        attrs: Optional[Dict[str, Optional[str]]] = None,
+        etype: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        assert self._db is not None
+        where: List[str] = []
+        args: List[Any] = []
+        match = _fts_query(text or "")
+        if match:
+            q = (
+                "SELECT e.ts, e.type, e.payload, bm25(events_fts) AS rank "
+                "FROM events_fts JOIN events e ON e.id = events_fts.rowid"
+            )
+            where.append("events_fts MATCH ?")
+            args.append(match)
+            order = "rank, e.id DESC"
+        else:
+            q = "SELECT e.ts, e.type, e.payload, NULL AS rank FROM events e"
+            order = "e.id DESC"
+        for col, val in (attrs or {}).items():
+            if col in ATTR_COLUMNS and val:
+                where.append(f"e.{col} = ?")
+                args.append(val)
+        if etype:
+            where.append("e.type = ?")
+            args.append(etype)
+        if since is not None:
+            where.append("e.ts >= ?")
+            args.append(float(since))
+        if until is not None:
+            where.append("e.ts < ?")
+            args.append(float(until))
+        if where:
+            q += " WHERE " + " AND ".join(where)
+        q += f" ORDER BY {order} LIMIT ? OFFSET ?"
+        args += [int(limit), int(offset)]
+        rows = []
+        async with self._db.execute(q, args) as cur:
+            async for ts, typ, payload, rank in cur:
+                try:
+                    data = json.loads(payload)
+                except Exception:
+                    data = {"type": typ, "ts": ts}
+                rows.append({"event": data, "score": (round(-rank, 4) if rank is not None else None)})
+        return rows
 
+    async def iter_events(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        etype: Optional[str] = None,
+        chunk: int = 500,
+    ) -> AsyncIterator[List[Tuple[float, str, str]]]:
+        # yields (ts, type, payload) rows oldest-first, holding at most one chunk in memory
+        assert self._db is not None
+        # pin the upper bound so rows written during a long export are not picked up
+        async with self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events") as cur:
+            row = await cur.fetchone()
+        max_id = int(row[0]) if row else 0
+        q = "SELECT ts, type, payload FROM events WHERE id <= ?"
+        args: List[Any] = [max_id]
+        if since is not None:
+            q += " AND ts >= ?"
+            args.append(float(since))
+        if until is not None:
+            q += " AND ts < ?"
+            args.append(float(until))
+        if etype:
+            q += " AND type = ?"
+            args.append(etype)
+        q += " ORDER BY id ASC"
+        async with aiosqlite.connect(self._path) as db:
+            async with db.execute(q, args) as cur:
+                while True:
+                    rows = await cur.fetchmany(chunk)
+                    if not rows:
+                        break
+                    yield list(rows)
@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency; columnar export falls back to CSV
+    pa = None
+    pq = None
+
+
+# Rows as produced by EventStore.iter_events: (ts, type, payload_json)
+Row = Tuple[float, str, str]
+
+DEFAULT_COLUMNS = "topic,device_id,room,kind,rule_id,tool,result,lat_ms:float,data.kind,data.value"
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_CASTS = {
+    "str": str,
+    "float": float,
+    "int": int,
+    "bool": bool,
+}
+
+
+def resolve_format(fmt: str) -> str:
+    fmt = (fmt or "ndjson").lower()
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if fmt in ("arrow", "parquet") and pa is None:
+        return "csv"
+    return fmt
+
+
+def parse_columns(spec: Optional[str]) -> List[Tuple[str, str]]:
+    # "topic,lat_ms:float,data.kind" -> [("topic", "str"), ("lat_ms", "float"), ("data.kind", "str")]
+    cols: List[Tuple[str, str]] = []
+    for part in (spec or DEFAULT_COLUMNS).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, typ = part.partition(":")
+        typ = typ or "str"
+        if typ not in _CASTS:
+            raise ValueError(f"Unsupported column type: {typ}")
+        cols.append((name, typ))
+    return cols
+
+
+def _project(data: Dict[str, Any], path: str, typ: str) -> Any:
+    cur: Any = data
+    for key in path.split("."):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(key)
+        if cur is None:
+            return None
+    if isinstance(cur, (dict, list)):
+        return json.dumps(cur, separators=(",", ":")) if typ == "str" else None
+    try:
+        return _CASTS[typ](cur)
+    except (TypeError, ValueError):
+        return None
+
+
+def _project_rows(rows: Sequence[Row], columns: List[Tuple[str, str]]) -> List[List[Any]]:
+    out: List[List[Any]] = []
+    for ts, typ, payload in rows:
+        try:
+            data = json.loads(payload)
+        except Exception:
+            data = {}
+        out.append([ts, typ] + [_project(data, name, ctype) for name, ctype in columns])
+    return out
+
+
+async def ndjson_stream(batches: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    # payloads are stored as compact JSON already, so they are passed through without re-encoding
+    async for rows in batches:
+        yield "".join(payload + "\n" for _, _, payload in rows).encode("utf-8")
+
+
+async def csv_stream(batches: AsyncIterator[List[Row]], columns: List[Tuple[str, str]]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["ts", "type"] + [name for name, _ in columns])
+    async for rows in batches:
+        writer.writerows(_project_rows(rows, columns))
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    tail = buf.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+
+class _Drain(io.RawIOBase):
+    # Write-only sink that hands out whatever pyarrow wrote since the last take()
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Any) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(columns: List[Tuple[str, str]]) -> Any:
+    types = {"str": pa.string(), "float": pa.float64(), "int": pa.int64(), "bool": pa.bool_()}
+    fields = [pa.field("ts", pa.float64()), pa.field("type", pa.string())]
+    fields += [pa.field(name, types[ctype]) for name, ctype in columns]
+    return pa.schema(fields)
+
+
+def _record_batch(schema: Any, rows: List[List[Any]]) -> Any:
+    arrays = [pa.array([r[i] for r in rows], type=schema.field(i).type) for i in range(len(schema))]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def arrow_stream(batches: AsyncIterator[List[Row]], columns: List[Tuple[str, str]], parquet: bool = False) -> AsyncIterator[bytes]:
+    schema = _arrow_schema(columns)
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema) if parquet else pa.ipc.new_stream(sink, schema)
+    try:
+        async for rows in batches:
+            # each batch becomes one IPC message / one parquet row group, so memory stays bounded
+            writer.write_batch(_record_batch(schema, _project_rows(rows, columns)))
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    tail = sink.take()
+    if tail:
+        yield tail
+
+
+def export_stream(fmt: str, batches: AsyncIterator[List[Row]], columns: Optional[str] = None) -> AsyncIterator[bytes]:
+    if fmt == "ndjson":
+        return ndjson_stream(batches)
+    cols = parse_columns(columns)
+    if fmt == "csv":
+        return csv_stream(batches, cols)
+    return arrow_stream(batches, cols, parquet=(fmt == "parquet"))
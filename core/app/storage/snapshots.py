@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import aiohttp
+from minio import Minio
+from minio.commonconfig import CopySource
+
+from ..metrics import snapshot_ops_total, snapshot_op_latency_ms
+
+
+class SnapshotStore:
+    def __init__(
+        self,
+        endpoint: Optional[str] = os.getenv("SNAPSHOT_S3_ENDPOINT"),
+        access_key: Optional[str] = os.getenv("SNAPSHOT_S3_ACCESS_KEY"),
+        secret_key: Optional[str] = os.getenv("SNAPSHOT_S3_SECRET_KEY"),
+        bucket: str = os.getenv("SNAPSHOT_S3_BUCKET", "snapshots"),
+        source_url: str = os.getenv("SNAPSHOT_SOURCE_URL", "http://sim:8100/sim/camera/{id}/frame"),
+        upload_threads: int = int(os.getenv("SNAPSHOT_UPLOAD_THREADS", "4")),
+        max_inflight: int = int(os.getenv("SNAPSHOT_MAX_INFLIGHT", "16")),
+        presign_margin_s: float = float(os.getenv("SNAPSHOT_PRESIGN_MARGIN_S", "30")),
+    ) -> None:
+        self.bucket = bucket
+        self._source_url = source_url
+        self._s3: Optional[Minio] = None
+        if endpoint and access_key and secret_key:
+            # strip http:// if present for Minio client
+            secure = endpoint.startswith("https://")
+            clean = endpoint.replace("https://", "").replace("http://", "")
+            self._s3 = Minio(clean, access_key=access_key, secret_key=secret_key, secure=secure)
+        self._upload_threads = max(1, upload_threads)
+        self._max_inflight = max(1, max_inflight)
+        self._presign_margin_s = presign_margin_s
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        # camera -> newest uploaded key still waiting to become last.jpg; a burst collapses to one copy
+        self._last_pending: Dict[str, str] = {}
+        self._last_tasks: Dict[str, asyncio.Task] = {}
+        self._last_copied: Dict[str, str] = {}
+        self._presigned: Dict[Tuple[str, int], Tuple[str, float]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self._s3 is not None
+
+    async def start(self) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10),
+                connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=30),
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._upload_threads, thread_name_prefix="snapshots")
+        if self._inflight is None:
+            self._inflight = asyncio.Semaphore(self._max_inflight)
+
+    async def stop(self) -> None:
+        tasks = list(self._last_tasks.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=5)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def _run(self, op: str, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        start = time.time()
+        try:
+            res = await loop.run_in_executor(self._executor, fn, *args)
+            snapshot_ops_total.labels(op=op, result="ok").inc()
+            return res
+        except Exception:
+            snapshot_ops_total.labels(op=op, result="error").inc()
+            raise
+        finally:
+            snapshot_op_latency_ms.labels(op=op).observe((time.time() - start) * 1000)
+
+    async def fetch(self, device_id: str) -> bytes:
+        if self._session is None:
+            await self.start()
+        url = self._source_url.replace("{id}", device_id)
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def put(self, device_id: str, data: bytes) -> Dict[str, Any]:
+        assert self._s3 is not None, "S3 not configured"
+        if self._inflight is None:
+            await self.start()
+        # ms timestamp keeps keys sortable; the random suffix makes same-ms captures distinct
+        key = f"{device_id}/{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.jpg"
+
+        def _put() -> None:
+            self._s3.put_object(self.bucket, key, BytesIO(data), length=len(data), content_type="image/jpeg")
+
+        # bounded: a burst from many cameras queues here instead of piling threads and sockets
+        async with self._inflight:
+            await self._run("put", _put)
+        self._schedule_last(device_id, key)
+        return {"bucket": self.bucket, "key": key, "last": f"{device_id}/last.jpg"}
+
+    def _schedule_last(self, device_id: str, key: str) -> None:
+        # uploads can finish out of order; keys sort by capture time, so never move last.jpg backwards
+        newest = max(self._last_pending.get(device_id, ""), self._last_copied.get(device_id, ""))
+        if key <= newest:
+            return
+        self._last_pending[device_id] = key
+        if device_id not in self._last_tasks:
+            self._last_tasks[device_id] = asyncio.create_task(self._copy_last(device_id), name=f"SnapshotStore.last-{device_id}")
+
+    async def _copy_last(self, device_id: str) -> None:
+        try:
+            while device_id in self._last_pending:
+                key = self._last_pending.pop(device_id)
+                try:
+                    # server-side copy: the frame bytes are not sent a second time
+                    await self._run("copy", self._s3.copy_object, self.bucket, f"{device_id}/last.jpg", CopySource(self.bucket, key))
+                    self._last_copied[device_id] = key
+                except Exception:
+                    pass
+        finally:
+            self._last_tasks.pop(device_id, None)
+
+    async def presigned_url(self, key: str, expires_seconds: int = 300) -> str:
+        assert self._s3 is not None, "S3 not configured"
+        now = time.time()
+        cached = self._presigned.get((key, expires_seconds))
+        if cached is not None and now < cached[1] - self._presign_margin_s:
+            snapshot_ops_total.labels(op="presign", result="cached").inc()
+            return cached[0]
+        url = await self._run("presign", self._s3.presigned_get_object, self.bucket, key, timedelta(seconds=expires_seconds))
+        self._presigned[(key, expires_seconds)] = (url, now + expires_seconds)
+        if len(self._presigned) > 1024:
+            self._presigned = {k: v for k, v in self._presigned.items() if v[1] - self._presign_margin_s > now}
+        return url
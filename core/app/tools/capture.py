@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..events import bus
+from ..storage.snapshots import SnapshotStore
+from ..metrics import snapshot_captures_total, snapshot_capture_lag_ms, snapshot_capture_inflight
+
+
+# security modes in which cameras are sampled at the fast cadence
+ARMED_MODES = {"away", "night", "armed", "armed_away", "armed_night"}
+
+
+class CaptureScheduler:
+    def __init__(
+        self,
+        store: SnapshotStore,
+        devices: Dict[str, Dict[str, Any]],
+        interval_s: float = float(os.getenv("CAPTURE_INTERVAL_S", "60")),
+        security_interval_s: float = float(os.getenv("CAPTURE_SECURITY_INTERVAL_S", "3")),
+        boost_interval_s: float = float(os.getenv("CAPTURE_BOOST_INTERVAL_S", "2")),
+        boost_s: float = float(os.getenv("CAPTURE_BOOST_S", "30")),
+        jitter: float = float(os.getenv("CAPTURE_JITTER", "0.1")),
+        concurrency: int = int(os.getenv("CAPTURE_CONCURRENCY", "4")),
+        extra_cameras: str = os.getenv("CAPTURE_CAMERAS", ""),
+    ) -> None:
+        self._store = store
+        self._interval_s = interval_s
+        self._security_interval_s = security_interval_s
+        self._boost_interval_s = boost_interval_s
+        self._boost_s = boost_s
+        self._jitter = max(0.0, min(jitter, 0.5))
+        self._concurrency = max(1, concurrency)
+        # camera_id -> per-camera overrides from the device registry ("capture": {...})
+        self._cameras: Dict[str, Dict[str, Any]] = {
+            dev_id: dict(dev.get("capture") or {}) for dev_id, dev in devices.items() if dev.get("type") == "camera"
+        }
+        for cam in (c.strip() for c in extra_cameras.split(",")):
+            if cam:
+                self._cameras.setdefault(cam, {})
+        self._armed = False
+        self._boost_until: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._events_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is not None or not self._store.enabled or not self._cameras:
+            return
+        self._sem = asyncio.Semaphore(self._concurrency)
+        self._wake = asyncio.Event()
+        now = time.time()
+        # spread the first round so cameras don't all fire in the same instant
+        self._heap = [(now + random.uniform(0, self._period(cam)), cam) for cam in self._cameras]
+        heapq.heapify(self._heap)
+        self._task = asyncio.create_task(self._run(), name="CaptureScheduler._run")
+        self._events_task = asyncio.create_task(self._watch_events(), name="CaptureScheduler._watch_events")
+
+    async def stop(self) -> None:
+        for t in (self._task, self._events_task, *self._inflight.values()):
+            if t is not None:
+                t.cancel()
+        for t in (self._task, self._events_task, *self._inflight.values()):
+            if t is None:
+                continue
+            try:
+                await t
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        self._events_task = None
+        self._inflight.clear()
+
+    def _period(self, cam: str, now: Optional[float] = None) -> float:
+        cfg = self._cameras.get(cam, {})
+        period = float(cfg.get("interval_s", self._interval_s))
+        if self._armed:
+            period = min(period, float(cfg.get("security_interval_s", self._security_interval_s)))
+        if self._boost_until.get(cam, 0.0) > (now or time.time()):
+            period = min(period, self._boost_interval_s)
+        return max(period, 0.5)
+
+    def _next_due(self, cam: str, from_ts: float) -> float:
+        period = self._period(cam, from_ts)
+        return from_ts + period * (1 + random.uniform(-self._jitter, self._jitter))
+
+    def _reschedule(self, cam: str, due: float) -> None:
+        # pull a camera forward when its cadence speeds up
+        self._heap = [(d, c) for d, c in self._heap if c != cam]
+        heapq.heapify(self._heap)
+        heapq.heappush(self._heap, (due, cam))
+        if self._wake is not None:
+            self._wake.set()
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        due = {cam: d for d, cam in self._heap}
+        return {
+            "enabled": self._task is not None,
+            "armed": self._armed,
+            "concurrency": self._concurrency,
+            "cameras": {
+                cam: {
+                    "period_s": round(self._period(cam, now), 2),
+                    "boosted": self._boost_until.get(cam, 0.0) > now,
+                    "next_in_s": round(due[cam] - now, 2) if cam in due else None,
+                    "inflight": cam in self._inflight,
+                    "last": self._last.get(cam),
+                }
+                for cam in self._cameras
+            },
+        }
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            if not self._heap:
+                await self._wake.wait()
+                self._wake.clear()
+                continue
+            due, cam = self._heap[0]
+            delay = due - time.time()
+            if delay > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            now = time.time()
+            period = self._period(cam, now)
+            if cam in self._inflight:
+                # the previous frame for this camera is still being fetched/stored: skip, don't pile up
+                snapshot_captures_total.labels(result="dropped_busy").inc()
+            elif now - due > period:
+                # woke up more than a whole period late (loop stall, overload): this slot is gone
+                snapshot_captures_total.labels(result="dropped_late").inc()
+            else:
+                self._inflight[cam] = asyncio.create_task(self._capture(cam, due), name=f"CaptureScheduler.capture-{cam}")
+            # keep the cadence anchored to the schedule, not to when the capture finishes
+            nxt = self._next_due(cam, due)
+            if nxt < now:
+                nxt = self._next_due(cam, now)
+            heapq.heappush(self._heap, (nxt, cam))
+
+    async def _capture(self, cam: str, due: float) -> None:
+        assert self._sem is not None
+        try:
+            async with self._sem:
+                # lag includes time spent waiting for a slot under the global cap
+                snapshot_capture_lag_ms.observe(max(0.0, time.time() - due) * 1000)
+                snapshot_capture_inflight.inc()
+                try:
+                    data = await self._store.fetch(cam)
+                    res = await self._store.put(cam, data)
+                finally:
+                    snapshot_capture_inflight.dec()
+            self._last[cam] = {"key": res["key"], "ts": time.time(), "lag_ms": round((time.time() - due) * 1000, 1)}
+            snapshot_captures_total.labels(result="ok").inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._last[cam] = {"error": str(e) or type(e).__name__, "ts": time.time()}
+            snapshot_captures_total.labels(result="error").inc()
+        finally:
+            self._inflight.pop(cam, None)
+
+    async def _watch_events(self) -> None:
+        async for ev in bus.subscribe():
+            etype = ev.get("type")
+            if etype == "state_update":
+                armed = (ev.get("snapshot") or {}).get("security_mode") in ARMED_MODES
+                if armed != self._armed:
+                    self._armed = armed
+                    if armed:
+                        now = time.time()
+                        for cam in self._cameras:
+                            self._reschedule(cam, now + random.uniform(0, self._period(cam, now)))
+            elif etype == "vision_event":
+                # vision/events/<camera_id>: something happened, sample that camera faster for a while
+                cam = str(ev.get("topic", "")).rsplit("/", 1)[-1]
+                if cam in self._cameras:
+                    now = time.time()
+                    boosted = self._boost_until.get(cam, 0.0) > now
+                    self._boost_until[cam] = now + self._boost_s
+                    if not boosted:
+                        self._reschedule(cam, now)
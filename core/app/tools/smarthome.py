@@ -1,31 +1,20 @@
 from typing import Any, Dict, Optional
-from datetime import timedelta
 
 from ..integration.mqtt_client import AsyncMqttClient
-import os
-import time
-import aiohttp
+from ..storage.snapshots import SnapshotStore
+from ..integration.stream_relay import StreamRelay
+from ..security.limiter import limiter
 import asyncio
-from minio import Minio
-from minio.error import S3Error
 
 
 class SmartHomeTools:
     def __init__(self, mqtt: AsyncMqttClient, devices: Dict[str, Dict[str, Any]]):
         self._mqtt = mqtt
         self._devices = devices
-        # S3 client for snapshots
-        endpoint = os.getenv("SNAPSHOT_S3_ENDPOINT")
-        access_key = os.getenv("SNAPSHOT_S3_ACCESS_KEY")
-        secret_key = os.getenv("SNAPSHOT_S3_SECRET_KEY")
-        self._snapshot_bucket = os.getenv("SNAPSHOT_S3_BUCKET", "snapshots")
-        self._snapshot_source = os.getenv("SNAPSHOT_SOURCE_URL", "http://sim:8100/sim/camera/{id}/frame")
-        self._s3: Optional[Minio] = None
-        if endpoint and access_key and secret_key:
-            # strip http:// if present for Minio client
-            secure = endpoint.startswith("https://")
-            clean = endpoint.replace("https://", "").replace("http://", "")
-            self._s3 = Minio(clean, access_key=access_key, secret_key=secret_key, secure=secure)
+        # frame source + S3 (MinIO) for snapshots; started/stopped with the app
+        self.snapshots = SnapshotStore()
+        # live view: one upstream per camera shared by every viewer
+        self.streams = StreamRelay(self.snapshots)
 
     def _device(self, device_id: str) -> Dict[str, Any]:
         if device_id not in self._devices:
@@ -33,14 +22,18 @@ class SmartHomeTools:
         return self._devices[device_id]
 
     def _set_topic(self, device_id: str) -> str:
-        return self._device(device_id)["topics"]["set"]
+        # every device command resolves its set topic here: one per-device bucket guards MQTT
+        topic = self._device(device_id)["topics"]["set"]
+        limiter.require("device", device_id)
+        return topic
 
     def _state_topic(self, device_id: str) -> str:
         return self._device(device_id)["topics"]["state"]
 
     async def get_device_status(self, device_id: str, timeout: float = 1.0) -> Any:
         state_topic = self._state_topic(device_id)
-        return await self._mqtt.wait_for_state(state_topic, timeout=timeout)
+        device_type = self._device(device_id).get("type", "unknown")
+        return await self._mqtt.wait_for_state(state_topic, timeout=timeout, device_type=device_type)
 
     async def control_light(
         self, device_id: str, state: bool, brightness: Optional[int] = None
@@ -68,6 +61,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def emit_sensor(self, sensor_id: str, value: Any) -> None:
@@ -75,6 +69,7 @@ class SmartHomeTools:
         await self._mqtt.publish_without_wait(
             topic=f"home/sensor/{sensor_id}/state",
             payload={"type": "generic", "value": value},
+            device_type="sensor",
         )
 
     async def lock_door(self, device_id: str) -> Any:
@@ -92,6 +87,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def unlock_door(self, device_id: str) -> Any:
@@ -109,6 +105,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def cover_set_position(self, device_id: str, position: int) -> Any:
@@ -126,6 +123,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def switch_on(self, device_id: str) -> Any:
@@ -142,6 +140,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def switch_off(self, device_id: str) -> Any:
@@ -158,6 +157,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def set_thermostat(self, device_id: str, temperature: float) -> Any:
@@ -175,6 +175,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def siren_on(self, device_id: str) -> Any:
@@ -191,6 +192,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def siren_off(self, device_id: str) -> Any:
@@ -207,6 +209,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic=self._state_topic(device_id),
             match=match,
+            device_type=device["type"],
         )
 
     async def arm_security(self, mode: str) -> Any:
@@ -221,6 +224,7 @@ class SmartHomeTools:
             payload=payload,
             state_topic="home/security/state",
             match=match,
+            device_type="security",
         )
 
     async def disarm_security(self) -> Any:
@@ -234,83 +238,78 @@ class SmartHomeTools:
             payload=payload,
             state_topic="home/security/state",
             match=match,
+            device_type="security",
         )
 
     async def camera_snapshot(self, device_id: str) -> Any:
-        if not self._s3:
+        if not self.snapshots.enabled:
             return {"device_id": device_id, "snapshot": None}
-        url = self._snapshot_source.replace("{id}", device_id)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                resp.raise_for_status()
-                data = await resp.read()
-        ts = int(time.time())
-        key = f"{device_id}/{ts}.jpg"
-        # upload to S3 (MinIO)
-        from io import BytesIO
-        bio = BytesIO(data)
-        bio.seek(0)
-        self._s3.put_object(self._snapshot_bucket, key, bio, length=len(data), content_type="image/jpeg")
-        # also update last.jpg for quick previews
-        bio.seek(0)
-        self._s3.put_object(self._snapshot_bucket, f"{device_id}/last.jpg", bio, length=len(data), content_type="image/jpeg")
-        return {"bucket": self._snapshot_bucket, "key": key, "last": f"{device_id}/last.jpg"}
+        data = await self.snapshots.fetch(device_id)
+        return await self.snapshots.put(device_id, data)
 
     async def camera_stream_info(self, device_id: str) -> Any:
-        return {"device_id": device_id, "stream": None}
+        return {
+            "device_id": device_id,
+            "stream": self.streams.path(device_id),
+            "content_type": self.streams.media_type(),
+            **self.streams.info(device_id),
+        }
 
     async def get_sensor_data(self, sensor_id: str, timeout: float = 1.0) -> Any:
         topic = f"home/sensor/{sensor_id}/state"
-        return await self._mqtt.wait_for_state(topic, timeout=timeout)
+        return await self._mqtt.wait_for_state(topic, timeout=timeout, device_type="sensor")
 
     async def analyze_snapshot(self, camera_id: str, prompt: str) -> Any:
-        # Take snapshot to S3 or return URL, then run analysis if local file exists
-        snap = await self.camera_snapshot(camera_id)
-        # If running without S3, just return metadata
-        result: Dict[str, Any] = {"snapshot": snap}
-        # Optionally download last.jpg and analyze
+        from ..llm.vision import analyze_with_gemini, basic_opencv_metrics, gv_annotate
+        from ..llm.frame_gate import frame_gate
+        result: Dict[str, Any] = {"snapshot": {"device_id": camera_id, "snapshot": None}}
+        try:
+            data = await self.snapshots.fetch(camera_id)
+        except Exception:
+            return result
+        # the frame stays in memory for the whole analysis; S3 persistence runs alongside, off the critical path
+        store = asyncio.create_task(self.snapshots.put(camera_id, data)) if self.snapshots.enabled else None
+        frame = memoryview(data)
         try:
-            import tempfile, httpx, os
-            from ..llm.vision import analyze_with_gemini, gv_labels, gv_objects, gv_ocr
-            url = snap.get("url") or None
-            if not url and self._s3:
-                # presign
-                url = self._s3.presigned_get_object(self._snapshot_bucket, f"{camera_id}/last.jpg", expires=300)
-            if url:
-                async with httpx.AsyncClient() as client:
-                    r = await client.get(url)
-                    r.raise_for_status()
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tf:
-                        tf.write(r.content)
-                        tmp = tf.name
-                # Gather facts with timeouts and metrics
-                facts = {}
-                try:
-                    facts["gv_labels"] = gv_labels(tmp) or []
-                except Exception:
-                    facts["gv_labels_error"] = True
-                try:
-                    facts["gv_objects"] = gv_objects(tmp) or []
-                except Exception:
-                    facts["gv_objects_error"] = True
-                try:
-                    facts["gv_ocr"] = gv_ocr(tmp) or ""
-                except Exception:
-                    facts["gv_ocr_error"] = True
-                from ..llm.vision import basic_opencv_metrics
-                facts["cv_metrics"] = basic_opencv_metrics(tmp)
+            # static scene: reuse the last analysis instead of calling the cloud again
+            gate, cached, small = await frame_gate.check(camera_id, prompt, frame)
+            result["gate"] = gate
+            if cached is not None:
+                result.update(cached)
+            else:
+                # Gather facts: Vision annotate and OpenCV metrics are independent, run them together
+                facts: Dict[str, Any] = {}
+                ann, facts["cv_metrics"] = await asyncio.gather(
+                    gv_annotate(frame, ("labels", "objects", "ocr")),
+                    basic_opencv_metrics(frame),
+                    return_exceptions=True,
+                )
+                if isinstance(ann, BaseException):
+                    facts["gv_error"] = True
+                else:
+                    facts["gv_labels"] = ann.get("labels") or []
+                    facts["gv_objects"] = ann.get("objects") or []
+                    facts["gv_ocr"] = ann.get("ocr") or ""
+                if isinstance(facts["cv_metrics"], BaseException):
+                    facts["cv_metrics"] = {}
                 prompt2 = (
                     f"Факты из Cloud Vision: labels={facts.get('gv_labels')}, objects={facts.get('gv_objects')}, "
                     f"ocr={(facts.get('gv_ocr') or '')[:200]}...\n"
                     f"OpenCV: {facts['cv_metrics']}\n\n"
                     f"Инструкция: {prompt}. Кратко, по пунктам, без дисклеймеров."
                 )
-                text = analyze_with_gemini(tmp, prompt2)
-                os.unlink(tmp)
+                text = await analyze_with_gemini(frame, prompt2, cache_prompt=prompt)
                 result["facts"] = facts
                 result["analysis"] = text
+                if not facts.get("gv_error") and not text.startswith(("Gemini error", "Gemini API key missing")):
+                    frame_gate.commit(camera_id, prompt, small, {"facts": facts, "analysis": text})
         except Exception:
             pass
+        if store is not None:
+            try:
+                result["snapshot"] = await store
+            except Exception:
+                result["snapshot"] = {"device_id": camera_id, "snapshot": None, "error": "upload_failed"}
         return result
 
     async def create_automation_rule(self, rule: Dict[str, Any]) -> Any:
@@ -320,10 +319,10 @@ class SmartHomeTools:
         raise NotImplementedError("Rules managed via API/TriggerEngine")
 
     async def get_snapshot_url(self, device_id: str, expires_seconds: int = 300) -> Any:
-        if not self._s3:
+        if not self.snapshots.enabled:
             return {"url": None}
         key = f"{device_id}/last.jpg"
-        url = self._s3.presigned_get_object(self._snapshot_bucket, key, expires=expires_seconds)
-        return {"bucket": self._snapshot_bucket, "key": key, "url": url}
+        url = await self.snapshots.presigned_url(key, expires_seconds)
+        return {"bucket": self.snapshots.bucket, "key": key, "url": url}
 
 
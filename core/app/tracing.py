@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attrs", "status", "_t0")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.status = "ok"
+        self._t0 = time.perf_counter()
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end is None:
+            return None
+        return (self.end - self.start) * 1000
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self) -> None:
+        # wall-clock start plus monotonic duration, so spans are immune to clock steps
+        self.end = self.start + (time.perf_counter() - self._t0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(self.duration_ms, 3) if self.end is not None else None,
+            "status": self.status,
+            "attrs": self.attrs,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        def _value(v: Any) -> Dict[str, Any]:
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        out: Dict[str, Any] = {
+            "traceId": self.trace_id.replace("-", "")[:32].rjust(32, "0"),
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int((self.end or self.start) * 1e9)),
+            "attributes": [{"key": k, "value": _value(v)} for k, v in self.attrs.items()],
+            "status": {"code": 1 if self.status == "ok" else 2},
+        }
+        if self.parent_id:
+            out["parentSpanId"] = self.parent_id
+        return out
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_current_trace: ContextVar[Optional[str]] = ContextVar("current_trace", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    return _current_trace.get()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class Tracer:
+    def __init__(self, ring_size: int = int(os.getenv("TRACE_RING_SIZE", "4096"))) -> None:
+        self._ring: Deque[Span] = deque(maxlen=ring_size)
+        # finished spans waiting for the exporter; bounded so a dead collector cannot grow memory
+        self._outbox: Deque[Span] = deque(maxlen=ring_size)
+        self._export_file = os.getenv("TRACE_EXPORT_FILE", "")
+        self._otlp_url = os.getenv("TRACE_OTLP_URL", "")
+        self._export_interval_s = float(os.getenv("TRACE_EXPORT_INTERVAL_MS", "1000")) / 1000.0
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def span(self, name: str, trace_id: Optional[str] = None, **attrs: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        tid = trace_id or (parent.trace_id if parent else None) or _current_trace.get() or str(uuid.uuid4())
+        sp = Span(name, tid, parent.span_id if parent and parent.trace_id == tid else None, attrs)
+        tok_span = _current_span.set(sp)
+        tok_trace = _current_trace.set(tid)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.status = "error"
+            sp.attrs.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            sp.finish()
+            _current_span.reset(tok_span)
+            _current_trace.reset(tok_trace)
+            self._ring.append(sp)
+            if self._task is not None:
+                self._outbox.append(sp)
+
+    def recent(self, trace_id: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        spans = [s for s in list(self._ring) if trace_id is None or s.trace_id == trace_id]
+        return [s.to_dict() for s in spans[-limit:]]
+
+    async def start(self) -> None:
+        if self._task is None and (self._export_file or self._otlp_url):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self._export()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._export_interval_s)
+            try:
+                await self._export()
+            except Exception:
+                # exporting is best-effort; spans stay in the ring either way
+                pass
+
+    async def _export(self) -> None:
+        batch: List[Span] = []
+        while self._outbox:
+            batch.append(self._outbox.popleft())
+        if not batch:
+            return
+        if self._export_file:
+            lines = "".join(json.dumps(s.to_dict(), separators=(",", ":")) + "\n" for s in batch)
+            await asyncio.to_thread(self._append_file, lines)
+        if self._otlp_url:
+            import httpx
+            body = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "smarthouse-core"}}]},
+                    "scopeSpans": [{"scope": {"name": "smarthouse"}, "spans": [s.to_otlp() for s in batch]}],
+                }]
+            }
+            async with httpx.AsyncClient(timeout=5) as client:
+                r = await client.post(self._otlp_url, json=body)
+                r.raise_for_status()
+
+    def _append_file(self, lines: str) -> None:
+        path = Path(self._export_file)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+tracer = Tracer()
@@ -8,6 +8,7 @@ from ..state.context import HomeContextManager
 from ..tools.smarthome import SmartHomeTools
 from ..metrics import trigger_firings_total
 from ..events import bus
+from ..security.limiter import limiter
 
 
 class TriggerEngine:
@@ -16,9 +17,8 @@ class TriggerEngine:
         self._tools = tools
         self._rules = rules
         self._task: Optional[asyncio.Task] = None
+        # last firing per rule, for `for:` durations; rate limits live in the shared limiter
         self._last_fire: Dict[str, float] = {}
-        self._debounce_until: Dict[str, float] = {}
-        self._throttle_until: Dict[str, float] = {}
 
     async def start(self) -> None:
         if self._task is None:
@@ -36,6 +36,8 @@ class TriggerEngine:
     def set_rules(self, rules: List[Dict[str, Any]]) -> None:
         self._rules = rules
         self._last_fire.clear()
+        for scope in ("rule", "rule.debounce", "rule.throttle"):
+            limiter.reset(scope)
 
     async def _run(self) -> None:
         while True:
@@ -50,24 +52,22 @@ class TriggerEngine:
     async def _maybe_fire(self, rule: Dict[str, Any], snapshot: Dict[str, Any]) -> None:
         rule_id = rule.get("id")
         safety = rule.get("safety", {})
-        rate_limit = float(safety.get("rate_limit_per_min", 0))
         now = time.time()
-        if rate_limit > 0:
-            last = self._last_fire.get(rule_id, 0)
-            min_interval = 60.0 / max(rate_limit, 1)
-            if now - last < min_interval:
-                return
-
-        # guards: debounce / throttle windows
+        # safety rate limit and debounce / throttle guards: each is a one-token bucket per rule whose
+        # refill time is the minimum interval between firings; checked here, spent when the rule fires
+        rate_limit = float(safety.get("rate_limit_per_min", 0))
         guards = rule.get("guards", {})
         debounce_ms = int(guards.get("debounce_ms", 0))
         throttle_per_min = float(guards.get("throttle_per_min", 0))
-        now_ms = now * 1000
-        if debounce_ms > 0 and now_ms < self._debounce_until.get(rule_id, 0):
-            return
+        limits = []
+        if rate_limit > 0:
+            limits.append(("rule", max(rate_limit, 1)))
+        if debounce_ms > 0:
+            limits.append(("rule.debounce", 60000.0 / debounce_ms))
         if throttle_per_min > 0:
-            min_interval_ms = 60000.0 / max(throttle_per_min, 1)
-            if now_ms < self._throttle_until.get(rule_id, 0):
+            limits.append(("rule.throttle", max(throttle_per_min, 1)))
+        for scope, per_min in limits:
+            if limiter.check(scope, rule_id, per_min=per_min, burst=1):
                 return
 
         rtype = rule.get("type")
@@ -125,10 +125,8 @@ class TriggerEngine:
                     await asyncio.sleep(backoff_ms / 1000.0)
 
         self._last_fire[rule_id] = now
-        if debounce_ms > 0:
-            self._debounce_until[rule_id] = now_ms + debounce_ms
-        if throttle_per_min > 0:
-            self._throttle_until[rule_id] = now_ms + (60000.0 / max(throttle_per_min, 1))
+        for scope, per_min in limits:
+            limiter.take(scope, rule_id, per_min=per_min, burst=1)
         trigger_firings_total.labels(rule_id=rule_id, result=("ok" if fired_ok else "err")).inc()
         await bus.publish({
             "type": "trigger_fired",
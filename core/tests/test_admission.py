@@ -0,0 +1,26 @@
+import asyncio
+
+import httpx
+
+from app import main
+from app.security.limiter import RateLimiter
+
+
+def _post(client_addr, headers):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app, client=client_addr)
+        async with httpx.AsyncClient(transport=transport, base_url="http://core") as http:
+            # an unknown tool: admission runs first, then routing answers 404
+            return [(await http.post("/tools/no_such_tool", headers=h)).status_code for h in headers]
+
+    return asyncio.run(run())
+
+
+def test_actor_bucket_ignores_minted_actor_headers(monkeypatch):
+    limiter = RateLimiter()
+    limiter.configure("actor", per_min=1, burst=2)
+    monkeypatch.setattr(main, "limiter", limiter)
+    statuses = _post(("10.0.0.5", 40000), [{"X-Actor": f"actor-{i}"} for i in range(4)])
+    assert statuses == [404, 404, 429, 429]
+    # another peer still has its own bucket
+    assert _post(("10.0.0.6", 40000), [{"X-Actor": "actor-0"}]) == [404]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.storage.db import ATTRS_VERSION, EventStore
+
+
+class _Bus:
+    async def subscribe(self):
+        await asyncio.Event().wait()
+        yield {}
+
+
+def _legacy_db(path, events):
+    # the schema before attribute columns and FTS existed
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, type TEXT NOT NULL, payload TEXT NOT NULL)")
+    db.executemany(
+        "INSERT INTO events (ts, type, payload) VALUES (?, ?, ?)",
+        [(ev["ts"], ev["type"], json.dumps(ev)) for ev in events],
+    )
+    db.commit()
+    db.close()
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    path = str(tmp_path / "core.db")
+    _legacy_db(path, [
+        {"type": "insight", "ts": 1.0, "kind": "waste_light", "room": "kitchen"},
+        {"type": "tool_call", "ts": 2.0, "tool": "lock_door", "args": {"device_id": "lock_front"}},
+        {"type": "state_update", "ts": 3.0, "device_id": "lock_front"},
+        {"type": "audit_log", "ts": 4.0, "action": "lock_door", "role": "admin", "result": "ok"},
+    ])
+    return path
+
+
+def _run(path, test, **kwargs):
+    async def main():
+        store = EventStore(path=path, **kwargs)
+        await store.start(_Bus())
+        try:
+            await test(store)
+        finally:
+            await store.stop()
+
+    asyncio.run(main())
+
+
+def test_upgrade_backfills_attribute_columns(legacy):
+    async def test(store):
+        hits = await store.search(attrs={"kind": "waste_light"})
+        assert [h["event"]["room"] for h in hits] == ["kitchen"]
+        hits = await store.search(attrs={"entity": "lock_front", "tool": "lock_door"})
+        assert [h["event"]["type"] for h in hits] == ["tool_call"]
+        # audit entries carry the tool in `action`
+        hits = await store.search(attrs={"tool": "lock_door"})
+        assert [h["event"]["type"] for h in hits] == ["audit_log", "tool_call"]
+
+    _run(legacy, test)
+    # done once: a later start finds user_version set and leaves the rows alone
+    db = sqlite3.connect(legacy)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == ATTRS_VERSION
+    db.close()
+
+
+def test_upgrade_backfills_fts_without_skipped_types(legacy):
+    async def test(store):
+        hits = await store.search(text="lock_front")
+        assert [h["event"]["type"] for h in hits] == ["tool_call"]
+
+    _run(legacy, test)
+
+
+def test_failed_batch_keeps_good_rows(tmp_path):
+    async def test(store):
+        before = REGISTRY.get_sample_value("events_store_dropped_total") or 0.0
+        good = {"type": "tool_call", "ts": 5.0, "tool": "set_thermostat"}
+        store._pending = [
+            (5.0, "tool_call", json.dumps(good), None, None, None, "set_thermostat"),
+            # NOT NULL violation: fails the batch insert
+            (None, "tool_call", "{}", None, None, None, None),
+            (6.0, "tool_call", json.dumps({**good, "ts": 6.0}), None, None, None, "set_thermostat"),
+        ]
+        await store._flush()
+        hits = await store.search(attrs={"tool": "set_thermostat"})
+        assert [h["event"]["ts"] for h in hits] == [6.0, 5.0]
+        assert REGISTRY.get_sample_value("events_store_dropped_total") == before + 1
+
+    _run(str(tmp_path / "core.db"), test)
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from app.llm import vision
+from app.llm.vision_cache import VisionCache
+
+
+PERSON = {"labelAnnotations": [{"description": "person"}], "localizedObjectAnnotations": [], "fullTextAnnotation": {"text": ""}}
+QUOTA = {"error": {"code": 8, "message": "Quota exceeded"}}
+
+
+@pytest.fixture
+def gv(monkeypatch):
+    # images:annotate served by an httpx mock transport; the SDK fallback is scripted per test
+    state = {"rest": [], "sdk": []}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"responses": [state["rest"].pop(0)]})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def sdk(image, features):
+        result = state["sdk"].pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    cache = VisionCache(phash=False)
+    monkeypatch.setenv("GOOGLE_CLOUD_VISION_API_KEY", "test")
+    monkeypatch.setattr(vision, "_http", lambda: client)
+    monkeypatch.setattr(vision, "_gv_annotate_sdk", sdk)
+    monkeypatch.setattr(vision, "_semaphores", {})
+    monkeypatch.setattr(vision, "vision_cache", cache)
+    state["cache"] = cache
+    return state
+
+
+def test_rest_result_is_parsed_and_cached(gv):
+    gv["rest"] = [PERSON]
+    image = os.urandom(1024)
+    out = asyncio.run(vision.gv_annotate(image))
+    assert out["labels"] == ["person"]
+    # second call is served from the cache: no further REST response is queued
+    assert asyncio.run(vision.gv_annotate(image)) == out
+
+
+def test_per_image_error_falls_back_to_sdk(gv):
+    gv["rest"] = [QUOTA]
+    gv["sdk"] = [PERSON]
+    out = asyncio.run(vision.gv_annotate(os.urandom(1024)))
+    assert out["labels"] == ["person"]
+    assert gv["sdk"] == []
+
+
+def test_error_response_is_never_cached(gv):
+    image = os.urandom(1024)
+    gv["rest"] = [QUOTA]
+    gv["sdk"] = [vision.VisionApiError("permission denied")]
+    with pytest.raises(vision.VisionApiError):
+        asyncio.run(vision.gv_annotate(image))
+    assert len(gv["cache"]._entries) == 0
+    # the next frame gets a real answer instead of an hour of empty labels
+    gv["rest"] = [PERSON]
+    assert asyncio.run(vision.gv_annotate(image))["labels"] == ["person"]
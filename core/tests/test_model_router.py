@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+from app.llm import model_router as mr
+from app.llm.clients import ClientRegistry
+
+
+class _Stubs:
+    # local vLLM (OpenAI SSE) and Ollama (NDJSON) servers with scriptable latency and failures
+    def __init__(self) -> None:
+        self.vllm_delay_s = 0.0
+        self.vllm_status = 200
+        self.ollama_delay_s = 0.0
+        self.hits = {"vllm": 0, "ollama": 0}
+        self.cancelled = {"vllm": 0, "ollama": 0}
+        self.urls = {}
+        self._runners = []
+
+    async def _vllm(self, request: web.Request) -> web.StreamResponse:
+        self.hits["vllm"] += 1
+        body = await request.json()
+        assert body["stream"] is True
+        if self.vllm_status != 200:
+            return web.Response(status=self.vllm_status)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        try:
+            await asyncio.sleep(self.vllm_delay_s)
+            for word in ("from ", "vllm"):
+                chunk = {"choices": [{"delta": {"content": word}}]}
+                await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await resp.write(b"data: [DONE]\n\n")
+        except asyncio.CancelledError:
+            self.cancelled["vllm"] += 1
+            raise
+        return resp
+
+    async def _ollama(self, request: web.Request) -> web.StreamResponse:
+        self.hits["ollama"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        try:
+            await asyncio.sleep(self.ollama_delay_s)
+            for word in ("from ", "ollama"):
+                await resp.write((json.dumps({"response": word, "done": False}) + "\n").encode())
+            await resp.write((json.dumps({"response": "", "done": True}) + "\n").encode())
+        except asyncio.CancelledError:
+            self.cancelled["ollama"] += 1
+            raise
+        return resp
+
+    async def start(self) -> None:
+        for kind, path, handler in (("vllm", "/v1/chat/completions", self._vllm), ("ollama", "/api/generate", self._ollama)):
+            app = web.Application()
+            app.router.add_post(path, handler)
+            # handlers see a client disconnect as cancellation, which is how the tests observe the hedge loser
+            runner = web.AppRunner(app, handler_cancellation=True)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.urls[kind] = f"http://127.0.0.1:{port}"
+            self._runners.append(runner)
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # pooled httpx clients are bound to the loop that created them; each test gets its own registry
+    reg = ClientRegistry(http2=False)
+    monkeypatch.setattr(mr, "clients", reg)
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    return reg
+
+
+def _router(stubs: _Stubs, **kwargs) -> mr.ModelRouter:
+    router = mr.ModelRouter(**kwargs)
+    router.configure({
+        "policies": {
+            "default": {"latency_ms": 100},
+            "control": {"deterministic": True, "prefer": "non_llm"},
+            # vLLM first, its fallback after it regardless of learned scores
+            "pinned": {"latency_ms": 100, "backends": ["vllm/llama3-8b"]},
+        },
+        "backends": [
+            {"name": "vllm/llama3-8b", "url": stubs.urls["vllm"]},
+            {"name": "ollama/mistral-7b-instruct", "url": stubs.urls["ollama"]},
+        ],
+        "fallbacks": [{"primary": "vllm/llama3-8b", "to": "ollama/mistral-7b"}],
+    })
+    return router
+
+
+def _run(registry: ClientRegistry, test) -> None:
+    async def main() -> None:
+        stubs = _Stubs()
+        await stubs.start()
+        try:
+            await test(stubs)
+        finally:
+            await registry.aclose()
+            await stubs.stop()
+
+    asyncio.run(main())
+
+
+async def _collect(router: mr.ModelRouter, request_class: str = "default") -> str:
+    return "".join([t async for t in router.stream("hello", request_class)])
+
+
+def test_fallback_short_name_resolves_by_prefix(registry):
+    async def test(stubs: _Stubs) -> None:
+        router = _router(stubs)
+        assert router.stats()["fallbacks"] == {"vllm/llama3-8b": ["ollama/mistral-7b-instruct"]}
+
+    _run(registry, test)
+
+
+def test_slow_primary_is_hedged_and_loser_cancelled(registry):
+    async def test(stubs: _Stubs) -> None:
+        router = _router(stubs)
+        vllm = router._backends["vllm/llama3-8b"]
+        # learned stats put vLLM first in the chain
+        vllm.ewma_ms = 10.0
+        stubs.vllm_delay_s = 2.0
+        t0 = time.perf_counter()
+        assert await _collect(router) == "from ollama"
+        assert time.perf_counter() - t0 < 1.0
+        assert stubs.hits == {"vllm": 1, "ollama": 1}
+        # the abandoned request is closed, so the server sees the disconnect well before its 2 s delay
+        for _ in range(50):
+            if stubs.cancelled["vllm"]:
+                break
+            await asyncio.sleep(0.02)
+        assert stubs.cancelled["vllm"] == 1
+        # abandoning after the budget is a lower bound on its latency, not an error
+        assert vllm.ewma_ms >= 10.0 and vllm.failures == 0
+
+    _run(registry, test)
+
+
+def test_fast_primary_is_not_hedged(registry):
+    async def test(stubs: _Stubs) -> None:
+        router = _router(stubs)
+        router._backends["vllm/llama3-8b"].ewma_ms = 10.0
+        assert await _collect(router) == "from vllm"
+        assert stubs.hits == {"vllm": 1, "ollama": 0}
+
+    _run(registry, test)
+
+
+def test_breaker_opens_after_consecutive_failures(registry):
+    async def test(stubs: _Stubs) -> None:
+        router = _router(stubs, trip_after=3, cooldown_s=30)
+        vllm = router._backends["vllm/llama3-8b"]
+        stubs.vllm_status = 500
+        for _ in range(3):
+            # a fast failure brings the fallback in at once instead of waiting out the budget
+            assert await _collect(router, "pinned") == "from ollama"
+        assert stubs.hits == {"vllm": 3, "ollama": 3}
+        assert vllm.failures == 3 and vllm.to_dict()["open"] is True
+        # open circuit: the backend is skipped without a request
+        assert [b.name for b in router.plan("pinned")[1]] == ["ollama/mistral-7b-instruct"]
+        assert await _collect(router, "pinned") == "from ollama"
+        assert stubs.hits == {"vllm": 3, "ollama": 4}
+        # after the cooldown one request probes it again, and a success closes the circuit
+        vllm.open_until = 0.0
+        stubs.vllm_status = 200
+        assert await _collect(router, "pinned") == "from vllm"
+        assert vllm.failures == 0
+
+    _run(registry, test)
+
+
+def test_prefer_non_llm_yields_no_model(registry):
+    async def test(stubs: _Stubs) -> None:
+        router = _router(stubs)
+        policy, chain = router.plan("control")
+        assert policy["prefer"] == "non_llm" and chain == []
+        with pytest.raises(mr.NoBackendAvailable):
+            await _collect(router, "control")
+        assert stubs.hits == {"vllm": 0, "ollama": 0}
+
+    _run(registry, test)
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+from aiomqtt import Client
+from paho.mqtt.client import MQTTMessageInfo
+from prometheus_client import REGISTRY
+
+from app.integration.mqtt_client import AsyncMqttClient
+
+
+ACK_DELAY_S = 0.05
+
+
+class _Paho:
+    # stands in for the connected paho client: queues the packet, then the "broker" acks through
+    # aiomqtt's own on_publish callback, exactly as the network loop would
+    def __init__(self, aio: Client, ack: bool = True) -> None:
+        self._aio = aio
+        self._ack = ack
+        self._mid = 0
+        self.published = []
+
+    def publish(self, topic, payload, qos, *args):
+        self._mid += 1
+        info = MQTTMessageInfo(self._mid)
+        info.rc = 0
+        self.published.append((topic, payload, qos))
+        if self._ack:
+            asyncio.get_running_loop().call_later(ACK_DELAY_S, self._aio._on_publish, None, None, self._mid)
+        return info
+
+
+def _observed(phase: str, device_type: str):
+    labels = {"phase": phase, "device_type": device_type}
+    return (
+        REGISTRY.get_sample_value("mqtt_phase_latency_ms_count", labels) or 0.0,
+        REGISTRY.get_sample_value("mqtt_phase_latency_ms_sum", labels) or 0.0,
+    )
+
+
+def _client(ack: bool = True):
+    aio = Client("localhost")
+    paho = _Paho(aio, ack)
+    aio._client = paho
+    mqtt = AsyncMqttClient("localhost")
+    mqtt._client = aio
+    return mqtt, aio, paho
+
+
+def test_qos1_records_publish_and_puback_separately():
+    async def run():
+        mqtt, aio, paho = _client()
+        before_pub, before_ack = _observed("publish", "test_lock"), _observed("puback", "test_lock")
+        await asyncio.wait_for(mqtt.publish_json("home/lock/front/set", {"state": "LOCKED"}, qos=1, device_type="test_lock"), 1.0)
+        pub, ack = _observed("publish", "test_lock"), _observed("puback", "test_lock")
+        assert paho.published == [("home/lock/front/set", b'{"state":"LOCKED"}', 1)]
+        assert pub[0] == before_pub[0] + 1 and ack[0] == before_ack[0] + 1
+        # the local send is immediate; the ack phase carries the broker round trip
+        assert pub[1] - before_pub[1] < ACK_DELAY_S * 1000
+        assert ack[1] - before_ack[1] >= ACK_DELAY_S * 1000 * 0.9
+        assert aio._pending_publishes == {}
+
+    asyncio.run(run())
+
+
+def test_qos0_records_publish_only():
+    async def run():
+        mqtt, aio, paho = _client(ack=False)
+        before_ack = _observed("puback", "test_light")
+        await mqtt.publish_json("home/light/hall/set", {"state": "ON"}, qos=0, device_type="test_light")
+        assert _observed("publish", "test_light")[0] >= 1
+        assert _observed("puback", "test_light") == before_ack
+
+    asyncio.run(run())
+
+
+def test_missing_puback_times_out_and_cleans_up():
+    async def run():
+        mqtt, aio, paho = _client(ack=False)
+        with pytest.raises(asyncio.TimeoutError):
+            await mqtt._publish_acked("home/lock/front/set", b"{}", 1, "test_lock", timeout=0.1)
+        assert aio._pending_publishes == {}
+
+    asyncio.run(run())
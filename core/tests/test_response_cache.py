@@ -0,0 +1,45 @@
+import pytest
+
+from app.llm.response_cache import ResponseCache
+
+
+REGISTRY = {
+    "lock_front": {"type": "lock", "room": "hall"},
+    "thermostat_living": {"type": "thermostat", "room": "living"},
+}
+SNAPSHOT = {"devices": {
+    "lock_front": {"state": "LOCKED"},
+    "thermostat_living": {"current": 21.5, "target": 22},
+}}
+
+
+@pytest.fixture
+def cache():
+    c = ResponseCache(fast_path=True)
+    c.bind(object(), REGISTRY)
+    return c
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Is the front door locked?", "lock_front (hall): заперт"),
+    ("Заперта ли дверь?", "lock_front (hall): заперт"),
+    ("Какая температура в living?", "thermostat_living (living): 21.5 °C, цель 22 °C"),
+    ("What is the thermostat temperature?", "thermostat_living (living): 21.5 °C, цель 22 °C"),
+])
+def test_status_reads_are_answered_from_the_snapshot(cache, query, expected):
+    assert cache.fast_answer(query, SNAPSHOT) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "Can you lock the front door?",
+    "Можешь запереть дверь?",
+    "How do I set the thermostat schedule?",
+    "Could you unlock the door?",
+    "Why is the temperature so low?",
+    "Почему не заперта дверь?",
+    "Как настроить температуру?",
+    "Lock the front door",
+    "Запри дверь",
+])
+def test_actions_and_instructions_go_to_the_model(cache, query):
+    assert cache.fast_answer(query, SNAPSHOT) is None
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from app.integration import stream_relay as sr
+
+
+def _segment(marker: int, body: bytes) -> bytes:
+    return bytes([0xFF, marker]) + (len(body) + 2).to_bytes(2, "big") + body
+
+
+def _jpeg(n: int) -> bytes:
+    # a camera frame with an EXIF thumbnail: a whole SOI...EOI nested inside APP1
+    thumb = sr.SOI + _segment(0xDB, b"\x00" * 8) + _segment(0xDA, b"\x01") + b"thumb" + sr.EOI
+    exif = _segment(0xE1, b"Exif\x00\x00" + thumb)
+    # scan data is byte-stuffed (FF00) and carries restart markers, never a bare FFD9
+    scan = _segment(0xDA, b"\x01") + bytes([n]) * 64 + b"\xff\x00\xff\xd0" + bytes([n]) * 64
+    return sr.SOI + _segment(0xE0, b"JFIF\x00") + exif + _segment(0xDB, b"\x00" * 8) + scan + sr.EOI
+
+
+def _multipart(frames, content_length: bool) -> bytes:
+    out = b""
+    for jpeg in frames:
+        out += b"--cam\r\nContent-Type: image/jpeg\r\n"
+        if content_length:
+            out += b"Content-Length: %d\r\n" % len(jpeg)
+        out += b"\r\n" + jpeg + b"\r\n"
+    return out
+
+
+def _split(stream: bytes, chunk: int):
+    buf, frames = bytearray(), []
+    for i in range(0, len(stream), chunk):
+        buf += stream[i:i + chunk]
+        while (frame := sr._next_frame(buf, 1 << 20)) is not None:
+            frames.append(frame)
+    return frames
+
+
+@pytest.mark.parametrize("content_length", [True, False])
+@pytest.mark.parametrize("chunk", [1, 7, 4096])
+def test_frames_with_embedded_thumbnail_are_kept_whole(content_length, chunk):
+    frames = [_jpeg(n) for n in range(1, 4)]
+    assert _split(_multipart(frames, content_length), chunk) == frames
+
+
+def test_content_length_wins_over_markers():
+    # the declared body is used as is, even when the image bytes would fool a marker scan
+    jpeg = sr.SOI + b"\x00" * 16 + sr.EOI + b"tail" + sr.EOI
+    assert _split(_multipart([jpeg], True), 5) == [jpeg]
+
+
+def test_oversized_frame_without_end_is_dropped():
+    buf = bytearray(sr.SOI + _segment(0xE0, b"JFIF\x00") + _segment(0xDA, b"\x01") + b"\x00" * 64)
+    assert sr._next_frame(buf, 32) is None
+    assert buf == bytearray()
+
+
+def test_relay_reads_upstream_mjpeg(tmp_path):
+    async def run():
+        frames = [_jpeg(n) for n in range(1, 4)]
+
+        async def handler(request):
+            resp = web.StreamResponse(headers={"Content-Type": "multipart/x-mixed-replace; boundary=cam"})
+            await resp.prepare(request)
+            body = _multipart(frames, True)
+            for i in range(0, len(body), 50):
+                await resp.write(body[i:i + 50])
+            await asyncio.Event().wait()
+            return resp
+
+        app = web.Application()
+        app.router.add_get("/{id}.mjpeg", handler)
+        runner = web.AppRunner(app, handler_cancellation=True)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        relay = sr.StreamRelay(store=None, mjpeg_url=f"http://127.0.0.1:{port}/{{id}}.mjpeg", client_buffer=8)
+        try:
+            stream = relay.subscribe("cam_1")
+            got = [await asyncio.wait_for(stream.__anext__(), 2.0) for _ in frames]
+            assert got == [sr._part(f) for f in frames]
+            await stream.aclose()
+        finally:
+            await relay.stop()
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from app.llm.vision_jobs import VisionJobAborted, VisionJobQueue
+
+
+def test_stop_fails_running_and_queued_jobs():
+    async def run():
+        started = asyncio.Event()
+
+        async def runner(camera_id, prompt):
+            started.set()
+            await asyncio.Event().wait()
+
+        q = VisionJobQueue(runner=runner, workers=1)
+        await q.start()
+        running = q.submit("cam_1", "p")
+        queued = q.submit("cam_2", "p")
+        waiters = [asyncio.ensure_future(q.wait(job)) for job in (running, queued)]
+        await started.wait()
+        await q.stop()
+        results = await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 1.0)
+        assert all(isinstance(r, VisionJobAborted) for r in results)
+        assert running.status == queued.status == "error"
+
+    asyncio.run(run())
+
+
+def test_runner_cancelled_error_fails_job_and_keeps_worker():
+    async def run():
+        calls = []
+
+        async def runner(camera_id, prompt):
+            calls.append(camera_id)
+            if camera_id == "cam_1":
+                raise asyncio.CancelledError()
+            return {"ok": camera_id}
+
+        q = VisionJobQueue(runner=runner, workers=1)
+        await q.start()
+        with pytest.raises(VisionJobAborted):
+            await q.wait(q.submit("cam_1", "p"), timeout=1.0)
+        # the same worker picks up the next job
+        assert await q.wait(q.submit("cam_2", "p"), timeout=1.0) == {"ok": "cam_2"}
+        await q.stop()
+
+    asyncio.run(run())
+
+
+def test_wait_timeout_leaves_job_running():
+    async def run():
+        release = asyncio.Event()
+
+        async def runner(camera_id, prompt):
+            await release.wait()
+            return "done"
+
+        q = VisionJobQueue(runner=runner, workers=1)
+        await q.start()
+        job = q.submit("cam_1", "p")
+        with pytest.raises(asyncio.TimeoutError):
+            await q.wait(job, timeout=0.05)
+        release.set()
+        assert await q.wait(job, timeout=1.0) == "done"
+        await q.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.llm import vision
+from app.llm.frame_gate import FrameGate
+from app.llm.vision_cache import VisionCache
+from app.tools.smarthome import SmartHomeTools
+
+
+MAX_LAG_MS = 50.0
+CONCURRENCY = 8
+
+
+class _Snapshots:
+    enabled = False
+
+    async def fetch(self, device_id: str) -> bytes:
+        # distinct bytes per camera so neither the vision cache nor the frame gate short-circuits
+        return os.urandom(4096)
+
+
+@pytest.fixture
+def slow_providers(monkeypatch):
+    async def api_key(image, features):
+        # REST without a key: slow, then fall through to the SDK
+        await asyncio.sleep(0.05)
+        return None
+
+    def sdk(image, features):
+        # the SDK is synchronous; it blocks whichever thread runs it
+        time.sleep(0.2)
+        return {"labelAnnotations": [{"description": "person"}], "localizedObjectAnnotations": [], "fullTextAnnotation": {"text": ""}}
+
+    async def gemini(model, api_key, image, mime, prompt):
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setattr(vision, "_gv_annotate_api_key", api_key)
+    monkeypatch.setattr(vision, "_gv_annotate_sdk", sdk)
+    monkeypatch.setattr(vision, "_gemini_rest", gemini)
+    # module-level state is bound to the loop that first used it
+    monkeypatch.setattr(vision, "_semaphores", {})
+    monkeypatch.setattr(vision, "vision_cache", VisionCache(phash=False))
+    # as on_startup does: the first cv2 import would otherwise hold the GIL inside a worker thread
+    vision.preload()
+
+
+async def _max_lag_ms(work) -> float:
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker() -> None:
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append((time.perf_counter() - t0) * 1000 - 5.0)
+
+    tick = asyncio.create_task(ticker())
+    try:
+        await work
+    finally:
+        stop.set()
+        await tick
+    return max(lags)
+
+
+def test_gv_annotate_keeps_loop_responsive(slow_providers):
+    async def run():
+        images = [os.urandom(2048) for _ in range(CONCURRENCY)]
+        work = asyncio.gather(*(vision.gv_annotate(img) for img in images))
+        return await _max_lag_ms(work), await work
+
+    lag, results = asyncio.run(run())
+    assert all(r["labels"] == ["person"] for r in results)
+    assert lag < MAX_LAG_MS
+
+
+def test_analyze_snapshot_keeps_loop_responsive(slow_providers, monkeypatch):
+    monkeypatch.setattr("app.llm.frame_gate.frame_gate", FrameGate(enabled=False))
+    tools = SmartHomeTools(mqtt=None, devices={})
+    tools.snapshots = _Snapshots()
+
+    async def run():
+        work = asyncio.gather(*(tools.analyze_snapshot(f"cam_{i}", "кто в кадре") for i in range(CONCURRENCY)))
+        return await _max_lag_ms(work), await work
+
+    lag, results = asyncio.run(run())
+    assert all(r["analysis"] == "ok" and r["facts"]["gv_labels"] == ["person"] for r in results)
+    assert lag < MAX_LAG_MS
@@ -1,6 +1,6 @@
 import React from 'react'
 
-type Msg = { role: 'user' | 'assistant', content: string }
+type Msg = { role: 'user' | 'assistant' | 'action', content: string }
 
 export function ChatPanel() {
   const [msgs, setMsgs] = React.useState<Msg[]>([])
@@ -14,15 +14,26 @@ export function ChatPanel() {
     const url = (import.meta as any).env.VITE_API_BASE + '/chat/stream?q=' + encodeURIComponent(q)
     const es = new EventSource(url)
     es.addEventListener('chunk', (e) => {
-      const data = (e as MessageEvent).data as string
+      const text = JSON.parse((e as MessageEvent).data as string).text
       setMsgs((m) => {
-        const last = m[m.length - 1]
-        if (last && last.role === 'assistant') {
-          return [...m.slice(0, -1), { role: 'assistant', content: last.content + JSON.parse(data).text }]
+        // action progress may land mid-answer; keep appending to this turn's assistant bubble
+        const lastUser = m.map((x) => x.role).lastIndexOf('user')
+        const idx = m.map((x) => x.role).lastIndexOf('assistant')
+        if (idx > lastUser) {
+          return [...m.slice(0, idx), { role: 'assistant', content: m[idx].content + text }, ...m.slice(idx + 1)]
         }
-        return [...m, { role: 'assistant', content: JSON.parse(data).text }]
+        return [...m, { role: 'assistant', content: text }]
       })
     })
+    es.addEventListener('action', (e) => {
+      const a = JSON.parse((e as MessageEvent).data as string)
+      const content = a.phase === 'error'
+        ? '[Ошибка при выполнении действий] ' + a.error
+        : a.phase === 'step'
+          ? '[Шаг] ' + a.tool + ': ' + a.status
+          : (a.phase === 'planned' ? '[Действия] запланировано: ' : '[Выполнено] ') + a.steps.map((s: any) => s.tool + (s.status ? ':' + s.status : '')).join(', ')
+      setMsgs((m) => [...m, { role: 'action', content }])
+    })
     es.addEventListener('done', () => es.close())
   }
   return (
@@ -31,7 +42,7 @@ export function ChatPanel() {
       <div className="flex-1 overflow-auto space-y-2 mt-2">
         {msgs.map((m, i) => (
           <div key={i} className={m.role === 'user' ? 'text-right' : 'text-left'}>
-            <span className={"inline-block px-2 py-1 rounded " + (m.role==='user'?'bg-blue-100':'bg-neutral-100')}>{m.content}</span>
+            <span className={"inline-block px-2 py-1 rounded " + (m.role==='user'?'bg-blue-100':m.role==='action'?'text-xs text-neutral-500':'bg-neutral-100')}>{m.content}</span>
           </div>
         ))}
       </div>